@@ -1,6 +1,7 @@
 """
 Execute a callable from ExtensionCustomAction event listener
 """
+import threading
 from collections import OrderedDict
 from typing import Any, Hashable, Callable
 from ulauncher.api.client.EventListener import EventListener
@@ -35,25 +36,30 @@ class LRU(OrderedDict):
 
 class Cache:
     """
-    Simple dict-like cache with 'add' and 'get' operations
+    Simple dict-like cache with 'add' and 'get' operations.
+    Thread-safe: results are built in a worker thread (see `debounce`),
+    while items are entered from Ulauncher's event thread.
     """
 
     def __init__(self):
         self.cache = LRU(maxsize=128)
+        self.lock = threading.Lock()
 
     def add(self, item: Any) -> Hashable:
         """
         Add item to the cache and return the key by which it can be retrieved later
         """
         key = id(item)
-        self.cache[key] = item
+        with self.lock:
+            self.cache[key] = item
         return key
 
     def get(self, key: Hashable) -> Any:
         """
         Retrieve item given its key or return None if not found
         """
-        return self.cache.get(key, None)
+        with self.lock:
+            return self.cache.get(key, None)
 
 
 _CALLABLE_CACHE = Cache()
@@ -0,0 +1,174 @@
+"""
+Headless command line interface to note search
+
+Useful for profiling and scripting the search engine without Ulauncher:
+
+    python -m notesnv.cli ~/notes "py chea"
+    python -m notesnv.cli ~/notes "py chea" --ext txt,md --json
+    python -m notesnv.cli ~/notes "py chea" --repeat 20 --timing
+    python -m notesnv.cli ~/notes "cafe" --index --ignore-accents --timing
+    python -m notesnv.cli ~/notes "py chea" --repeat 20 --timing --jobs 1
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, TextIO
+
+from .search import search_notes, SearchError, SearchResultItem, MAX_GREP_JOBS
+from .index import NoteIndex
+
+
+DEFAULT_EXTENSIONS = "txt,md"
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m notesnv.cli", description="Search notes from the terminal"
+    )
+    parser.add_argument("path", help="path to the notes directory")
+    parser.add_argument("query", help="search query")
+    parser.add_argument(
+        "--ext",
+        default=DEFAULT_EXTENSIONS,
+        help="comma-separated list of note file extensions "
+        f"(default: {DEFAULT_EXTENSIONS})",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=0, help="print at most this many results"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="run the search this many times"
+    )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="report per-stage latencies to stderr",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="build the in-memory index first and search it instead of "
+        "walking the directory and calling grep",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=0,
+        help="index memory budget in megabytes (implies --index)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="number of grep processes searching in parallel without the index "
+        f"(default: one per CPU, up to {MAX_GREP_JOBS})",
+    )
+    parser.add_argument(
+        "--ignore-accents",
+        action="store_true",
+        help="ignore diacritics when searching (implies --index)",
+    )
+    return parser.parse_args(argv)
+
+
+def print_results(matches: List[SearchResultItem], as_json: bool, out: TextIO) -> None:
+    """
+    Print search results, one per line or as a JSON list
+    """
+    if as_json:
+        json.dump([m._asdict() for m in matches], out, indent=2)
+        print(file=out)
+        return
+    for match in matches:
+        if match.match_summary:
+            print(f"{match.filename}\t{match.match_summary}", file=out)
+        else:
+            print(match.filename, file=out)
+
+
+def print_timings(runs: List[Dict[str, float]], out: TextIO) -> None:
+    """
+    Summarize per-stage latencies across all runs, in milliseconds
+    """
+    print(f"{'stage':<10} {'min':>9} {'median':>9} {'mean':>9} {'max':>9}", file=out)
+    for stage in runs[0]:
+        values = [run[stage] * 1000 for run in runs]
+        print(
+            f"{stage:<10} {min(values):>9.2f} {statistics.median(values):>9.2f} "
+            f"{statistics.mean(values):>9.2f} {max(values):>9.2f}",
+            file=out,
+        )
+    print(f"({len(runs)} run{'s' if len(runs) != 1 else ''}, ms)", file=out)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run the search and print results. Returns process exit code.
+    """
+    args = parse_args(argv)
+    file_exts = args.ext.replace(" ", "").split(",")
+
+    index = None
+    index_build_time = 0.0
+    if args.index or args.ignore_accents or args.memory_budget:
+        start = time.perf_counter()
+        index = NoteIndex(
+            os.path.expanduser(args.path),
+            file_exts,
+            args.ignore_accents,
+            int(args.memory_budget * 1024 * 1024) if args.memory_budget else None,
+        )
+        index.build()
+        index_build_time = time.perf_counter() - start
+
+    runs = []
+    matches: List[SearchResultItem] = []
+    for _ in range(max(1, args.repeat)):
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        try:
+            matches = search_notes(
+                args.path,
+                file_exts,
+                args.query,
+                timings=timings,
+                index=index,
+                jobs=args.jobs or None,
+            )
+        except SearchError as exc:
+            print(f"{exc.message}: {exc.details}", file=sys.stderr)
+            return 1
+        timings["total"] = time.perf_counter() - start
+        runs.append(timings)
+
+    if args.limit > 0:
+        matches = matches[: args.limit]
+    print_results(matches, args.json, sys.stdout)
+
+    if args.timing:
+        if index is not None:
+            print(
+                f"index build: {index_build_time * 1000:.2f} ms, {len(index)} notes",
+                file=sys.stderr,
+            )
+            footprint = ", ".join(
+                f"{part} {size / 1024:.0f}"
+                for part, size in index.memory_footprint().items()
+            )
+            print(
+                f"index memory: {index.memory_used() / 1024:.0f} KiB ({footprint})",
+                file=sys.stderr,
+            )
+        print_timings(runs, sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
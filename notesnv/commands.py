@@ -0,0 +1,148 @@
+"""
+Commands run on a note selected in the results (see `NotesNv.list_commands`)
+"""
+import os
+from typing import Callable, List, Tuple, TYPE_CHECKING
+from ulauncher.api.shared.item.ResultItem import ResultItem
+from ulauncher.api.shared.item.ExtensionResultItem import ExtensionResultItem
+from ulauncher.api.shared.action.BaseAction import BaseAction
+from ulauncher.api.shared.action.RenderResultListAction import (
+    RenderResultListAction,
+)
+from .callable_action import callable_action
+from .items import (
+    MAX_RESULTS_VISIBLE,
+    INDEX_NOT_READY,
+    error_item,
+    line_item,
+    match_description,
+    message_item,
+    results_page,
+)
+from .peek import HeadCache
+from .search import SearchResultItem
+
+if TYPE_CHECKING:
+    from .extension import NotesNv  # noqa: F401
+
+
+class NoteCommands:
+    """
+    Peek at a note, and find notes related to it or linking to it
+    """
+
+    def __init__(self, notesnv: "NotesNv"):
+        self.notesnv = notesnv
+        self.heads = HeadCache()
+
+    def prefetch_heads(self, filenames: List[str]) -> None:
+        """
+        Read ahead the beginnings of the notes that are shown,
+        so that peeking at them doesn't wait for the disk
+        """
+        notes_path = self.notesnv.get_notes_path()
+        self.heads.prefetch(
+            [os.path.join(notes_path, fn) for fn in filenames[:MAX_RESULTS_VISIBLE]]
+        )
+
+    def peek_note(self, filename: str) -> BaseAction:
+        """
+        Show the first lines of the given note file
+        """
+        path = os.path.join(self.notesnv.get_notes_path(), filename)
+        try:
+            lines = self.heads.get(path)
+        except OSError as exc:
+            return RenderResultListAction(
+                [error_item("Could not read note file", exc.strerror)]
+            )
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return RenderResultListAction([message_item("Note is empty", filename)])
+        return RenderResultListAction(
+            [
+                line_item(
+                    line,
+                    callable_action(self.notesnv.open_note, path),
+                    callable_action(self.notesnv.list_commands, filename),
+                )
+                for line in lines
+            ]
+        )
+
+    def show_related_notes(self, filename: str) -> BaseAction:
+        """
+        Show notes about the same topic as the given note file
+        """
+        index = self.notesnv.indexes.ready()
+        if index is None:
+            return RenderResultListAction([message_item(INDEX_NOT_READY)])
+        related = index.related(filename, MAX_RESULTS_VISIBLE)
+        if not related:
+            return RenderResultListAction(
+                [message_item("No related notes found", filename)]
+            )
+        return RenderResultListAction(
+            self.items_note_list(
+                [
+                    (note.filename, "Shares: " + ", ".join(note.shared_terms[:5]))
+                    for note in related
+                ]
+            )
+        )
+
+    def show_backlinks(self, filename: str) -> BaseAction:
+        """
+        Show notes that link to the given note file
+        """
+        index = self.notesnv.indexes.ready()
+        if index is None:
+            return RenderResultListAction([message_item(INDEX_NOT_READY)])
+        backlinks = index.backlinks(filename)
+        if not backlinks:
+            return RenderResultListAction(
+                [message_item("No notes link here", filename)]
+            )
+        return RenderResultListAction(
+            self.items_note_list([(fn, f"Links to {filename}") for fn in backlinks])
+        )
+
+    @staticmethod
+    def items_note_command(
+        matches: List[SearchResultItem],
+        label: str,
+        command: Callable[[str], BaseAction],
+        offset: int = 0,
+    ) -> List[ResultItem]:
+        """
+        Search result items that run a command on the selected note
+        """
+        items = []
+        for match in results_page(matches, offset):
+            item = ExtensionResultItem(
+                icon="images/note.svg",
+                name=f"{label}: {match.filename}",
+                description=match_description(match),
+                on_enter=callable_action(command, match.filename),
+            )
+            items.append(item)
+        return items
+
+    def items_note_list(self, notes: List[Tuple[str, str]]) -> List[ResultItem]:
+        """
+        Result items that open notes, given their filenames and descriptions
+        """
+        notes_path = self.notesnv.get_notes_path()
+        return [
+            ExtensionResultItem(
+                icon="images/note.svg",
+                name=filename,
+                description=description,
+                on_enter=callable_action(
+                    self.notesnv.open_note, os.path.join(notes_path, filename)
+                ),
+                on_alt_enter=callable_action(self.notesnv.list_commands, filename),
+                highlightable=False,
+            )
+            for filename, description in notes
+        ]
@@ -0,0 +1,184 @@
+"""
+Compressed note files
+
+Notes can be archived compressed, as `Note.md.gz` (or `Note.md.zst`,
+if the optional `zstandard` package is installed). `grep` can't search
+them, so they are decompressed (streaming, and at most
+`MAX_DECOMPRESSED_SIZE` of text) and searched in Python instead.
+Decompressed text is kept in a cache, checked against the file's
+modification time and size, so that every query doesn't decompress
+them again.
+"""
+import gzip
+import io
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack
+from typing import BinaryIO, List, NamedTuple, Tuple, Type
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+
+GZIP_SUFFIX = ".gz"
+ZSTD_SUFFIX = ".zst"
+
+# Only this much of a compressed note is read, same as the size limit
+# of plain text notes (`ignore.MAX_NOTE_SIZE`)
+MAX_DECOMPRESSED_SIZE = 8 * 1024 * 1024
+
+# Total size of decompressed text to keep
+MAX_CACHED_TEXT = 32 * 1024 * 1024
+
+# Raised when reading corrupt compressed files
+DECOMPRESSION_ERRORS: Tuple[Type[Exception], ...] = (
+    EOFError,
+    ValueError,
+    zlib.error,
+) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def compression_suffixes() -> Tuple[str, ...]:
+    """
+    Suffixes of compressed files that can be read
+    """
+    return (GZIP_SUFFIX, ZSTD_SUFFIX) if zstandard else (GZIP_SUFFIX,)
+
+
+def is_compressed(path: str) -> bool:
+    """
+    Whether the file name has a compression suffix
+
+    >>> is_compressed("old/Meeting.md.gz"), is_compressed("Meeting.md")
+    (True, False)
+    """
+    return path.lower().endswith(compression_suffixes())
+
+
+def split_compressed(files: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Plain text and compressed files
+
+    >>> split_compressed(["a.md", "b.md.gz", "c.txt"])
+    (['a.md', 'c.txt'], ['b.md.gz'])
+    """
+    suffixes = compression_suffixes()
+    plain: List[str] = []
+    compressed: List[str] = []
+    for fn in files:
+        (compressed if fn.lower().endswith(suffixes) else plain).append(fn)
+    return plain, compressed
+
+
+def strip_compression_suffix(path: str) -> str:
+    """
+    File name without compression suffix, if it has one
+
+    >>> strip_compression_suffix("old/Meeting.md.GZ")
+    'old/Meeting.md'
+    """
+    if is_compressed(path):
+        return os.path.splitext(path)[0]
+    return path
+
+
+def open_note_file(path: str) -> BinaryIO:
+    """
+    Open note file for reading bytes, decompressing on the fly
+    if it's compressed. Raises OSError.
+    """
+    if not is_compressed(path):
+        return open(path, "rb")
+    if path.lower().endswith(ZSTD_SUFFIX):
+        with ExitStack() as on_error:
+            f = on_error.enter_context(open(path, "rb"))
+            reader = zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+            # The reader owns the file from here on
+            on_error.pop_all()
+        return io.BufferedReader(reader)
+    return gzip.open(path, "rb")  # type: ignore
+
+
+def decompress_note(path: str) -> str:
+    """
+    Text of a compressed note, up to `MAX_DECOMPRESSED_SIZE` bytes of it.
+    Raises OSError, also if the file isn't validly compressed.
+    """
+    try:
+        with open_note_file(path) as f:
+            data = f.read(MAX_DECOMPRESSED_SIZE)
+    except DECOMPRESSION_ERRORS as exc:
+        raise OSError(str(exc)) from exc
+    return data.decode("utf-8", errors="replace")
+
+
+class CachedText(NamedTuple):
+    """
+    Decompressed text, and mtime and size of the file when it was read
+    """
+
+    mtime: float
+    size: int
+    text: str
+
+
+class DecompressedCache:
+    """
+    Least recently used decompressed texts, keyed by full path
+    """
+
+    def __init__(self, max_chars: int = MAX_CACHED_TEXT):
+        self.max_chars = max_chars
+        self.texts: "OrderedDict[str, CachedText]" = OrderedDict()
+        self.chars = 0
+        self.lock = threading.Lock()
+
+    def get(self, path: str) -> str:
+        """
+        Text of the compressed note file, decompressing it only
+        if it changed since last time. Raises OSError.
+        """
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.texts.get(path)
+            if (
+                cached is not None
+                and cached.mtime == stat.st_mtime
+                and cached.size == stat.st_size
+            ):
+                self.texts.move_to_end(path)
+                return cached.text
+        text = decompress_note(path)
+        with self.lock:
+            old = self.texts.pop(path, None)
+            if old is not None:
+                self.chars -= len(old.text)
+            self.texts[path] = CachedText(stat.st_mtime, stat.st_size, text)
+            self.chars += len(text)
+            while self.chars > self.max_chars and len(self.texts) > 1:
+                _, evicted = self.texts.popitem(last=False)
+                self.chars -= len(evicted.text)
+        return text
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+_DECOMPRESSED_CACHE = DecompressedCache()
+
+
+def read_note_text(path: str, cached: bool = True) -> str:
+    """
+    Text of a note file, compressed or not. Decompressed text
+    is served from the cache, unless `cached` is off. Raises OSError.
+    """
+    if is_compressed(path):
+        if cached:
+            return _DECOMPRESSED_CACHE.get(path)
+        return decompress_note(path)
+    with open(path, "rt", encoding="utf-8", errors="replace") as f:
+        return f.read()
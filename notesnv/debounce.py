@@ -0,0 +1,135 @@
+"""
+Coalescing of queries typed faster than they can be searched
+
+Ulauncher sends a query on every keystroke. Rather than searching each one
+in turn, queries are handed to a single worker thread that only runs the
+most recent one: queries replaced before they started are dropped,
+and results of queries replaced while they ran are discarded.
+
+Before running a query, the worker waits for a debounce window without
+newer keystrokes. The window is proportional to how long recent searches
+took, so that it adds next to nothing when searches are fast and merges
+bursts of keystrokes when they are slow.
+"""
+import logging
+import threading
+import time
+from typing import Callable, NamedTuple, Optional, Tuple
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Debounce window before any search has been timed
+INITIAL_DEBOUNCE = 0.1
+
+# Upper bound of the debounce window
+MAX_DEBOUNCE = 0.3
+
+# Debounce window as a fraction of recent search latency
+DEBOUNCE_LATENCY_SHARE = 0.5
+
+# Weight of the latest search in the smoothed latency
+LATENCY_SMOOTHING = 0.3
+
+
+def debounce_window(latency: Optional[float]) -> float:
+    """
+    How long to wait for more keystrokes, given smoothed search latency
+
+    >>> debounce_window(0.008), debounce_window(0.2), debounce_window(5)
+    (0.004, 0.1, 0.3)
+    """
+    if latency is None:
+        return INITIAL_DEBOUNCE
+    return min(MAX_DEBOUNCE, latency * DEBOUNCE_LATENCY_SHARE)
+
+
+class QueryTask(NamedTuple):
+    """
+    Query waiting to be run. `run` is given a function that tells
+    whether a newer query has arrived since.
+    """
+
+    run: Callable[[Callable[[], bool]], None]
+    debounced: bool
+
+
+# pylint: disable=too-few-public-methods
+class QueryCoalescer:
+    """
+    Worker thread that runs the latest submitted query
+    """
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.condition = threading.Condition()
+        self.pending: Optional[QueryTask] = None
+        self.generation = 0
+        self.last_submitted = 0.0
+        self.latency: Optional[float] = None
+        self.thread: Optional[threading.Thread] = None
+        self.metrics.debounce_window = debounce_window(None)
+
+    def submit(
+        self, run: Callable[[Callable[[], bool]], None], debounced: bool = True
+    ) -> None:
+        """
+        Run query in the worker thread, replacing the one that's waiting, if any.
+        Queries that aren't `debounced` start as soon as the worker is free.
+        """
+        with self.condition:
+            if self.pending is not None:
+                self.metrics.count("dropped")
+            self.pending = QueryTask(run, debounced)
+            self.generation += 1
+            self.last_submitted = time.perf_counter()
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._work, name="notesnv-queries", daemon=True
+                )
+                self.thread.start()
+            self.condition.notify()
+
+    def _next_task(self) -> Tuple[QueryTask, int]:
+        """
+        Wait for a query, and for the debounce window to pass without newer ones
+        """
+        with self.condition:
+            while True:
+                while self.pending is None:
+                    self.condition.wait()
+                delay = 0.0
+                if self.pending.debounced:
+                    delay = (
+                        self.last_submitted
+                        + self.metrics.debounce_window
+                        - time.perf_counter()
+                    )
+                if delay <= 0:
+                    task = self.pending
+                    self.pending = None
+                    return task, self.generation
+                self.condition.wait(delay)
+
+    def _work(self) -> None:
+        while True:
+            task, generation = self._next_task()
+            self._run(task, generation)
+
+    def _run(self, task: QueryTask, generation: int) -> None:
+        started = time.perf_counter()
+        try:
+            task.run(lambda: self.generation != generation)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Query failed")
+            self.metrics.count("errors")
+            return
+        if task.debounced:
+            self._record_latency(time.perf_counter() - started)
+
+    def _record_latency(self, seconds: float) -> None:
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+        self.metrics.debounce_window = debounce_window(self.latency)
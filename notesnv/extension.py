@@ -1,53 +1,93 @@
 """
 Notes search Ulauncher extension inspired by NotationalVelocity
+
+Startup is kept short: Gtk (via the clipboard) and Ulauncher action classes
+that pull it in are only imported when they are first needed,
+and the note index is built in a background thread.
 """
-import os
-import re
-import subprocess
-from typing import Optional, List
-from ulauncher.api.client.Extension import Extension
-from ulauncher.api.client.EventListener import EventListener
-from ulauncher.api.shared.event import KeywordQueryEvent, ItemEnterEvent
-from ulauncher.api.shared.item.ResultItem import ResultItem
-from ulauncher.api.shared.item.ExtensionResultItem import ExtensionResultItem
-from ulauncher.api.shared.item.ExtensionSmallResultItem import ExtensionSmallResultItem
-from ulauncher.api.shared.action.BaseAction import BaseAction
-from ulauncher.api.shared.action.RenderResultListAction import RenderResultListAction
-from ulauncher.api.shared.action.DoNothingAction import DoNothingAction
-from ulauncher.api.shared.action.OpenAction import OpenAction
-from ulauncher.api.shared.action.CopyToClipboardAction import CopyToClipboardAction
-
-from .callable_action import callable_action, CallableEventListener
-from .search import (
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+# pylint: disable=wrong-import-position
+import io  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+import re  # noqa: E402
+import subprocess  # noqa: E402
+from typing import Optional, List, Dict, Callable  # noqa: E402
+from ulauncher.api.client.Extension import Extension  # noqa: E402
+from ulauncher.api.client.EventListener import EventListener  # noqa: E402
+from ulauncher.api.shared.event import (  # noqa: E402
+    KeywordQueryEvent,
+    ItemEnterEvent,
+    PreferencesEvent,
+    PreferencesUpdateEvent,
+)
+from ulauncher.api.shared.Response import Response  # noqa: E402
+from ulauncher.api.shared.item.ResultItem import ResultItem  # noqa: E402
+from ulauncher.api.shared.item.ExtensionResultItem import (  # noqa: E402
+    ExtensionResultItem,
+)
+from ulauncher.api.shared.action.BaseAction import BaseAction  # noqa: E402
+from ulauncher.api.shared.action.RenderResultListAction import (  # noqa: E402
+    RenderResultListAction,
+)
+from ulauncher.api.shared.action.DoNothingAction import DoNothingAction  # noqa: E402
+
+from .callable_action import callable_action, CallableEventListener  # noqa: E402
+from .search import (  # noqa: E402
     search_notes,
     contains_filename_match,
     SearchError,
     ls_dir,
     SearchResultItem,
 )
-from .cmd_arg_utils import argbuild
-from . import query_command
-from .clipboard import GtkClipboard
+from .compressed import read_note_text  # noqa: E402
+from .debounce import QueryCoalescer  # noqa: E402
+from .items import (  # noqa: E402
+    MAX_RESULTS_VISIBLE,
+    error_item,
+    match_description,
+    results_page,
+)
+from .warmup import IndexWarmup  # noqa: E402
+from .commands import NoteCommands  # noqa: E402
+from .pages import ResultCursor, ResultPages  # noqa: E402
+from .stats import stats_items  # noqa: E402
+from .profiling import (  # noqa: E402
+    SlowQueryProfiler,
+    profiled,
+    default_profiles_dir,
+)
+from .metrics import Metrics  # noqa: E402
+from .cmd_arg_utils import argbuild  # noqa: E402
+from . import query_command  # noqa: E402
+
 
+logger = logging.getLogger(__name__)
 
-MAX_RESULTS_VISIBLE = 10
+# Seconds since this module started importing:
+# - "import": module finished importing
+# - "init": extension object constructed
+# - "ready": note index built and serving queries
+STARTUP_TIMINGS: Dict[str, float] = {}
 
 
-def error_item(message: str, details: Optional[str] = None) -> ResultItem:
+def record_startup_timing(stage: str) -> None:
     """
-    Show small result item with error icon and a message.
+    Remember how long it took since import started to reach the given stage
     """
-    if not details:
-        return ExtensionSmallResultItem(
-            icon="images/error.svg", name=message, on_enter=DoNothingAction()
-        )
+    STARTUP_TIMINGS[stage] = time.perf_counter() - _IMPORT_STARTED
 
-    return ExtensionResultItem(
-        icon="images/error.svg",
-        name=message,
-        description=details,
-        on_enter=DoNothingAction(),
-    )
+
+def record_index_ready() -> None:
+    """
+    Log startup timings once the first note index is ready
+    """
+    if "ready" not in STARTUP_TIMINGS:
+        record_startup_timing("ready")
+        logger.info("Startup timings: %s", STARTUP_TIMINGS)
 
 
 def note_filename_from_query(fn: str) -> str:
@@ -72,7 +112,42 @@ class NotesNv:
 
     def __init__(self, preferences):
         self.preferences = preferences
-        self.clipboard = GtkClipboard()
+        self._clipboard = None
+        self.indexes = IndexWarmup(self, on_ready=record_index_ready)
+        self.commands = NoteCommands(self)
+        self.pages = ResultPages(self)
+        self.metrics = Metrics()
+        self.profiler: Optional[SlowQueryProfiler] = None
+
+    @property
+    def clipboard(self):
+        """
+        Gtk clipboard, created on first use because importing Gtk is slow
+        """
+        if self._clipboard is None:
+            # pylint: disable=import-outside-toplevel
+            from .clipboard import GtkClipboard
+
+            self._clipboard = GtkClipboard()
+        return self._clipboard
+
+    def has_preferences(self) -> bool:
+        """
+        Whether Ulauncher has sent us the preferences yet
+        """
+        return "notes-directory-path" in self.preferences
+
+    def configure_profiler(self) -> None:
+        """
+        Turn slow query profiling on or off according to preferences
+        """
+        threshold_ms = self.get_number_preference("slow-query-threshold")
+        if threshold_ms:
+            self.profiler = SlowQueryProfiler(
+                threshold_ms / 1000, default_profiles_dir()
+            )
+        else:
+            self.profiler = None
 
     def get_notes_path(self) -> str:
         """
@@ -90,6 +165,21 @@ class NotesNv:
             exts = "txt,md"
         return exts.replace(" ", "").split(",")
 
+    def get_number_preference(self, pref_id: str) -> float:
+        """
+        Numeric preference, 0 if empty or not a number
+        """
+        try:
+            return max(0.0, float(self.preferences.get(pref_id) or 0))
+        except ValueError:
+            return 0.0
+
+    def get_progressive_results(self) -> bool:
+        """
+        Whether to show title matches before content search is done
+        """
+        return self.preferences.get("progressive-results", "yes") != "no"
+
     def can_be_new_note_title(
         self, query_arg: str, query_matches: List[SearchResultItem]
     ) -> bool:
@@ -142,17 +232,17 @@ class NotesNv:
         )
 
     def items_open_note_command(
-        self, matches: List[SearchResultItem], query: str
+        self, matches: List[SearchResultItem], query: str, offset: int = 0
     ) -> List[ResultItem]:
         """
         Search result items for the "open note" command
         """
         items = []
-        for match in matches[:MAX_RESULTS_VISIBLE]:
+        for match in results_page(matches, offset):
             item = ExtensionResultItem(
                 icon="images/note.svg",
                 name=match.filename,
-                description=match.match_summary,
+                description=match_description(match),
                 on_enter=callable_action(
                     self.open_note, os.path.join(self.get_notes_path(), match.filename)
                 ),
@@ -162,7 +252,7 @@ class NotesNv:
 
         # If the search query looks like a new unique note title,
         # offer to create the note
-        if self.can_be_new_note_title(query, matches):
+        if offset == 0 and self.can_be_new_note_title(query, matches):
             fn = self.new_note_filename(query)
             items.append(self.item_create_empty_note(fn))
             items.append(self.item_create_note_from_clipboard(fn))
@@ -170,17 +260,17 @@ class NotesNv:
         return items
 
     def items_copy_note_command(
-        self, matches: List[SearchResultItem]
+        self, matches: List[SearchResultItem], offset: int = 0
     ) -> List[ResultItem]:
         """
         Search result items for the "copy to clipboard" command
         """
         items = []
-        for match in matches[:MAX_RESULTS_VISIBLE]:
+        for match in results_page(matches, offset):
             item = ExtensionResultItem(
                 icon="images/copy-note.svg",
                 name=f"Copy: {match.filename}",
-                description=match.match_summary,
+                description=match_description(match),
                 on_enter=callable_action(
                     self.copy_note, os.path.join(self.get_notes_path(), match.filename)
                 ),
@@ -188,28 +278,63 @@ class NotesNv:
             items.append(item)
         return items
 
-    def process_search_query(self, arg: str) -> BaseAction:
+    @profiled("search")
+    def process_search_query(
+        self, arg: str, send_partial: Optional[Callable[[BaseAction], None]] = None
+    ) -> BaseAction:
         """
         Show results that match user's query.
+
+        Without the index, content search with `grep` can take a while.
+        If `send_partial` is given, title matches are sent through it
+        as soon as they're found, and the returned action has all results.
         """
         qcmd = query_command.parse(arg)
 
+        if qcmd.cmd == "stats":
+            return RenderResultListAction(
+                stats_items(
+                    self.metrics,
+                    self.indexes.index,
+                    self.commands.heads,
+                    STARTUP_TIMINGS.get("ready"),
+                )
+            )
+
+        started = time.perf_counter()
+        first_result_time = None
+        index = self.indexes.ready()
+
+        def on_titles(title_matches: List[SearchResultItem]) -> None:
+            nonlocal first_result_time
+            if send_partial is not None:
+                send_partial(self.pages.render_matches(qcmd, title_matches))
+            first_result_time = time.perf_counter() - started
+
+        progressive = (
+            send_partial is not None
+            and index is None
+            and self.get_progressive_results()
+        )
         try:
             matches = search_notes(
                 self.get_notes_path(),
                 self.get_note_file_extensions(),
                 qcmd.search_query,
+                index=index,
+                on_titles=on_titles if progressive else None,
+                tags=qcmd.tags,
             )
         except SearchError as exc:
+            self.metrics.count("errors")
             return RenderResultListAction([error_item(exc.message, exc.details)])
+        self.metrics.record_search(time.perf_counter() - started, first_result_time)
 
-        if qcmd.cmd == "cp":
-            items = self.items_copy_note_command(matches)
-        else:
-            items = self.items_open_note_command(matches, qcmd.search_query)
-
-        return RenderResultListAction(items)
+        self.pages.cursor = ResultCursor(qcmd, matches)
+        self.commands.prefetch_heads([match.filename for match in matches])
+        return self.pages.render_matches(qcmd, matches)
 
+    @profiled("empty")
     def process_empty_query(self) -> BaseAction:
         """
         Show something if query is empty
@@ -219,6 +344,7 @@ class NotesNv:
                 self.get_notes_path(), self.get_note_file_extensions()
             )
         except SearchError as exc:
+            self.metrics.count("errors")
             return RenderResultListAction([error_item(exc.message, exc.details)])
 
         items = [
@@ -237,8 +363,10 @@ class NotesNv:
                     on_enter=callable_action(
                         self.open_note, os.path.join(self.get_notes_path(), fn)
                     ),
+                    on_alt_enter=callable_action(self.list_commands, fn),
                 )
             )
+        self.commands.prefetch_heads(recently_modified)
         return RenderResultListAction(items)
 
     def create_empty_note(self, path: str) -> BaseAction:
@@ -252,6 +380,7 @@ class NotesNv:
             return RenderResultListAction(
                 [error_item("Could not create note file", exc.strerror)]
             )
+        self.indexes.note_written(path)
         return self.open_note(path)
 
     def create_note_from_clipboard(self, path: str) -> BaseAction:
@@ -267,6 +396,7 @@ class NotesNv:
             return RenderResultListAction(
                 [error_item("Could not create note file", exc.strerror)]
             )
+        self.indexes.note_written(path)
         return self.open_note(path)
 
     def open_note(self, path: str) -> BaseAction:
@@ -276,6 +406,9 @@ class NotesNv:
         """
         cmd = self.preferences["open-note-command"]
         if not cmd:
+            # pylint: disable=import-outside-toplevel
+            from ulauncher.api.shared.action.OpenAction import OpenAction
+
             return OpenAction(path)
         args = argbuild(cmd, {"fn": path}, append_missing_field="fn")
         try:
@@ -288,11 +421,16 @@ class NotesNv:
 
     def copy_note(self, path: str) -> BaseAction:  # pylint: disable=no-self-use
         """
-        Copy the contents of note file into the clipboard
+        Copy the contents of note file into the clipboard.
+        Compressed notes are decompressed.
         """
-        with open(path, "rt") as f:
-            text = os.linesep.join(f.readlines())
-        return CopyToClipboardAction(text)
+        # pylint: disable=import-outside-toplevel
+        from ulauncher.api.shared.action.CopyToClipboardAction import (
+            CopyToClipboardAction,
+        )
+
+        lines = io.StringIO(read_note_text(path)).readlines()
+        return CopyToClipboardAction(os.linesep.join(lines))
 
     def list_commands(self, filename: str) -> BaseAction:
         """
@@ -310,6 +448,33 @@ class NotesNv:
                 highlightable=False,
             )
         )
+        items.append(
+            ExtensionResultItem(
+                icon="images/note.svg",
+                name="Peek at note",
+                description=filename,
+                on_enter=callable_action(self.commands.peek_note, filename),
+                highlightable=False,
+            )
+        )
+        items.append(
+            ExtensionResultItem(
+                icon="images/note.svg",
+                name="Show related notes",
+                description=filename,
+                on_enter=callable_action(self.commands.show_related_notes, filename),
+                highlightable=False,
+            )
+        )
+        items.append(
+            ExtensionResultItem(
+                icon="images/note.svg",
+                name="Show notes linking here",
+                description=filename,
+                on_enter=callable_action(self.commands.show_backlinks, filename),
+                highlightable=False,
+            )
+        )
         return RenderResultListAction(items)
 
 
@@ -323,6 +488,25 @@ class NotesNvExtension(Extension):
         self.notesnv = NotesNv(self.preferences)
         self.subscribe(KeywordQueryEvent, KeywordQueryEventListener(self.notesnv))
         self.subscribe(ItemEnterEvent, CallableEventListener())
+        preferences_listener = PreferencesEventListener(self.notesnv)
+        self.subscribe(PreferencesEvent, preferences_listener)
+        self.subscribe(PreferencesUpdateEvent, preferences_listener)
+        self.notesnv.configure_profiler()
+        record_startup_timing("init")
+        # Preferences may not have arrived yet,
+        # in which case PreferencesEventListener will start the warmup
+        self.notesnv.indexes.start()
+
+    def send_response(self, event: KeywordQueryEvent, action: BaseAction) -> None:
+        """
+        Send results for a query from any thread
+        """
+        # Ulauncher only sends actions that listeners return, and waiting
+        # for results in a listener would hold up its event thread, and with it
+        # newer keystrokes. The client's websocket serializes sends,
+        # so they can come from a worker thread.
+        # pylint: disable=protected-access
+        self._client.send(Response(event, action))
 
 
 # pylint: disable=too-few-public-methods
@@ -332,13 +516,70 @@ class KeywordQueryEventListener(EventListener):
     def __init__(self, notesnv):
         super(KeywordQueryEventListener, self).__init__()
         self.notesnv = notesnv
+        self.coalescer = QueryCoalescer(notesnv.metrics)
 
-    def on_event(self, event, extension) -> BaseAction:
+    def on_event(self, event, extension) -> None:
         """
         Handle keyword query event.
+        Queries are searched in a worker thread, which sends results
+        unless a newer query arrived in the meantime.
         """
         # assuming only one ulauncher keyword
         arg = event.get_argument()
-        if not arg:
-            return self.notesnv.process_empty_query()
-        return self.notesnv.process_search_query(arg)
+
+        def send(action: BaseAction) -> None:
+            extension.send_response(event, action)
+
+        def run(is_stale: Callable[[], bool]) -> None:
+            if not arg:
+                action = self.notesnv.process_empty_query()
+            else:
+
+                def send_partial(action: BaseAction) -> None:
+                    # Ulauncher renders every response to the current query,
+                    # so the final results simply replace these
+                    if not is_stale():
+                        send(action)
+
+                action = self.notesnv.process_search_query(arg, send_partial)
+            if is_stale():
+                self.notesnv.metrics.count("cancelled")
+                return
+            send(action)
+
+        self.coalescer.submit(run, debounced=bool(arg))
+
+
+# pylint: disable=too-few-public-methods
+class PreferencesEventListener(EventListener):
+    """
+    Rebuild the note index and reconfigure profiling
+    when preferences arrive or change
+    """
+
+    def __init__(self, notesnv):
+        super(PreferencesEventListener, self).__init__()
+        self.notesnv = notesnv
+
+    def on_event(self, event, extension) -> None:
+        """
+        Handle initial preferences and preference update events.
+        Extension's own listener has already updated the preferences dict.
+        """
+        if not isinstance(event, PreferencesUpdateEvent) or (
+            event.id == "slow-query-threshold"
+        ):
+            self.notesnv.configure_profiler()
+        if isinstance(event, PreferencesUpdateEvent) and event.id not in (
+            "notes-directory-path",
+            "file-extensions",
+            "accent-insensitive-search",
+            "index-memory-budget",
+            "rescan-interval",
+            "rescan-io-budget",
+        ):
+            return
+        self.notesnv.indexes.start()
+
+
+record_startup_timing("import")
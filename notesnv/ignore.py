@@ -0,0 +1,416 @@
+"""
+Pruning of the notes directory tree
+
+Notes directories often hold much more than notes: version control metadata,
+attachment folders, symlinks back up the tree. Everything that searches or
+indexes notes walks the tree through `list_note_dir`, which skips:
+
+- files and directories matching gitignore-style patterns
+  from a `.nvignore` file in the root of the notes directory
+- version control and hidden directories (can be re-included with `!`)
+- files larger than `MAX_NOTE_SIZE`
+
+Compressed notes (see `compressed`) are listed along with plain text ones.
+
+Directories are pruned before they are listed, so walking costs time
+proportional to the notes rather than to everything on disk.
+Symbolic links are followed, but every directory is only walked once,
+so symlink loops are harmless.
+"""
+import os
+import re
+import threading
+from typing import Dict, List, NamedTuple, Optional, Pattern, Set, Tuple
+from typing import TYPE_CHECKING
+from .compressed import compression_suffixes
+
+if TYPE_CHECKING:
+    from .rescan import IoBudget  # noqa: F401
+
+
+IGNORE_FILE = ".nvignore"
+
+# Applied before patterns from `IGNORE_FILE`, which can override them
+DEFAULT_IGNORE_PATTERNS = [".*/", "CVS/", "_darcs/"]
+
+# Note files larger than this are skipped
+MAX_NOTE_SIZE = 8 * 1024 * 1024
+
+# How many bytes a stat() is assumed to cost when throttling I/O
+STAT_COST = 4096
+
+DirId = Tuple[int, int]
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translate gitignore glob into a regex matching whole relative paths
+
+    >>> glob_to_regex("*.pdf")
+    '(?:.*/)?[^/]*\\\\.pdf'
+    >>> glob_to_regex("/drafts/**")
+    'drafts/.*'
+    >>> glob_to_regex("a/**/b")
+    'a/(?:.*/)?b'
+    """
+    # Patterns without a slash (other than a leading one) match at any depth
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    out = "" if anchored else "(?:.*/)?"
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            out += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out += ".*"
+            i += 2
+            continue
+        if char == "*":
+            out += "[^/]*"
+        elif char == "?":
+            out += "[^/]"
+        elif char == "[":
+            start = i + 1
+            end = pattern.find("]", start + 1)
+            if end == -1:
+                out += "\\["
+            else:
+                chars = pattern[start:end]
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                out += "[" + chars.replace("\\", "\\\\") + "]"
+                i = end
+        elif char == "\\" and i + 1 < len(pattern):
+            i += 1
+            out += re.escape(pattern[i])
+        else:
+            out += re.escape(char)
+        i += 1
+    return out
+
+
+class IgnoreRule(NamedTuple):
+    """
+    One line of an ignore file
+    """
+
+    regex: Pattern
+    negated: bool
+    dir_only: bool
+
+
+def parse_ignore_rule(line: str) -> Optional[IgnoreRule]:
+    """
+    Parse gitignore-style line, None for blank lines and comments
+    """
+    line = line.rstrip("\n").rstrip()
+    if not line or line.startswith("#"):
+        return None
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    elif line.startswith("\\"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    return IgnoreRule(re.compile(glob_to_regex(line)), negated, dir_only)
+
+
+class IgnoreRules:
+    """
+    Ordered gitignore-style rules, the last matching one wins
+
+    >>> rules = IgnoreRules(["*.pdf", "!keep.pdf", "attachments/"])
+    >>> rules.is_ignored("docs/scan.pdf", False)
+    True
+    >>> rules.is_ignored("docs/keep.pdf", False)
+    False
+    >>> rules.is_ignored("attachments", True), rules.is_ignored("attachments", False)
+    (True, False)
+    """
+
+    def __init__(self, lines: List[str], source: str = ""):
+        self.rules = [r for r in map(parse_ignore_rule, lines) if r is not None]
+        self.dir_rules = self.rules
+        self.file_rules = [r for r in self.rules if not r.dir_only]
+        self.source = source
+
+    @classmethod
+    def load(cls, root: str) -> "IgnoreRules":
+        """
+        Default rules followed by the ones in `IGNORE_FILE`, if there is one
+        """
+        ignore_path = os.path.join(root, IGNORE_FILE)
+        try:
+            with open(ignore_path, "rt", encoding="utf-8", errors="replace") as f:
+                source = f.read()
+        except OSError:
+            source = ""
+        return cls(DEFAULT_IGNORE_PATTERNS + source.splitlines(), source)
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """
+        Whether a file or directory (path relative to the root,
+        with "/" separators) should be skipped
+        """
+        for rule in reversed(self.dir_rules if is_dir else self.file_rules):
+            if rule.regex.fullmatch(rel_path):
+                return not rule.negated
+        return False
+
+    def is_ignored_file(self, rel_path: str) -> bool:
+        """
+        Whether a file is skipped, either itself or because
+        one of its parent directories is
+
+        >>> IgnoreRules([".*/"]).is_ignored_file(".git/notes.txt")
+        True
+        """
+        parts = rel_path.split(os.sep)
+        for i in range(1, len(parts)):
+            if self.is_ignored(os.sep.join(parts[:i]), True):
+                return True
+        return self.is_ignored(rel_path, False)
+
+
+def ignore_file_stamp(root: str) -> Optional[Tuple[float, int]]:
+    """
+    Modification time and size of `IGNORE_FILE`, None if there isn't one
+    """
+    try:
+        stat = os.stat(os.path.join(root, IGNORE_FILE))
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def note_suffixes(file_exts: List[str]) -> Tuple[str, ...]:
+    """
+    Lowercase file name suffixes of note files, plain and compressed
+
+    >>> note_suffixes(["txt", "MD"])[:4]
+    ('.txt', '.md', '.txt.gz', '.md.gz')
+    """
+    plain = tuple("." + ext.lower() for ext in file_exts)
+    return plain + tuple(
+        suffix + compressed for compressed in compression_suffixes() for suffix in plain
+    )
+
+
+class DirListing(NamedTuple):
+    """
+    Note files and subdirectories of one directory
+    """
+
+    mtime: float
+    dir_id: DirId
+    files: Dict[str, os.stat_result]
+    sub_dirs: List[str]
+
+
+def list_note_dir(
+    root: str,
+    rel_dir: str,
+    file_exts: List[str],
+    rules: IgnoreRules,
+    io_budget: Optional["IoBudget"] = None,
+) -> Optional[DirListing]:
+    """
+    List one directory of the notes tree, following symlinks.
+    Returns None if the directory can't be listed.
+    """
+    full_dir = os.path.join(root, rel_dir)
+    try:
+        stat = os.stat(full_dir)
+        entries = list(os.scandir(full_dir))
+    except OSError:
+        return None
+    if io_budget:
+        io_budget.spend(STAT_COST)
+
+    files = {}
+    sub_dirs = []
+    prefix = rel_dir + os.sep if rel_dir else ""
+    suffixes = note_suffixes(file_exts)
+    for entry in entries:
+        rel_path = prefix + entry.name
+        try:
+            if entry.is_dir():
+                if not rules.is_ignored(rel_path, True):
+                    sub_dirs.append(rel_path)
+            elif (
+                entry.name.lower().endswith(suffixes)
+                and entry.is_file()
+                and not rules.is_ignored(rel_path, False)
+            ):
+                file_stat = entry.stat()
+                if io_budget:
+                    io_budget.spend(STAT_COST)
+                if file_stat.st_size <= MAX_NOTE_SIZE:
+                    files[rel_path] = file_stat
+        except OSError:
+            continue
+    return DirListing(stat.st_mtime, (stat.st_dev, stat.st_ino), files, sub_dirs)
+
+
+class TreeListing(NamedTuple):
+    """
+    Note files and directories of the whole notes tree
+    """
+
+    files: Dict[str, os.stat_result]
+    mtimes: Dict[str, float]
+    ids: Dict[str, DirId]
+    # Directories that couldn't be listed, their notes are unknown
+    unlisted: List[str]
+
+
+class NoteDirs:
+    """
+    Directories of the notes tree as they were last listed:
+    their modification times and identities, and the ignore rules
+    they were listed with
+    """
+
+    def __init__(self, path: str, file_exts: List[str]):
+        self.path = path
+        self.file_exts = file_exts
+        self.ignore_stamp = ignore_file_stamp(path)
+        self.ignore_rules = IgnoreRules.load(path)
+        self.mtimes: Dict[str, float] = {}
+        # Identities of listed directories, to not list one twice through symlinks
+        self.ids: Dict[str, DirId] = {}
+        # Set when the whole tree needs listing again, see `PeriodicRescan`
+        self.rescan_wanted = threading.Event()
+
+    def load_ignore_rules(self) -> None:
+        """
+        Re-read ignore rules before listing the whole tree again
+        """
+        # Stamped before reading, so that a concurrent edit is seen next time
+        self.ignore_stamp = ignore_file_stamp(self.path)
+        self.ignore_rules = IgnoreRules.load(self.path)
+
+    def ignore_rules_changed(self) -> bool:
+        """
+        Whether `IGNORE_FILE` has different rules than the ones directories
+        were listed with. Only re-reads it if its modification time
+        or size changed.
+        """
+        stamp = ignore_file_stamp(self.path)
+        if stamp == self.ignore_stamp:
+            return False
+        self.ignore_stamp = stamp
+        return IgnoreRules.load(self.path).source != self.ignore_rules.source
+
+    def list_dir(
+        self, rel_dir: str, io_budget: Optional["IoBudget"] = None
+    ) -> Optional[DirListing]:
+        """
+        List one directory with the current ignore rules
+        (see `list_note_dir`)
+        """
+        return list_note_dir(
+            self.path, rel_dir, self.file_exts, self.ignore_rules, io_budget
+        )
+
+    def list_tree(
+        self, io_budget: Optional["IoBudget"] = None
+    ) -> Optional[TreeListing]:
+        """
+        List the whole tree with the current ignore rules,
+        None if the root directory can't be listed
+        """
+        tree = TreeListing({}, {}, {}, [])
+        seen: Set[DirId] = set()
+        to_list = [""]
+        while to_list:
+            rel_dir = to_list.pop()
+            listing = self.list_dir(rel_dir, io_budget)
+            if listing is None:
+                if not rel_dir:
+                    return None
+                tree.unlisted.append(rel_dir)
+                continue
+            if listing.dir_id in seen:
+                continue
+            seen.add(listing.dir_id)
+            tree.mtimes[rel_dir] = listing.mtime
+            tree.ids[rel_dir] = listing.dir_id
+            tree.files.update(listing.files)
+            to_list.extend(listing.sub_dirs)
+        return tree
+
+    def record_tree(self, tree: TreeListing) -> None:
+        """
+        Remember the whole tree as listed. Directories that couldn't be listed
+        keep what's known about them.
+        """
+        mtimes = dict(tree.mtimes)
+        ids = dict(tree.ids)
+        for rel_dir in tree.unlisted:
+            if rel_dir in self.mtimes:
+                mtimes[rel_dir] = self.mtimes[rel_dir]
+                ids[rel_dir] = self.ids[rel_dir]
+        self.mtimes = mtimes
+        self.ids = ids
+
+    def record(self, rel_dir: str, listing: DirListing) -> None:
+        """
+        Remember the directory as listed
+        """
+        self.mtimes[rel_dir] = listing.mtime
+        self.ids[rel_dir] = listing.dir_id
+
+    def forget(self, rel_dir: str) -> None:
+        """
+        Forget the directory, so that it's listed again when found
+        """
+        self.mtimes.pop(rel_dir, None)
+        self.ids.pop(rel_dir, None)
+
+    def changed(self) -> List[str]:
+        """
+        Directories whose modification time changed since they were listed,
+        or that are gone
+        """
+        changed = []
+        for rel_dir, mtime in self.mtimes.items():
+            try:
+                if os.stat(os.path.join(self.path, rel_dir)).st_mtime != mtime:
+                    changed.append(rel_dir)
+            except OSError:
+                changed.append(rel_dir)
+        return changed
+
+
+def walk_note_files(
+    root: str, file_exts: List[str], rules: Optional[IgnoreRules] = None
+) -> Optional[List[str]]:
+    """
+    Relative paths of all note files in the tree, None if the root
+    directory can't be listed
+    """
+    if rules is None:
+        rules = IgnoreRules.load(root)
+    found: List[str] = []
+    seen: Set[DirId] = set()
+    to_list = [""]
+    while to_list:
+        rel_dir = to_list.pop()
+        listing = list_note_dir(root, rel_dir, file_exts, rules)
+        if listing is None:
+            if not rel_dir:
+                return None
+            continue
+        if listing.dir_id in seen:
+            continue
+        seen.add(listing.dir_id)
+        found.extend(listing.files)
+        to_list.extend(listing.sub_dirs)
+    return found
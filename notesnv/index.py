@@ -0,0 +1,955 @@
+"""
+In-memory index of note files and their contents
+
+Built once in the background, then kept up to date cheaply:
+file creation, deletion and renaming all change the modification time
+of the parent directory, so only directories whose mtime changed
+need to be re-listed. Note files themselves are only re-read
+when their modification time or size changes.
+
+For filesystems where directory modification times can't be relied on
+(network filesystems, synced folders), `rescan()` walks the whole tree
+and compares every file's (mtime, size, inode) against the index instead.
+
+Ignored files and directories (see `ignore`) are never listed nor indexed.
+
+Titles and contents are stored case-folded (and optionally stripped of
+diacritics), so queries don't pay for folding.
+
+Every note gets a new numeric id whenever it is (re)read. Words of its folded
+contents point to it through compressed posting lists, which narrow down
+the notes that a content search has to look at. Notes and their posting lists
+are kept in segments (see `segments`), one per batch of updates: changed
+and deleted notes are only marked as deleted in the segment they're in,
+and segments are merged in the background, dropping them.
+
+The index can be given a memory budget. When it goes over the budget,
+it drops what's cheapest to get back from disk: first the original text
+of notes that haven't been matched recently (it's only needed for snippets
+and can be re-read from the note file), then posting lists of rare words
+(moved to a temporary file), then folded contents of cold notes.
+
+Queries don't wait for the index lock: they read an immutable
+`IndexSnapshot`, which updates replace with a single assignment once they're
+fully applied, and the check for changed directories before a search
+(`NoteIndex.refresh`) is skipped while an update holds the lock.
+Updates copy the parts of segments they change on first write
+(copy-on-write), so a query always sees the index as it was before or after
+an update, never in between. Note lists of links and #tags, and the spelling
+dictionary grow by appending, so they are shared between snapshots:
+ids that a snapshot doesn't know are skipped. Ids of deleted notes are
+taken out of link and tag lists when their segment is merged.
+
+Every new term also goes into a spelling dictionary (see `spelling`),
+used to correct misspelled query words. Terms that no note has any more
+are skipped as corrections. Links between notes (see `links`)
+are recorded as lists of ids of linking notes, same as posting lists,
+and so are #tags.
+"""
+import heapq
+import math
+import os
+import sys
+import threading
+from collections import OrderedDict
+from functools import partial
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Sequence,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
+from .compressed import read_note_text
+from .ignore import (
+    DirId,
+    NoteDirs,
+    note_suffixes,
+    MAX_NOTE_SIZE,
+)
+from .links import NoteLinks
+from .spelling import SpellingDictionary
+from .tags import NoteTags
+from .textfold import fold, fold_with_offsets, original_offset, Offsets
+from .postings import TERM_REGEX, extract_terms, decode_postings, postings_count
+from .segments import (
+    IndexSnapshot,
+    SegmentStore,
+    iter_notes,
+    pick_merge,
+    merge_segments,
+    segment_note_ids,
+    term_note_count,
+)
+
+if TYPE_CHECKING:
+    from .rescan import IoBudget  # noqa: F401
+
+
+# Query words shorter than this are part of too many terms to be worth looking up
+MIN_LOOKUP_LEN = 3
+
+# Query words that are part of more terms than this don't narrow down the search
+MAX_LOOKUP_TERMS = 2000
+
+# Candidate notes this few are quicker to match against the query
+# than to narrow down further by looking up posting lists of more words
+FEW_CANDIDATES = 100
+
+# Posting lists this short (in bytes) are considered rare and spilled first
+RARE_POSTINGS_LEN = 2
+
+# How many recently matched notes to remember as "hot"
+MAX_RECENTLY_MATCHED = 1000
+
+# How many of a note's most distinctive terms are used to find related notes
+MAX_RELATED_TERMS = 64
+
+# Terms found in a larger share of notes than this don't tell topics apart
+MAX_RELATED_DOC_SHARE = 0.05
+
+
+class NoteEntry(NamedTuple):
+    """
+    Indexed note file
+
+    `text` and `folded` (with `offsets`) are None when evicted from memory.
+    """
+
+    doc_id: int
+    filename: str
+    filename_folded: str
+    basename_folded: str
+    mtime: float
+    size: int
+    inode: int
+    text: Optional[str]
+    folded: Optional[str]
+    offsets: Offsets
+    # Number of distinct terms in the note
+    term_count: int = 0
+
+
+class ContentMatch(NamedTuple):
+    """
+    First line of a note that matched a content search pattern
+    """
+
+    filename: str
+    filename_folded: str
+    line: str
+    line_folded: str
+    start: int
+    end: int
+
+
+class RelatedNote(NamedTuple):
+    """
+    Note similar to another one, and the most distinctive terms they share
+    """
+
+    filename: str
+    score: float
+    shared_terms: List[str]
+
+
+def is_unchanged(note: Optional[NoteEntry], stat: os.stat_result) -> bool:
+    """
+    Whether note file looks the same as when it was indexed
+    """
+    return (
+        note is not None
+        and note.mtime == stat.st_mtime
+        and note.size == stat.st_size
+        and note.inode == stat.st_ino
+    )
+
+
+def text_size(text: Optional[str], offsets: Offsets = None) -> int:
+    """
+    Approximate memory used by text and its offsets
+    """
+    size = sys.getsizeof(text) if text is not None else 0
+    if offsets is not None:
+        size += sys.getsizeof(offsets)
+    return size
+
+
+def title_size(note: NoteEntry) -> int:
+    """
+    Approximate memory used by note entry itself and its names
+    """
+    return (
+        sys.getsizeof(note)
+        + sys.getsizeof(note.filename)
+        + sys.getsizeof(note.filename_folded)
+        + sys.getsizeof(note.basename_folded)
+    )
+
+
+class NoteMemory:
+    """
+    Memory used by titles and contents of notes, and which notes
+    were matched recently: their contents are kept in memory the longest
+    when the index goes over its `budget`
+    """
+
+    def __init__(self, budget: Optional[int]):
+        self.budget = budget
+        self.sizes = {"titles": 0, "text": 0, "folded": 0}
+        self.recently_matched: "OrderedDict[str, None]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, note: NoteEntry) -> None:
+        """
+        Account for a note put into the index
+        """
+        self.sizes["titles"] += title_size(note)
+        self.sizes["text"] += text_size(note.text)
+        self.sizes["folded"] += text_size(note.folded, note.offsets)
+
+    def remove(self, note: NoteEntry) -> None:
+        """
+        Account for a note taken out of the index
+        """
+        self.sizes["titles"] -= title_size(note)
+        self.sizes["text"] -= text_size(note.text)
+        self.sizes["folded"] -= text_size(note.folded, note.offsets)
+
+    def forget(self, filename: str) -> None:
+        """
+        Forget that the file's note was matched
+        """
+        with self.lock:
+            self.recently_matched.pop(filename, None)
+
+    def mark_matched(self, *filenames: str) -> None:
+        """
+        Remember the files' notes as the most recently matched
+        """
+        with self.lock:
+            for fn in filenames:
+                self.recently_matched[fn] = None
+                self.recently_matched.move_to_end(fn)
+            while len(self.recently_matched) > MAX_RECENTLY_MATCHED:
+                self.recently_matched.popitem(last=False)
+
+    def cold_notes(self, notes: Iterable[NoteEntry]) -> List[NoteEntry]:
+        """
+        Notes, least recently matched first
+        """
+        with self.lock:
+            recent = dict(self.recently_matched)
+        by_filename = {note.filename: note for note in notes}
+        return [note for fn, note in by_filename.items() if fn not in recent] + [
+            by_filename[fn] for fn in recent if fn in by_filename
+        ]
+
+
+class NoteIndex:
+    """
+    Index of note files in a directory tree
+    """
+
+    def __init__(
+        self,
+        path: str,
+        file_exts: List[str],
+        strip_accents: bool = False,
+        memory_budget: Optional[int] = None,
+    ):
+        self.dirs = NoteDirs(path, file_exts)
+        self.strip_accents = strip_accents
+        self.store = SegmentStore()
+        self.memory = NoteMemory(memory_budget)
+        self.spelling = SpellingDictionary()
+        self.links = NoteLinks()
+        self.tags = NoteTags()
+
+    @property
+    def path(self) -> str:
+        """
+        Notes directory
+        """
+        return self.dirs.path
+
+    @property
+    def file_exts(self) -> List[str]:
+        """
+        Extensions of note files
+        """
+        return self.dirs.file_exts
+
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        """
+        Index as of the last update, for queries to read
+        """
+        return self.store.snapshot
+
+    def is_ready(self) -> bool:
+        """
+        Whether the index has been built and can serve queries
+        """
+        return self.store.ready.is_set()
+
+    def _commit(self) -> None:
+        """
+        Finish a batch of updates: keep the index within its memory budget
+        and publish the changes
+        """
+        self.store.writer.seal()
+        self._enforce_memory_budget()
+        self.store.publish()
+
+    def _read_note(self, rel_path: str, cached: bool = False) -> Optional[str]:
+        """
+        Text of the note file. Compressed notes are only decompressed
+        through the shared cache if `cached`, when reading back notes
+        evicted from memory, so that building the index doesn't flood it.
+        """
+        try:
+            return read_note_text(os.path.join(self.path, rel_path), cached)
+        except OSError:
+            return None
+
+    def _load_note(
+        self, rel_path: str, stat: os.stat_result, previous: Optional[NoteEntry]
+    ) -> Optional[NoteEntry]:
+        """
+        Read and fold note file, unless it hasn't changed since `previous`.
+        New notes get their id when they're added to the index.
+        """
+        if previous is not None and is_unchanged(previous, stat):
+            return previous
+        text = self._read_note(rel_path)
+        if text is None:
+            return None
+        folded, offsets = fold_with_offsets(text, self.strip_accents)
+        return NoteEntry(
+            0,
+            sys.intern(rel_path),
+            fold(rel_path, self.strip_accents),
+            fold(os.path.basename(rel_path), self.strip_accents),
+            stat.st_mtime,
+            stat.st_size,
+            stat.st_ino,
+            text,
+            folded,
+            offsets,
+        )
+
+    def _add_note(self, note: NoteEntry, is_new: bool = True) -> None:
+        """
+        Put note into the index. New notes get an id in the open segment
+        and their words are added to its posting lists. Notes that aren't new
+        have been removed during this update and are put back where they were.
+        """
+        if is_new:
+            terms = extract_terms(note.folded) if note.folded else set()
+            note, added = self.store.writer.add_note(note, terms)
+            for term in added:
+                self.spelling.add(term)
+            if note.text:
+                self.links.add_note(
+                    note.doc_id, note.text, note.filename, self.file_exts
+                )
+                self.tags.add_note(note.doc_id, note.text)
+        else:
+            self.store.writer.restore_note(note)
+        self.memory.add(note)
+
+    def _remove_note(self, fn: str) -> None:
+        """
+        Take note out of the index by marking it deleted in its segment.
+        Its id stays in posting lists until the segment is merged.
+        """
+        note = self.store.writer.remove_note(fn)
+        if note is not None:
+            self.memory.remove(note)
+            self.memory.forget(fn)
+
+    def _scan_dir(
+        self, rel_dir: str, previous: IndexSnapshot, seen: Set[DirId]
+    ) -> None:
+        """
+        List one directory, add its notes and recurse into subdirectories
+        that haven't been listed yet. Directories in `seen` have been listed
+        under another path (through a symlink) and are skipped.
+        """
+        listing = self.dirs.list_dir(rel_dir)
+        if listing is None or listing.dir_id in seen:
+            self.dirs.forget(rel_dir)
+            return
+        seen.add(listing.dir_id)
+        self.dirs.record(rel_dir, listing)
+        for rel_path, stat in listing.files.items():
+            old = previous.note(rel_path)
+            note = self._load_note(rel_path, stat, old)
+            if note is not None:
+                self._add_note(note, is_new=note is not old)
+        for sub_dir in listing.sub_dirs:
+            if sub_dir not in self.dirs.mtimes:
+                self._scan_dir(sub_dir, previous, seen)
+
+    def build(self) -> None:
+        """
+        Walk the whole notes directory and build the index
+        """
+        self.rescan()
+        self.store.ready.set()
+
+    def rescan(self, io_budget: Optional["IoBudget"] = None) -> int:
+        """
+        Walk the whole notes directory, compare (mtime, size, inode) of every
+        note file against the index, and re-read the ones that changed.
+        Doesn't rely on directory modification times.
+
+        The walk and the reading happen without holding the lock,
+        so that queries aren't blocked. Returns number of changed notes.
+        """
+        known = self.snapshot
+        self.dirs.rescan_wanted.clear()
+        self.dirs.load_ignore_rules()
+        tree = self.dirs.list_tree(io_budget)
+        if tree is None:
+            # Notes directory is gone or inaccessible, don't touch anything
+            return 0
+
+        loaded = self._load_changed(known, tree.files, io_budget)
+        # Notes in directories that couldn't be listed this time are kept
+        unlisted = tuple(rel_dir + os.sep for rel_dir in tree.unlisted)
+        removed = [
+            note
+            for note in known.iter_notes()
+            if note.filename not in tree.files
+            and not note.filename.startswith(unlisted)
+        ]
+
+        with self.store.lock:
+            writer = self.store.writer
+            for note in removed:
+                if writer.note(note.filename) is note:
+                    self._remove_note(note.filename)
+            for fn, note in loaded.items():
+                # Skip notes that changed in the index while we were reading
+                if writer.note(fn) is known.note(fn):
+                    self._remove_note(fn)
+                    self._add_note(note)
+            self.dirs.record_tree(tree)
+            self._commit()
+        return len(loaded) + len(removed)
+
+    def _load_changed(
+        self,
+        known: IndexSnapshot,
+        files: Dict[str, os.stat_result],
+        io_budget: Optional["IoBudget"],
+    ) -> Dict[str, NoteEntry]:
+        """
+        Read the note files whose (mtime, size, inode) differ from the index
+        """
+        loaded = {}
+        for fn, stat in files.items():
+            if is_unchanged(known.note(fn), stat):
+                continue
+            note = self._load_note(fn, stat, None)
+            if io_budget:
+                io_budget.spend(stat.st_size)
+            if note is not None:
+                loaded[fn] = note
+        return loaded
+
+    def refresh(self) -> None:
+        """
+        Re-list directories that changed since they were last listed,
+        re-reading the notes in them that changed.
+
+        Only costs a stat per directory, so that it can run on every search.
+        Notes changed in place don't change their directory's modification
+        time: periodic rescans find those. When ignore rules change,
+        a rescan is requested from the background rescanner (see
+        `PeriodicRescan`) and the current notes keep being served until then.
+        Does nothing if an update is under way, rather than making the search
+        wait for it.
+        """
+        if self.dirs.ignore_rules_changed():
+            self.dirs.rescan_wanted.set()
+        lock = self.store.lock
+        # Not a with statement: a search shouldn't wait for the lock
+        if not lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return
+        try:
+            changed = self.dirs.changed()
+            if not changed:
+                return
+
+            previous = self.snapshot
+            for rel_dir in changed:
+                self._forget_dir(rel_dir)
+            seen = set(self.dirs.ids.values())
+            for rel_dir in changed:
+                parent = os.path.dirname(rel_dir)
+                if not rel_dir or parent in self.dirs.mtimes:
+                    self._scan_dir(rel_dir, previous, seen)
+            self._commit()
+        finally:
+            lock.release()
+
+    def update_note(self, rel_path: str) -> None:
+        """
+        Re-read one note right after it's been written, so that it can be
+        found without waiting for a refresh or a rescan to notice it.
+        The note is marked as recently matched to keep it in memory.
+        """
+        if (
+            rel_path.startswith(os.pardir)
+            or not rel_path.lower().endswith(note_suffixes(self.file_exts))
+            or self.dirs.ignore_rules.is_ignored_file(rel_path)
+        ):
+            return
+        try:
+            stat = os.stat(os.path.join(self.path, rel_path))
+        except OSError:
+            stat = None
+        with self.store.lock:
+            old = self.store.writer.note(rel_path)
+            if stat is None or stat.st_size > MAX_NOTE_SIZE:
+                self._remove_note(rel_path)
+                self.store.publish()
+                return
+            note = self._load_note(rel_path, stat, old)
+            if note is not old:
+                self._remove_note(rel_path)
+                if note is None:
+                    self.store.publish()
+                    return
+                self._add_note(note)
+            self.memory.mark_matched(rel_path)
+            self._commit()
+
+    def _forget_dir(self, rel_dir: str) -> None:
+        """
+        Remove directory's own notes from the index.
+        Subdirectories are tracked separately and are left alone,
+        unless they are gone too.
+        """
+        self.dirs.forget(rel_dir)
+        for note in list(iter_notes(self.store.writer.segments)):
+            if os.path.dirname(note.filename) == rel_dir:
+                self._remove_note(note.filename)
+        prefix = rel_dir + os.sep if rel_dir else ""
+        for sub_dir in [d for d in self.dirs.mtimes if d.startswith(prefix) and d]:
+            if not os.path.isdir(os.path.join(self.path, sub_dir)):
+                self._forget_dir(sub_dir)
+
+    def memory_footprint(self) -> Dict[str, int]:
+        """
+        Approximate number of bytes used by each part of the index
+        """
+        footprint = dict(self.memory.sizes)
+        footprint["postings"] = 0
+        footprint["links"] = self.links.size
+        footprint["tags"] = self.tags.size
+        footprint["spilled"] = 0
+        for segment in list(self.store.writer.segments):
+            footprint["titles"] += sys.getsizeof(segment.notes) + sys.getsizeof(
+                segment.filenames_by_id
+            )
+            footprint["postings"] += (
+                sys.getsizeof(segment.postings) + segment.postings_size
+            )
+            if segment.spilled is not None:
+                footprint["spilled"] += segment.spilled.memory_footprint()
+        footprint["spelling"] = self.spelling.memory_footprint()
+        return footprint
+
+    def memory_used(self) -> int:
+        """
+        Approximate total number of bytes used by the index
+        """
+        return sum(self.memory_footprint().values())
+
+    def _evict(self, note: NoteEntry, **changes) -> None:
+        """
+        Drop parts of note's contents from memory
+        """
+        self.memory.remove(note)
+        self.memory.add(note._replace(**changes))
+        self.store.writer.replace_note(note.filename, **changes)
+
+    def _enforce_memory_budget(self) -> None:
+        """
+        Move cold data out of memory until the index fits into its budget
+        """
+        budget = self.memory.budget
+        if budget is None or self.memory_used() <= budget:
+            return
+        writer = self.store.writer
+        for note in self.memory.cold_notes(iter_notes(writer.segments)):
+            if note.text is not None:
+                self._evict(note, text=None)
+                if self.memory_used() <= budget:
+                    return
+        writer.spill_rare_postings(RARE_POSTINGS_LEN)
+        if self.memory_used() <= budget:
+            return
+        for note in self.memory.cold_notes(iter_notes(writer.segments)):
+            if note.folded is not None:
+                self._evict(note, text=None, folded=None, offsets=None)
+                if self.memory_used() <= budget:
+                    return
+
+    def merge(self, io_budget: Optional["IoBudget"] = None) -> int:
+        """
+        Merge the next published segments that need merging (see `segments`),
+        dropping their deleted notes. The merging happens without holding
+        the lock; the merged segment is swapped in under it, with whatever
+        was deleted or evicted in the meantime. Returns number of segments
+        that were merged.
+        """
+        store = self.store
+        with store.merge_lock:
+            published = store.snapshot.segments
+            picked = pick_merge(published)
+            if picked is None:
+                return 0
+            start, end = picked
+            merged = merge_segments(published[start:end], io_budget)
+            with store.lock:
+                store.writer.replace_merged(start, end, merged, published[start:end])
+                # Ids of deleted notes are gone from the merged segment
+                dropped = set().union(
+                    *(segment.deleted for segment in published[start:end])
+                )
+                self.links.prune(dropped)
+                self.tags.prune(dropped)
+                self._commit()
+            return end - start
+
+    def fold(self, text: str) -> str:
+        """
+        Fold query text the same way indexed text was folded
+        """
+        return fold(text, self.strip_accents)
+
+    def find_titles(
+        self, name_chunks: List[str], within: Optional[Set[int]] = None
+    ) -> List[NoteEntry]:
+        """
+        Find notes with file names that contain all `name_chunks` in any order,
+        same as `search.filter_titles`. If `within` is given, only notes
+        with those ids are looked at.
+        """
+        chunks = [self.fold(c) for c in name_chunks]
+        snapshot = self.snapshot
+        notes = (
+            snapshot.iter_notes() if within is None else snapshot.notes_by_ids(within)
+        )
+        return [
+            entry for entry in notes if all(c in entry.basename_folded for c in chunks)
+        ]
+
+    def ids_with_tags(self, tags: Sequence[str]) -> Set[int]:
+        """
+        Ids of notes that have all of the (folded) tags
+        """
+        snapshot = self.snapshot
+        return snapshot.live_ids(self.tags.ids_with_all(tags))
+
+    def tagged_notes(self, ids: Set[int]) -> List[NoteEntry]:
+        """
+        Notes with the given ids, as found by `ids_with_tags`
+        """
+        return self.snapshot.notes_by_ids(ids)
+
+    def _ids_containing(self, snapshot: IndexSnapshot, word: str) -> Optional[Set[int]]:
+        """
+        Ids of notes that have a term containing the word,
+        or None if the word is too common to narrow anything down
+        """
+        hot_terms = self.store.lookup.hot_terms(snapshot, word)
+        spilled_terms = [
+            (segment.spilled, segment.spilled.find_terms(word))
+            for segment in snapshot.segments
+            if segment.spilled is not None
+        ]
+        if len(hot_terms) + sum(len(o) for _, o in spilled_terms) > MAX_LOOKUP_TERMS:
+            return None
+        ids: Set[int] = set()
+        for term in hot_terms:
+            for segment in snapshot.segments:
+                data = segment.postings.get(term)
+                if data is not None:
+                    ids.update(decode_postings(data))
+        for spilled, ordinals in spilled_terms:
+            for ordinal in ordinals:
+                ids.update(spilled.read(ordinal))
+        return ids
+
+    def _candidates(
+        self,
+        snapshot: IndexSnapshot,
+        query_words: List[str],
+        within: Optional[Set[int]] = None,
+    ) -> Optional[List[NoteEntry]]:
+        """
+        Notes (with ids in `within`, if given) that could match all query words,
+        or None if all notes could
+        """
+        candidate_ids: Optional[Set[int]] = within
+        for word in query_words:
+            for piece in TERM_REGEX.findall(word):
+                if len(piece) < MIN_LOOKUP_LEN:
+                    continue
+                if candidate_ids is not None and len(candidate_ids) <= FEW_CANDIDATES:
+                    return snapshot.notes_by_ids(candidate_ids)
+                ids = self._ids_containing(snapshot, piece)
+                if ids is None:
+                    continue
+                candidate_ids = ids if candidate_ids is None else candidate_ids & ids
+                if not candidate_ids:
+                    return []
+        if candidate_ids is None:
+            return None
+        return snapshot.notes_by_ids(candidate_ids)
+
+    def _note_contents(self, note: NoteEntry) -> Tuple[str, str, Offsets]:
+        """
+        Original text, folded text and offsets of the note,
+        reading whatever was evicted back from disk
+        """
+        if note.text is not None and note.folded is not None:
+            return note.text, note.folded, note.offsets
+        text = self._read_note(note.filename, cached=True) or ""
+        if note.folded is not None and original_offset(
+            note.offsets, len(note.folded)
+        ) == len(text):
+            return text, note.folded, note.offsets
+        folded, offsets = fold_with_offsets(text, self.strip_accents)
+        return text, folded, offsets
+
+    def search_content(
+        self,
+        pattern: Pattern,
+        query_words: List[str],
+        within: Optional[Set[int]] = None,
+    ) -> List[ContentMatch]:
+        """
+        Find notes whose folded contents match the pattern
+        and return the first matching line of each, same as `search.grep_dir`
+
+        Pattern and query words must be folded. Only notes that have
+        terms containing each of the query words (and ids in `within`,
+        if given) are matched against the pattern.
+        """
+        snapshot = self.snapshot
+        matches = []
+        candidates = self._candidates(snapshot, query_words, within)
+        notes = snapshot.iter_notes() if candidates is None else candidates
+        for note in notes:
+            match = self._match_note(note, pattern)
+            if match is not None:
+                matches.append(match)
+        self.memory.mark_matched(*(m.filename for m in matches))
+        return matches
+
+    def _match_note(self, note: NoteEntry, pattern: Pattern) -> Optional[ContentMatch]:
+        """
+        First line of the note that matches the pattern, if any.
+        Text evicted from memory is only read back from disk when needed.
+        """
+        text, folded, offsets = note.text, note.folded, note.offsets
+        if folded is None:
+            text, folded, offsets = self._note_contents(note)
+        match = pattern.search(folded)
+        if match is None:
+            return None
+        if text is None:
+            text, folded, offsets = self._note_contents(note)
+            match = pattern.search(folded)
+            if match is None:
+                return None
+        line_start = folded.rfind("\n", 0, match.start()) + 1
+        line_end = folded.find("\n", match.end())
+        if line_end == -1:
+            line_end = len(folded)
+        orig_line_start = original_offset(offsets, line_start)
+        orig_line_end = original_offset(offsets, line_end)
+        return ContentMatch(
+            note.filename,
+            note.filename_folded,
+            text[orig_line_start:orig_line_end],
+            folded[line_start:line_end],
+            original_offset(offsets, match.start()) - orig_line_start,
+            original_offset(offsets, match.end()) - orig_line_start,
+        )
+
+    def note_ids(
+        self, term: str, snapshot: Optional[IndexSnapshot] = None
+    ) -> List[int]:
+        """
+        Ids of notes that have the term, including ids that are no longer
+        in the index (or in the given snapshot)
+        """
+        if snapshot is None:
+            snapshot = self.snapshot
+        ids: List[int] = []
+        for segment in snapshot.segments:
+            ids.extend(segment_note_ids(segment, term))
+        return ids
+
+    @staticmethod
+    def _postings_count(snapshot: IndexSnapshot, term: str) -> int:
+        """
+        Number of ids the term's in-memory posting lists have,
+        deleted ones included
+        """
+        return sum(postings_count(s.postings.get(term, b"")) for s in snapshot.segments)
+
+    def correct_spelling(self, query_words: List[str]) -> Optional[List[str]]:
+        """
+        Query words with the ones that aren't part of any indexed term
+        replaced by the closest terms, None if there's nothing to correct.
+        Query words must be folded. Terms that only differ from the word
+        by accents don't count as corrections.
+        """
+        snapshot = self.snapshot
+        popularity = partial(term_note_count, snapshot.segments)
+        lookup = self.store.lookup
+        corrected = []
+        for word in query_words:
+            if len(word) < MIN_LOOKUP_LEN or lookup.hot_terms(snapshot, word):
+                corrected.append(word)
+                continue
+            if any(
+                segment.spilled.find_terms(word)
+                for segment in snapshot.segments
+                if segment.spilled is not None
+            ):
+                corrected.append(word)
+                continue
+            # Accent-sensitive search shouldn't be undone by corrections
+            suggestions = [
+                term
+                for term in self.spelling.suggest(word, popularity, 3)
+                if fold(term, True) != fold(word, True)
+            ]
+            corrected.append(suggestions[0] if suggestions else word)
+        return corrected if corrected != query_words else None
+
+    def related(self, filename: str, limit: int) -> List[RelatedNote]:
+        """
+        Notes sharing the most of the given note's rarest terms, best first
+
+        Shared terms are weighted by their squared inverse document
+        frequency, and scores are normalized by the number of distinct terms
+        of both notes: a cosine similarity with binary term frequencies,
+        whose norms don't go stale as document frequencies change.
+        Only the note's rarest terms are looked up, which keeps this fast
+        for any corpus size: common terms carry little weight anyway.
+        """
+        snapshot = self.snapshot
+        note = snapshot.note(filename)
+        if note is None:
+            return []
+        folded = note.folded
+        if folded is None:
+            _, folded, _ = self._note_contents(note)
+        return score_related(
+            snapshot, self._rare_term_ids(snapshot, note.doc_id, folded), limit
+        )
+
+    def _rare_term_ids(
+        self, snapshot: IndexSnapshot, doc_id: int, folded: str
+    ) -> Dict[str, Set[int]]:
+        """
+        Other notes having each of the rarest terms of a note's folded text,
+        for up to `MAX_RELATED_TERMS` terms that are in few enough notes.
+        Terms are taken by the number of ids in their posting lists, which is
+        counted without decoding them: only the terms taken are decoded.
+        """
+        max_doc_freq = max(2, int(snapshot.note_count * MAX_RELATED_DOC_SHARE))
+        counts = {
+            term: self._postings_count(snapshot, term) for term in extract_terms(folded)
+        }
+        term_ids: Dict[str, Set[int]] = {}
+        for term in sorted(counts, key=counts.__getitem__):
+            ids = snapshot.live_ids(self.note_ids(term, snapshot))
+            ids.discard(doc_id)
+            if not ids:
+                continue
+            if len(ids) >= max_doc_freq:
+                break
+            term_ids[term] = ids
+            if len(term_ids) >= MAX_RELATED_TERMS:
+                break
+        return term_ids
+
+    def backlinks(self, filename: str) -> List[str]:
+        """
+        Notes that link to the given note, by title or by path
+        """
+        snapshot = self.snapshot
+        ids = self.links.linking_ids(filename, self.file_exts)
+        found = {note.filename for note in snapshot.notes_by_ids(ids)}
+        found.discard(filename)
+        return sorted(found)
+
+    def __len__(self) -> int:
+        return self.snapshot.note_count
+
+
+def score_related(
+    snapshot: IndexSnapshot, term_ids: Dict[str, Set[int]], limit: int
+) -> List[RelatedNote]:
+    """
+    Best `limit` notes having the given terms (see `NoteIndex.related`)
+    """
+    total = snapshot.note_count
+    scores: Dict[int, float] = {}
+    query_norm = 0.0
+    for ids in term_ids.values():
+        weight = math.log(1 + total / (len(ids) + 1)) ** 2
+        query_norm += weight
+        for doc_id in ids:
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight
+
+    notes_by_id = {other.doc_id: other for other in snapshot.notes_by_ids(scores)}
+
+    def normalized(doc_id: int) -> float:
+        term_count = notes_by_id[doc_id].term_count
+        return scores[doc_id] / math.sqrt(query_norm * max(1, term_count))
+
+    best = heapq.nlargest(limit, scores, key=normalized)
+    return [
+        RelatedNote(
+            notes_by_id[doc_id].filename,
+            normalized(doc_id),
+            [term for term, ids in term_ids.items() if doc_id in ids],
+        )
+        for doc_id in best
+    ]
+
+
+def build_in_background(
+    index: NoteIndex, on_ready: Optional[Callable[[], None]] = None
+) -> threading.Thread:
+    """
+    Build the index in a daemon thread, call `on_ready()` when done
+    """
+
+    def run():
+        index.build()
+        if on_ready:
+            on_ready()
+
+    thread = threading.Thread(target=run, name="notesnv-index-warmup", daemon=True)
+    thread.start()
+    return thread
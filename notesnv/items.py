@@ -0,0 +1,92 @@
+"""
+Ulauncher result items shared by the extension's query and note commands
+"""
+from typing import List, Optional
+from ulauncher.api.shared.item.ResultItem import ResultItem
+from ulauncher.api.shared.item.ExtensionResultItem import ExtensionResultItem
+from ulauncher.api.shared.item.ExtensionSmallResultItem import (
+    ExtensionSmallResultItem,
+)
+from ulauncher.api.shared.action.BaseAction import BaseAction
+from ulauncher.api.shared.action.DoNothingAction import DoNothingAction
+from .search import SearchResultItem
+
+
+MAX_RESULTS_VISIBLE = 10
+
+INDEX_NOT_READY = "Notes are still being indexed, try again shortly"
+
+
+def error_item(message: str, details: Optional[str] = None) -> ResultItem:
+    """
+    Show small result item with error icon and a message.
+    """
+    if not details:
+        return ExtensionSmallResultItem(
+            icon="images/error.svg", name=message, on_enter=DoNothingAction()
+        )
+
+    return ExtensionResultItem(
+        icon="images/error.svg",
+        name=message,
+        description=details,
+        on_enter=DoNothingAction(),
+    )
+
+
+def message_item(message: str, details: Optional[str] = None) -> ResultItem:
+    """
+    Show result item with a message that isn't an error
+    """
+    return ExtensionResultItem(
+        icon="images/notes-nv.svg",
+        name=message,
+        description=details,
+        on_enter=DoNothingAction(),
+    )
+
+
+def match_description(match: SearchResultItem) -> str:
+    """
+    Result item description: matching text, and whether the note
+    matched a spelling-corrected query
+    """
+    if not match.corrected_query:
+        return match.match_summary
+    corrected = f'Matches "{match.corrected_query}"'
+    return f"{corrected}: {match.match_summary}" if match.match_summary else corrected
+
+
+def results_page(
+    matches: List[SearchResultItem], offset: int
+) -> List[SearchResultItem]:
+    """
+    Matches shown on the page of results that starts at `offset`
+    """
+    end = offset + MAX_RESULTS_VISIBLE
+    return matches[offset:end]
+
+
+def more_results_item(remaining: int, on_enter: BaseAction) -> ResultItem:
+    """
+    Result item that shows the next page of results
+    """
+    return ExtensionSmallResultItem(
+        icon="images/notes-nv.svg",
+        name=f"More results… ({remaining} more)",
+        on_enter=on_enter,
+        highlightable=False,
+    )
+
+
+def line_item(line: str, on_enter: BaseAction, on_alt_enter: BaseAction) -> ResultItem:
+    """
+    Small result item showing one line of a note
+    """
+    return ExtensionSmallResultItem(
+        icon="images/note.svg",
+        name=line,
+        on_enter=on_enter,
+        on_alt_enter=on_alt_enter,
+        highlightable=False,
+    )
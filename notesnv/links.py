@@ -0,0 +1,122 @@
+"""
+Links between notes
+
+Notes link to each other either by title, wiki-style (`[[Note Title]]`,
+`[[Note Title|shown text]]`, `[[Note Title#Heading]]`), or by relative path,
+Markdown-style (`[shown text](../other/note.md)`).
+
+Both kinds of links are turned into link keys, so that a note can find
+notes linking to it by looking up its own keys: "w:" followed by the
+folded title (or "p:" and the path relative to the notes directory
+if the wiki link contains one), and "p:" followed by the folded path
+without extension for relative path links.
+"""
+import os
+import posixpath
+import re
+from typing import List, Set
+from urllib.parse import unquote
+from .compressed import strip_compression_suffix
+from .postings import IdLists
+from .textfold import fold
+
+
+WIKI_LINK_REGEX = re.compile(r"\[\[([^\[\]\n]+)\]\]")
+PATH_LINK_REGEX = re.compile(r"\]\(\s*<?([^()<>\s]+|[^()<>\n]+(?=>))>?\s*\)")
+URL_SCHEME_REGEX = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*:")
+
+
+def strip_note_extension(path: str, file_exts: List[str]) -> str:
+    """
+    Remove note file extension (and compression suffix), if path has one
+
+    >>> strip_note_extension("dir/Note.MD", ["txt", "md"])
+    'dir/Note'
+    >>> strip_note_extension("archive/Note.md.gz", ["txt", "md"])
+    'archive/Note'
+    >>> strip_note_extension("v1.2", ["txt", "md"])
+    'v1.2'
+    """
+    stem, ext = os.path.splitext(strip_compression_suffix(path))
+    return stem if ext[1:].lower() in (e.lower() for e in file_exts) else path
+
+
+def note_link_keys(rel_path: str, file_exts: List[str]) -> List[str]:
+    """
+    Keys under which links to the note are found
+
+    >>> note_link_keys("dir/My Note.md", ["md"])
+    ['w:my note', 'p:dir/my note']
+    """
+    stem = fold(strip_note_extension(rel_path, file_exts))
+    return ["w:" + posixpath.basename(stem), "p:" + stem]
+
+
+def extract_link_keys(text: str, rel_path: str, file_exts: List[str]) -> Set[str]:
+    """
+    Keys of notes that the note at `rel_path` links to
+
+    >>> sorted(extract_link_keys(
+    ...     "See [[Other Note|this]] and [setup](../howto/Setup%20Guide.md), "
+    ...     "not [site](https://example.com) or [[sub/Deep note#intro]]",
+    ...     "work/today.md",
+    ...     ["md"],
+    ... ))
+    ['p:howto/setup guide', 'p:sub/deep note', 'w:other note']
+    """
+    keys = set()
+    if "[[" in text:
+        for target in WIKI_LINK_REGEX.findall(text):
+            target = target.split("|", 1)[0].split("#", 1)[0].strip()
+            if not target:
+                continue
+            target = fold(strip_note_extension(target, file_exts))
+            keys.add(("p:" if "/" in target else "w:") + target.lstrip("/"))
+    if "](" in text:
+        source_dir = posixpath.dirname(rel_path)
+        for target in PATH_LINK_REGEX.findall(text):
+            if target.startswith("#") or URL_SCHEME_REGEX.match(target):
+                continue
+            target = unquote(target.split("#", 1)[0])
+            stem = strip_note_extension(target, file_exts)
+            if stem == target:
+                # Not a link to a note
+                continue
+            if stem.startswith("/"):
+                path = posixpath.normpath(stem.lstrip("/"))
+            else:
+                path = posixpath.normpath(posixpath.join(source_dir, stem))
+            if path.startswith(".."):
+                continue
+            keys.add("p:" + fold(path))
+    return keys
+
+
+class NoteLinks(IdLists):
+    """
+    Link key -> ids of notes that link to it
+    """
+
+    def add_note(
+        self, doc_id: int, text: str, rel_path: str, file_exts: List[str]
+    ) -> None:
+        """
+        Record the notes that a new note links to
+        """
+        for key in extract_link_keys(text, rel_path, file_exts):
+            self.add(key, doc_id)
+
+    def linking_ids(self, rel_path: str, file_exts: List[str]) -> Set[int]:
+        """
+        Ids of notes that link to the note, by title or by path
+
+        >>> note_links = NoteLinks()
+        >>> note_links.add_note(1, "[[Setup]]", "a.md", ["md"])
+        >>> note_links.add_note(2, "[x](howto/setup.md)", "b.md", ["md"])
+        >>> note_links.linking_ids("howto/Setup.md", ["md"])
+        {1, 2}
+        """
+        ids: Set[int] = set()
+        for key in note_link_keys(rel_path, file_exts):
+            ids.update(self.get(key))
+        return ids
@@ -0,0 +1,139 @@
+"""
+Search engine performance counters
+
+Counters and latency samples are updated on every query,
+so updating them must stay cheap: percentiles and rates are only
+computed when they're displayed.
+"""
+import math
+import threading
+from collections import Counter, deque
+from typing import Deque, Optional
+
+
+# Number of most recent searches that latency percentiles are computed over
+LATENCY_WINDOW_SIZE = 200
+
+
+class LatencyWindow:
+    """
+    Rolling window of most recent latency samples, in seconds
+    """
+
+    def __init__(self, size: int = LATENCY_WINDOW_SIZE):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        """
+        Record a sample, pushing the oldest one out if the window is full
+        """
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        Nearest-rank percentile of the samples, None if there are none
+
+        >>> window = LatencyWindow()
+        >>> for ms in range(1, 101):
+        ...     window.add(ms / 1000)
+        >>> window.percentile(50), window.percentile(95)
+        (0.05, 0.095)
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        rank = max(1, math.ceil(pct / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+
+class Metrics:
+    """
+    Counters and latency windows of a running extension
+    """
+
+    def __init__(self):
+        self.counters: Counter = Counter()
+        # Counters are updated from the query worker thread too
+        self.lock = threading.Lock()
+        self.search_latency = LatencyWindow()
+        self.first_result_latency = LatencyWindow()
+        # How long queries currently wait for more keystrokes, in seconds
+        self.debounce_window = 0.0
+
+    def record_search(
+        self, seconds: float, first_result_seconds: Optional[float] = None
+    ) -> None:
+        """
+        Count a completed search, time to its final results and,
+        if partial results were shown first, time to those
+        """
+        self.count("searches")
+        self.search_latency.add(seconds)
+        self.first_result_latency.add(
+            seconds if first_result_seconds is None else first_result_seconds
+        )
+
+    def count(self, name: str) -> None:
+        """
+        Add one to a counter
+        """
+        with self.lock:
+            self.counters[name] += 1
+
+
+def hit_rate(hits: int, misses: int) -> Optional[float]:
+    """
+    Fraction of lookups that were hits, None if there were no lookups
+
+    >>> hit_rate(3, 1)
+    0.75
+    >>> hit_rate(0, 0) is None
+    True
+    """
+    total = hits + misses
+    return hits / total if total else None
+
+
+def format_bytes(size: float) -> str:
+    """
+    Human-readable size
+
+    >>> format_bytes(512)
+    '512 B'
+    >>> format_bytes(3 * 1024 * 1024)
+    '3.0 MiB'
+    """
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def format_ms(seconds: Optional[float]) -> str:
+    """
+    Latency in milliseconds, or a dash if unknown
+
+    >>> format_ms(0.0123)
+    '12.3 ms'
+    >>> format_ms(None)
+    '-'
+    """
+    if seconds is None:
+        return "-"
+    return f"{seconds * 1000:.1f} ms"
+
+
+def format_rate(rate: Optional[float]) -> str:
+    """
+    Percentage, or a dash if unknown
+
+    >>> format_rate(0.755)
+    '76%'
+    """
+    if rate is None:
+        return "-"
+    return f"{rate * 100:.0f}%"
@@ -0,0 +1,91 @@
+"""
+Pages of search results
+
+Searches rank all matching notes, but only a page of them is shown at a time.
+The ranked results of the latest search are kept, so that the next page
+is shown without searching again.
+"""
+from typing import List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+from ulauncher.api.shared.action.BaseAction import BaseAction
+from ulauncher.api.shared.action.RenderResultListAction import (
+    RenderResultListAction,
+)
+from .callable_action import callable_action
+from .items import MAX_RESULTS_VISIBLE, message_item, more_results_item, results_page
+from .search import SearchResultItem
+from . import query_command
+
+if TYPE_CHECKING:
+    from .extension import NotesNv  # noqa: F401
+
+
+class ResultCursor(NamedTuple):
+    """
+    Ranked results of the latest search, for paging through them
+    """
+
+    qcmd: query_command.QueryCommand
+    matches: List[SearchResultItem]
+
+
+class ResultPages:
+    """
+    Result items for a page of search results, and the results
+    of the latest search to page through
+    """
+
+    def __init__(self, notesnv: "NotesNv"):
+        self.notesnv = notesnv
+        self.cursor: Optional[ResultCursor] = None
+
+    def render_matches(
+        self,
+        qcmd: query_command.QueryCommand,
+        matches: List[SearchResultItem],
+        offset: int = 0,
+    ) -> BaseAction:
+        """
+        Turn a page of search results into result items for the query command
+        """
+        notesnv = self.notesnv
+        commands = notesnv.commands
+        if qcmd.cmd == "cp":
+            items = notesnv.items_copy_note_command(matches, offset)
+        elif qcmd.cmd == "related":
+            items = commands.items_note_command(
+                matches, "Related", commands.show_related_notes, offset
+            )
+        elif qcmd.cmd == "backlinks":
+            items = commands.items_note_command(
+                matches, "Backlinks", commands.show_backlinks, offset
+            )
+        elif qcmd.cmd == "peek":
+            items = commands.items_note_command(
+                matches, "Peek", commands.peek_note, offset
+            )
+        else:
+            items = notesnv.items_open_note_command(matches, qcmd.search_query, offset)
+        next_offset = offset + MAX_RESULTS_VISIBLE
+        if len(matches) > next_offset:
+            items.append(
+                more_results_item(
+                    len(matches) - next_offset,
+                    # Plain tuple, since action data is pickled by Ulauncher
+                    callable_action(self.show_more_results, tuple(qcmd), next_offset),
+                )
+            )
+        return RenderResultListAction(items)
+
+    def show_more_results(self, query: Tuple, offset: int) -> BaseAction:
+        """
+        Show the next page of results of the latest search,
+        without searching again
+        """
+        cursor = self.cursor
+        if cursor is None or tuple(cursor.qcmd) != query:
+            return RenderResultListAction(
+                [message_item("These results are out of date", "Search again")]
+            )
+        page = results_page(cursor.matches, offset)
+        self.notesnv.commands.prefetch_heads([match.filename for match in page])
+        return self.render_matches(cursor.qcmd, cursor.matches, offset)
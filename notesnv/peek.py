@@ -0,0 +1,133 @@
+"""
+Cache of the first lines of note files, for previews
+
+Previews of search results should show up without waiting for the disk,
+so heads of the notes that are likely to be previewed (top search results,
+recently modified notes) are read ahead of time in a background thread.
+Cached heads are checked against the file's modification time and size
+before they're used.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+from .compressed import open_note_file, DECOMPRESSION_ERRORS
+
+
+# How many lines of a note a preview shows
+PEEK_LINES = 10
+
+# How much of a note file is read for its preview
+HEAD_BYTES = 4096
+
+# How many note heads to keep
+MAX_HEADS = 256
+
+
+class Head(NamedTuple):
+    """
+    First lines of a note file, and the file's mtime and size when read
+    """
+
+    mtime: float
+    size: int
+    lines: List[str]
+
+
+def read_head(path: str, max_lines: int = PEEK_LINES) -> Head:
+    """
+    Read the first lines of a file, decompressing it if it's compressed.
+    Raises OSError.
+    """
+    stat = os.stat(path)
+    try:
+        with open_note_file(path) as f:
+            data = f.read(HEAD_BYTES)
+    except DECOMPRESSION_ERRORS as exc:
+        raise OSError(str(exc)) from exc
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    if len(data) == HEAD_BYTES and lines:
+        # Last line was probably cut off
+        lines[-1] += "…"
+    return Head(stat.st_mtime, stat.st_size, lines[:max_lines])
+
+
+class HeadCache:
+    """
+    Least recently used heads of note files, keyed by full path
+    """
+
+    def __init__(self, max_heads: int = MAX_HEADS):
+        self.max_heads = max_heads
+        self.heads: "OrderedDict[str, Head]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.executor: Optional[ThreadPoolExecutor] = None
+        # Prefetches that were superseded by a newer one stop early
+        self.generation = 0
+
+    def _cached(self, path: str) -> Optional[Head]:
+        """
+        Cached head, if file hasn't changed since it was read
+        """
+        with self.lock:
+            head = self.heads.get(path)
+        if head is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_mtime != head.mtime or stat.st_size != head.size:
+            return None
+        return head
+
+    def _store(self, path: str, head: Head) -> None:
+        with self.lock:
+            self.heads[path] = head
+            self.heads.move_to_end(path)
+            while len(self.heads) > self.max_heads:
+                self.heads.popitem(last=False)
+
+    def get(self, path: str) -> List[str]:
+        """
+        First lines of the file, from the cache if possible. Raises OSError.
+        """
+        head = self._cached(path)
+        if head is not None:
+            self.hits += 1
+            with self.lock:
+                if path in self.heads:
+                    self.heads.move_to_end(path)
+            return head.lines
+        self.misses += 1
+        head = read_head(path)
+        self._store(path, head)
+        return head.lines
+
+    def prefetch(self, paths: List[str]) -> None:
+        """
+        Read heads of the files that aren't cached yet, in the background
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="notesnv-peek"
+            )
+        self.generation += 1
+        self.executor.submit(self._fill, paths, self.generation)
+
+    def _fill(self, paths: List[str], generation: int) -> None:
+        for path in paths:
+            if generation != self.generation:
+                return
+            if self._cached(path) is not None:
+                continue
+            try:
+                self._store(path, read_head(path))
+            except OSError:
+                continue
+
+    def __len__(self) -> int:
+        return len(self.heads)
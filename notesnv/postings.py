@@ -0,0 +1,268 @@
+"""
+Compressed posting lists
+
+A posting list is the sorted list of ids of the notes that contain a term.
+It is stored as varint-encoded deltas between consecutive ids,
+so that most ids take up a single byte.
+
+Ids are unique and start at 1, so a delta can never be 0: a 0 byte is used
+to mark the start of a chunk of absolute ids. This way ids that are
+larger than any id already in the list can be appended without decoding it.
+
+Posting lists of rare terms can be moved out of memory into a temporary
+file (`SpilledPostings`). Only their terms stay in memory,
+packed into one newline-separated string.
+
+Notes that have a tag or link to a note are kept in plain arrays
+of ids (`IdLists`) instead: there are few of them, and they're read whole.
+"""
+import os
+import re
+import sys
+import tempfile
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+
+TERM_REGEX = re.compile(r"\w+")
+
+# Bytes that end an id in a posting list
+ID_END_BYTES = bytes(range(1, 0x80))
+
+
+def extract_terms(folded: str) -> Set[str]:
+    """
+    Unique words in (folded) text
+
+    >>> sorted(extract_terms("apt-get install apt"))
+    ['apt', 'get', 'install']
+    """
+    return set(TERM_REGEX.findall(folded))
+
+
+def encode_postings(ids: Iterable[int]) -> bytes:
+    """
+    Encode sorted ids as varint deltas
+
+    >>> encode_postings([1, 2, 300])
+    b'\\x01\\x01\\xaa\\x02'
+    """
+    out = bytearray()
+    prev = 0
+    for doc_id in ids:
+        delta = doc_id - prev
+        prev = doc_id
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def append_postings(data: bytes, ids: List[int]) -> bytes:
+    """
+    Append ids, all larger than the ones already in `data`
+
+    >>> decode_postings(append_postings(encode_postings([1, 5]), [7, 9]))
+    [1, 5, 7, 9]
+    """
+    if not data:
+        return encode_postings(ids)
+    return data + b"\x00" + encode_postings(ids)
+
+
+def postings_count(data: bytes) -> int:
+    """
+    Number of ids in a posting list, without decoding it: the last byte
+    of every id is below 0x80, and only chunk markers are 0
+
+    >>> postings_count(append_postings(encode_postings([1, 2, 300]), [400]))
+    4
+    """
+    return len(data) - len(data.translate(None, ID_END_BYTES))
+
+
+def decode_postings(data: bytes) -> List[int]:
+    """
+    Decode varint deltas back into ids
+
+    >>> decode_postings(encode_postings([1, 2, 300, 70000]))
+    [1, 2, 300, 70000]
+    """
+    ids = []
+    prev = 0
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        elif value == 0:
+            # Chunk of absolute ids starts here
+            prev = 0
+        else:
+            prev += value
+            ids.append(prev)
+            value = 0
+            shift = 0
+    return ids
+
+
+class SpilledPostings:
+    """
+    Posting lists stored in a temporary file, looked up by term substring
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.file_size = 0
+        # "\n"-separated terms, with a leading and trailing "\n"
+        self.vocab = "\n"
+        # Start of each term in `vocab`, and where its postings are in the file
+        self.term_starts = array("Q")
+        self.file_offsets = array("Q")
+        self.file_lengths = array("L")
+
+    def add(self, postings: Dict[str, bytes]) -> None:
+        """
+        Move posting lists into the file
+        """
+        terms = []
+        blob = bytearray()
+        pos = len(self.vocab)
+        for term, data in postings.items():
+            self.term_starts.append(pos)
+            self.file_offsets.append(self.file_size + len(blob))
+            self.file_lengths.append(len(data))
+            blob += data
+            terms.append(term)
+            pos += len(term) + 1
+        self.file.seek(self.file_size)
+        self.file.write(blob)
+        self.file.flush()
+        self.file_size += len(blob)
+        self.vocab += "\n".join(terms) + "\n" if terms else ""
+
+    def find_terms(self, piece: str) -> List[int]:
+        """
+        Ordinals of spilled terms that contain `piece`
+        """
+        ordinals = []
+        last = -1
+        i = self.vocab.find(piece)
+        while i != -1:
+            ordinal = bisect_right(self.term_starts, i) - 1
+            if ordinal != last:
+                ordinals.append(ordinal)
+                last = ordinal
+            # Continue from the next term
+            i = self.vocab.find("\n", i)
+            i = self.vocab.find(piece, i)
+        return ordinals
+
+    def find_term(self, term: str) -> Optional[int]:
+        """
+        Ordinal of the spilled term, None if it's not there
+        """
+        i = self.vocab.find("\n" + term + "\n")
+        if i == -1:
+            return None
+        return bisect_right(self.term_starts, i + 1) - 1
+
+    def term(self, ordinal: int) -> str:
+        """
+        Term by its ordinal
+        """
+        start = self.term_starts[ordinal]
+        end = self.vocab.find("\n", start)
+        return self.vocab[start:end]
+
+    def data(self, ordinal: int) -> bytes:
+        """
+        Load encoded posting list of the term from disk
+        """
+        return os.pread(
+            self.file.fileno(), self.file_lengths[ordinal], self.file_offsets[ordinal]
+        )
+
+    def read(self, ordinal: int) -> List[int]:
+        """
+        Load posting list of the term from disk
+        """
+        return decode_postings(self.data(ordinal))
+
+    def __len__(self) -> int:
+        return len(self.term_starts)
+
+    def memory_footprint(self) -> int:
+        """
+        Approximate number of bytes used in memory
+        """
+        return (
+            sys.getsizeof(self.vocab)
+            + sys.getsizeof(self.term_starts)
+            + sys.getsizeof(self.file_offsets)
+            + sys.getsizeof(self.file_lengths)
+        )
+
+
+class IdLists:
+    """
+    Ids of notes by key, in ascending order
+
+    Ids are only ever appended, so that the lists can be read while
+    they grow. Pruning replaces lists instead of changing them.
+    """
+
+    def __init__(self):
+        self.lists: Dict[str, array] = {}
+        # Approximate memory used by the lists and their keys
+        self.size = 0
+
+    def add(self, key: str, doc_id: int) -> None:
+        """
+        Append id, larger than the ones already in the list, to the key's list
+        """
+        ids = self.lists.get(key)
+        if ids is None:
+            ids = self.lists[sys.intern(key)] = array("I")
+            self.size += sys.getsizeof(key) + sys.getsizeof(ids)
+        ids.append(doc_id)
+        self.size += ids.itemsize
+
+    def get(self, key: str) -> Sequence[int]:
+        """
+        Ids of the key, empty if there are none
+        """
+        return self.lists.get(key, ())
+
+    def prune(self, dropped: Set[int]) -> None:
+        """
+        Take ids out of the lists that have them
+
+        >>> id_lists = IdLists()
+        >>> for key, doc_id in [("a", 1), ("b", 1), ("b", 2)]:
+        ...     id_lists.add(key, doc_id)
+        >>> id_lists.prune({1})
+        >>> sorted(id_lists.lists), list(id_lists.get("b"))
+        (['b'], [2])
+        """
+        if not dropped:
+            return
+        for key, ids in list(self.lists.items()):
+            if dropped.isdisjoint(ids):
+                continue
+            kept = array("I", (doc_id for doc_id in ids if doc_id not in dropped))
+            self.size -= (len(ids) - len(kept)) * ids.itemsize
+            if kept:
+                self.lists[key] = kept
+            else:
+                del self.lists[key]
+                self.size -= sys.getsizeof(key) + sys.getsizeof(ids)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.lists
+
+    def __len__(self) -> int:
+        return len(self.lists)
@@ -0,0 +1,127 @@
+"""
+Opt-in profiling of slow queries
+
+When enabled, every query runs under cProfile with tracemalloc tracing
+allocations. If a query takes longer than a threshold, its cProfile stats
+and top memory allocations are saved into a directory that only keeps
+the most recent few.
+
+When disabled, the only cost is checking that the profiler is None.
+"""
+import cProfile
+import functools
+import os
+import re
+import time
+import tracemalloc
+from typing import Any, Callable, TypeVar
+
+
+# How many slow queries to keep profiles for
+MAX_PROFILES = 20
+
+# How many top allocation sites to save
+TOP_ALLOCATIONS = 25
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def default_profiles_dir() -> str:
+    """
+    Where profiles go by default: under the XDG cache directory
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_dir, "ulauncher-notes-nv", "slow-queries")
+
+
+class SlowQueryProfiler:
+    """
+    Profile calls and save profiles of those slower than `threshold` seconds
+    """
+
+    def __init__(
+        self, threshold: float, directory: str, max_profiles: int = MAX_PROFILES
+    ):
+        self.threshold = threshold
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def run(self, label: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Call `func` under the profiler, save profile if it was slow
+        """
+        profile = cProfile.Profile()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot() if elapsed > self.threshold else None
+            if started_tracing:
+                tracemalloc.stop()
+            if snapshot is not None:
+                self.save(label, args, elapsed, profile, snapshot)
+
+    def save(
+        self,
+        label: str,
+        args: tuple,
+        elapsed: float,
+        profile: cProfile.Profile,
+        snapshot: tracemalloc.Snapshot,
+    ) -> str:
+        """
+        Write cProfile stats and allocations report, remove oldest profiles.
+        Returns path prefix of saved files.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{time.time_ns() % 10 ** 9:09d}"
+        safe_label = re.sub(r"[^a-zA-Z0-9_-]", "_", label)
+        prefix = os.path.join(self.directory, f"{stamp}-{safe_label}")
+
+        profile.dump_stats(prefix + ".prof")
+        with open(prefix + ".txt", "wt", encoding="utf-8") as f:
+            print(f"{label} took {elapsed * 1000:.1f} ms, args: {args!r}", file=f)
+            print(f"Top {TOP_ALLOCATIONS} allocations by line:", file=f)
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                print(stat, file=f)
+
+        self.rotate()
+        return prefix
+
+    def rotate(self) -> None:
+        """
+        Keep only files of the `max_profiles` most recent slow queries
+        """
+        prefixes = sorted(
+            set(os.path.splitext(fn)[0] for fn in os.listdir(self.directory))
+        )
+        for prefix in prefixes[: -self.max_profiles]:
+            for ext in [".prof", ".txt"]:
+                try:
+                    os.remove(os.path.join(self.directory, prefix + ext))
+                except OSError:
+                    pass
+
+
+def profiled(label: str) -> Callable[[F], F]:
+    """
+    Decorate a method to run under `self.profiler`, if it's not None
+    """
+
+    def decorator(method: F) -> F:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            return profiler.run(label, functools.partial(method, self), *args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
@@ -1,12 +1,13 @@
 """
 Parse user queries into "search query" and "command"
 """
-from typing import NamedTuple
+from typing import NamedTuple, Tuple
 import re
+from .tags import split_tags, strip_tags
 
 
 COMMAND_SEP = "|"
-KNOWN_COMMANDS = set(["cp"])
+KNOWN_COMMANDS = set(["cp", "stats", "related", "backlinks", "peek"])
 DEFAULT_COMMAND = "open"
 
 
@@ -17,12 +18,15 @@ class QueryCommand(NamedTuple):
 
     cmd: str
     search_query: str
+    # Folded #tags, without the "#", that are not part of `search_query`
+    tags: Tuple[str, ...] = ()
 
     def short(self) -> str:
         """
         Short str output of the tuple, for doctests
         """
-        return f"{self.cmd}: {self.search_query}"
+        tags = "".join(f" #{tag}" for tag in self.tags)
+        return f"{self.cmd}: {self.search_query}{tags}"
 
 
 def parse(query: str) -> QueryCommand:
@@ -48,14 +52,42 @@ def parse(query: str) -> QueryCommand:
     >>> parse(' |  cp  snippet apt get').short()
     'cp: snippet apt get'
 
+    ### related: find notes about the same topic as the selected note
+
+    >>> parse('asyncio | related').short()
+    'related: asyncio'
+
+    ### backlinks: find notes that link to the selected note
+
+    >>> parse('|backlinks setup guide').short()
+    'backlinks: setup guide'
+
+    ### peek: show the first lines of the selected note
+
+    >>> parse('meeting notes | peek').short()
+    'peek: meeting notes'
+
+    ### stats: show search engine performance metrics
+
+    >>> parse('|stats').short()
+    'stats: '
+
     ### Unrecognized command names are treated as 'open' command:
 
     >>> parse('zsh ref | blahbalh').short()
     'open: zsh ref'
+
+    ### #tags are separated from the search query
+
+    >>> parse('#Infra disk full #oncall').short()
+    'open: disk full #infra #oncall'
+
+    >>> parse('#infra | cp').short()
+    'cp:  #infra'
     """
 
     if COMMAND_SEP not in query:
-        return QueryCommand(DEFAULT_COMMAND, query)
+        return with_tags(QueryCommand(DEFAULT_COMMAND, query))
 
     query_chunk, cmd_chunk = [
         s.strip(" ") for s in query.split(COMMAND_SEP, maxsplit=1)
@@ -70,6 +102,18 @@ def parse(query: str) -> QueryCommand:
     cmd_chunk = cmd_chunk.lower()
 
     if cmd_chunk not in KNOWN_COMMANDS:
-        return QueryCommand(DEFAULT_COMMAND, query_chunk)
+        return with_tags(QueryCommand(DEFAULT_COMMAND, query_chunk))
+
+    return with_tags(QueryCommand(cmd_chunk, query_chunk))
 
-    return QueryCommand(cmd_chunk, query_chunk)
+
+def with_tags(qcmd: QueryCommand) -> QueryCommand:
+    """
+    Move #tags from the search query into their own field
+    """
+    if "#" not in qcmd.search_query:
+        return qcmd
+    tags = split_tags(qcmd.search_query)
+    if not tags:
+        return qcmd
+    return qcmd._replace(search_query=strip_tags(qcmd.search_query), tags=tuple(tags))
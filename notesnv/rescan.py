@@ -0,0 +1,121 @@
+"""
+Periodic stat-based rescans of the notes directory
+
+Meant for notes stored on NFS, SSHFS, or synced by Syncthing and the like,
+where changes made on another machine may not show up in the modification
+time of the parent directory right away, or at all. Instead, every note
+file's (mtime, size, inode) is periodically compared against the index,
+and only changed files are re-read. Rescans also run, less often,
+when searches check directories for changes, to find notes edited in place.
+
+Rescans run in a low-priority background thread, and their disk reads
+can be throttled to a number of bytes per second.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .index import NoteIndex  # noqa: F401
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between rescans when they aren't configured. Searches then only
+# check directories for changes (see `NoteIndex.refresh`), and rescans
+# find notes that were changed in place: until then, searches see their
+# previous text.
+DEFAULT_RESCAN_INTERVAL = 30
+
+# Niceness of the rescan thread, on systems that support per-thread priority
+RESCAN_NICENESS = 19
+
+
+# pylint: disable=too-few-public-methods
+class IoBudget:
+    """
+    Throttle I/O to a number of bytes per second by sleeping when ahead of it
+    """
+
+    def __init__(self, bytes_per_second: Optional[int]):
+        self.bytes_per_second = bytes_per_second
+        self.started = time.monotonic()
+        self.spent = 0
+
+    def spend(self, nbytes: int) -> None:
+        """
+        Account for I/O that's just been done, sleep if over the budget
+        """
+        if not self.bytes_per_second:
+            return
+        self.spent += nbytes
+        ahead = self.spent / self.bytes_per_second - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def lower_thread_priority() -> None:
+    """
+    Make the calling thread yield CPU (and, with the default I/O scheduler,
+    disk) to everything else. Only works on Linux, does nothing elsewhere.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), RESCAN_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+
+class PeriodicRescan:
+    """
+    Rescan note index every `interval` seconds in a background thread
+    """
+
+    def __init__(
+        self,
+        index: "NoteIndex",
+        interval: float,
+        io_bytes_per_second: Optional[int] = None,
+    ):
+        self.index = index
+        self.interval = interval
+        self.io_bytes_per_second = io_bytes_per_second
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start rescanning in the background
+        """
+        self.thread = threading.Thread(
+            target=self.run, name="notesnv-rescan", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop rescanning after the current rescan finishes
+        """
+        self.stopped.set()
+        self.index.dirs.rescan_wanted.set()
+
+    def run(self) -> None:
+        """
+        Rescan loop
+        """
+        lower_thread_priority()
+        # Also woken up early when a search asks for a rescan,
+        # see `NoteIndex.refresh`
+        while not self.stopped.is_set():
+            self.index.dirs.rescan_wanted.wait(self.interval)
+            if self.stopped.is_set():
+                break
+            started = time.perf_counter()
+            changed = self.index.rescan(IoBudget(self.io_bytes_per_second))
+            if changed:
+                logger.debug(
+                    "Rescan found %d changed notes in %.3fs",
+                    changed,
+                    time.perf_counter() - started,
+                )
@@ -1,14 +1,62 @@
 """
 Note searching functionality
 
-- Uses `grep` to search note contents
-- Uses `find` to search note titles
+- Uses `grep` to search note contents, and matches names of note files
+  found by walking the notes directory (skipping ignored files, see `ignore`)
+- Searches compressed notes, which `grep` can't, in Python
+  (see `compressed`)
+- Uses the in-memory `NoteIndex` instead once it's built
 """
 import subprocess
 import re
 import os
-from typing import NamedTuple, List, Optional, Tuple, Pattern
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    NamedTuple,
+    List,
+    Optional,
+    Tuple,
+    Pattern,
+    Dict,
+    Callable,
+    Sequence,
+    Set,
+    TYPE_CHECKING,
+)
 from functools import partial
+from .compressed import (
+    compression_suffixes,
+    read_note_text,
+    split_compressed,
+    strip_compression_suffix,
+)
+from .timing import stage_timer
+from .ignore import IgnoreRules, walk_note_files, MAX_NOTE_SIZE
+from .tags import extract_tags, grep_tag_pattern
+from .textfold import fold
+
+if TYPE_CHECKING:
+    from .index import NoteIndex  # noqa: F401
+
+
+# Command line length of a single `grep` call, well below the usual limits
+MAX_GREP_ARGS_BYTES = 128 * 1024
+
+# Only this much of a matching line is decoded and shown
+MAX_MATCH_LINE_BYTES = 4096
+
+# Most `grep` processes run at once on the cold path. Past this, searches
+# are bound by reading files rather than by matching them.
+MAX_GREP_JOBS = 8
+
+# Files aren't split between `grep` processes into shards smaller than this,
+# so that starting a process (about 1 ms) costs little next to searching
+# its shard (about 5 ms for 500 small notes). See `test_perf`.
+MIN_FILES_PER_SHARD = 500
+
+# With fewer results than this, matches of a spelling-corrected query are added
+FEW_RESULTS = 3
 
 
 class SearchResultItem(NamedTuple):  # pylint: disable=too-few-public-methods
@@ -23,6 +71,8 @@ class SearchResultItem(NamedTuple):  # pylint: disable=too-few-public-methods
     match_content: str
     match_content_lower: str
     match_summary: str
+    # Set when the note matched a spelling-corrected query instead
+    corrected_query: str = ""
 
 
 class SearchError(Exception):
@@ -36,29 +86,77 @@ class SearchError(Exception):
         self.details = details
 
 
-def grep_dir(
-    path: str, file_exts: List[str], pattern: str, grep_cmd: str = "grep"
-) -> List[Tuple[str, str]]:
+def walk_notes_dir(path: str, file_exts: List[str]) -> List[str]:
     """
-    Call `grep` recursively on a directory and return matching filenames and
-    first matching line of each file
+    List all note files in a directory tree, skipping ignored ones
+    """
+    files = walk_note_files(path, file_exts)
+    if files is None:
+        raise SearchError("Could not list note files", f"Cannot read {path}")
+    return files
+
+
+def file_batches(files: List[str], max_bytes: int) -> List[List[str]]:
+    """
+    Split files into batches small enough to be passed as command arguments
 
-    Only include files with certain extensions.
+    >>> file_batches(["a.txt", "b.txt", "c.txt"], 12)
+    [['a.txt', 'b.txt'], ['c.txt']]
+    >>> file_batches([], 12)
+    [[]]
+    """
+    batches: List[List[str]] = [[]]
+    size = 0
+    for fn in files:
+        if size + len(fn) + 1 > max_bytes and batches[-1]:
+            batches.append([])
+            size = 0
+        batches[-1].append(fn)
+        size += len(fn) + 1
+    return batches
+
+
+def default_grep_jobs() -> int:
+    """
+    How many `grep` processes to run at once: one per available CPU,
+    up to `MAX_GREP_JOBS`
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))  # type: ignore
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, min(MAX_GREP_JOBS, cpus))
+
+
+def grep_shards(files: List[str], jobs: int) -> List[List[str]]:
+    """
+    Split files into batches for `jobs` parallel `grep` processes:
+    at least one batch per process, if there are enough files,
+    and every batch small enough to be passed as command arguments
+
+    >>> [len(b) for b in grep_shards(["note.txt"] * 1200, 4)]
+    [600, 600]
+    >>> [len(b) for b in grep_shards(["note.txt"] * 1200, 1)]
+    [1200]
+    """
+    shards = max(1, min(jobs, len(files) // MIN_FILES_PER_SHARD))
+    total_bytes = sum(len(fn) + 1 for fn in files)
+    max_bytes = min(MAX_GREP_ARGS_BYTES, -(-total_bytes // shards))
+    return file_batches(files, max_bytes)
+
+
+def grep_batch(
+    path: str, batch: List[str], args: List[str], grep_cmd: str = "grep"
+) -> bytes:
+    """
+    Call `grep` with the given arguments on one batch of files
+    (relative to `path`) and return its output
     """
-    include_globs = ["--include=*.{}".format(e) for e in file_exts]
     try:
         ret = subprocess.run(
-            [
-                grep_cmd,
-                "--with-filename",
-                "--ignore-case",
-                "--recursive",
-                "--extended-regexp",
-                "--null",
-                "--max-count=1",
-            ]
-            + include_globs
-            + ["-e", pattern, path],
+            [grep_cmd] + args + ["--"] + batch,
+            cwd=path,
+            stdin=subprocess.DEVNULL,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             check=False,
@@ -68,82 +166,191 @@ def grep_dir(
 
     if ret.returncode == 2:
         raise SearchError(
-            "Could not search through note contents", ret.stderr.decode("utf-8")
+            "Could not search through note contents",
+            ret.stderr.decode("utf-8", errors="replace"),
         )
+    return ret.stdout
+
 
-    out = ret.stdout.decode("utf-8")
-    # Can't use .splitlines below because
-    # some of my files contain lines with weird linebreaks
-    lines = out.split("\n")
+def run_grep(
+    path: str,
+    files: List[str],
+    args: List[str],
+    grep_cmd: str = "grep",
+    jobs: Optional[int] = None,
+) -> List[bytes]:
+    """
+    Call `grep` with the given arguments on files (relative to `path`),
+    in batches that fit on the command line, and return output of each call,
+    in the order of the files.
+
+    Large file lists are split into shards searched by up to `jobs`
+    (by default, `default_grep_jobs()`) `grep` processes at once.
+    """
+    if jobs is None:
+        jobs = default_grep_jobs()
+    batches = grep_shards(files, jobs)
+    if len(batches) == 1 or jobs == 1:
+        return [grep_batch(path, batch, args, grep_cmd) for batch in batches]
+    with ThreadPoolExecutor(max_workers=min(jobs, len(batches))) as executor:
+        return list(
+            executor.map(lambda batch: grep_batch(path, batch, args, grep_cmd), batches)
+        )
+
+
+# Options past the pattern are keyword-only, so that callers name them
+def grep_dir(  # pylint: disable=too-many-arguments
+    path: str,
+    file_exts: List[str],
+    pattern: str,
+    grep_cmd: str = "grep",
+    *,
+    files: Optional[List[str]] = None,
+    jobs: Optional[int] = None,
+) -> List[Tuple[str, str]]:
+    """
+    Call `grep` on note files in a directory tree and return matching
+    filenames and first matching line of each file
+
+    Only include files with certain extensions. Note files are listed
+    by walking the directory, unless `files` (relative to `path`) are given.
+    Up to `jobs` `grep` processes search shards of the files in parallel.
+    Compressed files are searched in Python, so `pattern` must mean
+    the same as a Python regex.
+    """
+    if files is None:
+        files = walk_notes_dir(path, file_exts)
+    files, compressed = split_compressed(files)
+    args = [
+        "--with-filename",
+        "--ignore-case",
+        "--extended-regexp",
+        "--null",
+        "--max-count=1",
+        # Otherwise notes that aren't valid UTF-8 only match as "binary files"
+        "--binary-files=text",
+        "-e",
+        pattern,
+    ]
     matches = []
-    for line in lines:
-        if line:
-            fn, text = line.split("\x00", maxsplit=1)
-            matches.append((os.path.relpath(fn, path), text))
+    for output in run_grep(path, files, args, grep_cmd, jobs):
+        matches += parse_grep_records(output)
+    if compressed:
+        matches += search_compressed_files(path, compressed, pattern)
     return matches
 
 
-def file_exts_to_regex(exts: List[str], quoted: bool = False) -> str:
+def parse_grep_records(output: bytes) -> List[Tuple[str, str]]:
     """
-    Turn list of file extensions into one regex
-    """
-    quote = '"' if quoted else ""
-    globs = "|".join("\\.{}".format(re.escape(e)) for e in exts)
-    return f"^{quote}.+({globs}){quote}$"
+    Filenames and matching lines from the output of `grep --null`:
+    each record is a filename terminated by NUL, then the line up to "\\n".
 
+    Output is never decoded as a whole, only the slices that are shown:
+    filenames, the same way the OS does (so that they can be opened even
+    if they aren't valid UTF-8), and at most `MAX_MATCH_LINE_BYTES` of each
+    line, with invalid UTF-8 replaced. Lines are only split on "\\n",
+    since some notes contain other, weird line breaks.
 
-def name_chunks_to_find_args(chunks: List[str]) -> List[str]:
+    >>> parse_grep_records(b"a.txt\\x00hi\\rthere\\nb.txt\\x00bad \\xff\\n")
+    [('a.txt', 'hi\\rthere'), ('b.txt', 'bad \\ufffd')]
     """
-    Turn array of name chunks into a set of '-iname' args joined by '-a' predicate.
+    view = memoryview(output)
+    fs_encoding = sys.getfilesystemencoding()
+    records = []
+    start = 0
+    while start < len(output):
+        name_end = output.find(b"\x00", start)
+        if name_end == -1:
+            break
+        line_end = output.find(b"\n", name_end)
+        if line_end == -1:
+            line_end = len(output)
+        line_start = name_end + 1
+        shown_end = min(line_end, line_start + MAX_MATCH_LINE_BYTES)
+        records.append(
+            (
+                str(view[start:name_end], fs_encoding, "surrogateescape"),
+                str(view[line_start:shown_end], "utf-8", "replace"),
+            )
+        )
+        start = line_end + 1
+    return records
+
 
-    For example:
-    ["good"] becomes `-iname "*good*"`
-    ["py","note"] becomes `( -iname "*py*" -a -iname "*note*" )`
+def search_compressed_files(
+    path: str, files: List[str], pattern: str
+) -> List[Tuple[str, str]]:
+    """
+    Same as `grep_dir`, for compressed files: matching filenames
+    and first matching line of each file
     """
-    if len(chunks) == 1:
-        return ["-iname", f"*{chunks[0]}*"]
-    args = ["(", "-iname", f"*{chunks[0]}*"]
-    for chunk in chunks[1:]:
-        args += ["-a", "-iname", f"*{chunk}*"]
-    args += [")"]
-    return args
+    regex = re.compile(pattern, re.IGNORECASE)
+    matches = []
+    for fn in files:
+        try:
+            text = read_note_text(os.path.join(path, fn))
+        except OSError:
+            continue
+        match = regex.search(text)
+        if match is None:
+            continue
+        start = text.rfind("\n", 0, match.start()) + 1
+        end = text.find("\n", match.end())
+        if end == -1:
+            end = len(text)
+        matches.append((fn, text[start:end]))
+    return matches
 
 
-def find_dir(
-    path: str, file_exts: List[str], name_chunks: List[str], find_cmd: str = "find"
+def grep_tagged_files(
+    path: str,
+    files: List[str],
+    tags: Sequence[str],
+    grep_cmd: str = "grep",
+    jobs: Optional[int] = None,
 ) -> List[str]:
     """
-    Execute `find` on a directory and find all files that:
-    - have one of the extensions in `file_exts`
-    - have names that contain all `name_chunks` in any order
+    Those of the note files that contain all of the #tags.
+    Each tag narrows down the files that the next one is looked for in.
     """
-    try:
-        ret = subprocess.run(
-            [
-                find_cmd,
-                path,
-                "-type",
-                "f",
-                "-regextype",
-                "egrep",
-                "-iregex",
-                file_exts_to_regex(file_exts),
-            ]
-            + name_chunks_to_find_args(name_chunks),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=False,
-        )
-    except OSError as exc:
-        raise SearchError("Could not execute `find` system command", exc.strerror)
+    files, compressed = split_compressed(files)
+    tagged = []
+    for fn in compressed:
+        try:
+            if set(tags) <= extract_tags(read_note_text(os.path.join(path, fn))):
+                tagged.append(fn)
+        except OSError:
+            continue
+    for tag in tags:
+        if not files:
+            break
+        args = [
+            "--files-with-matches",
+            "--ignore-case",
+            "--extended-regexp",
+            "--null",
+            "--binary-files=text",
+            "-e",
+            grep_tag_pattern(tag),
+        ]
+        files = [
+            os.fsdecode(fn)
+            for output in run_grep(path, files, args, grep_cmd, jobs)
+            for fn in output.split(b"\x00")
+            if fn
+        ]
+    return files + tagged
 
-    if ret.returncode != 0:
-        raise SearchError("Could not search for note files", ret.stderr.decode("utf-8"))
 
-    return [
-        os.path.relpath(fpath, path)
-        for fpath in ret.stdout.decode("utf-8").splitlines()
-    ]
+def file_exts_to_regex(exts: List[str], quoted: bool = False) -> str:
+    """
+    Turn list of file extensions into one regex,
+    also matching compressed files with those extensions
+    """
+    quote = '"' if quoted else ""
+    globs = "|".join("\\.{}".format(re.escape(e)) for e in exts)
+    compressed = "|".join(re.escape(suffix) for suffix in compression_suffixes())
+    return f"^{quote}.+({globs})({compressed})?{quote}$"
 
 
 # pylint: disable=unused-argument
@@ -151,11 +358,16 @@ def ls_dir(path: str, file_exts: List[str], ls_cmd: str = "/bin/ls") -> List[str
     """
     Execute `ls` on a directory and return all files...
     - that have one of the extensions in `file_exts`
+    - that aren't ignored and not larger than `MAX_NOTE_SIZE`,
+      same as `walk_note_files`
     - sorted by modified time, most recent first
     """
     try:
         ret = subprocess.run(
-            [ls_cmd, "--quote-name", "-t", "-1", "--escape", "--quote-name", path],
+            # Long format without owner and group: mode, links, size, time, name,
+            # of the files that symbolic links point to
+            [ls_cmd, "-t", "-1", "-L", "-og", "--time-style=+%s"]
+            + ["--escape", "--quote-name", path],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             check=False,
@@ -163,17 +375,43 @@ def ls_dir(path: str, file_exts: List[str], ls_cmd: str = "/bin/ls") -> List[str
     except OSError as exc:
         raise SearchError("Could not execute `ls` system command", exc.strerror)
 
-    if ret.returncode != 0:
+    # 1 is for minor problems, such as broken symbolic links, which are skipped
+    if ret.returncode > 1:
         raise SearchError(
             "Could not get a directory listing", ret.stderr.decode("utf-8")
         )
 
     extensions_regex = file_exts_to_regex(file_exts, quoted=True)
-    return [
-        fn.strip('"')
-        for fn in ret.stdout.decode("utf-8").splitlines()
-        if re.fullmatch(extensions_regex, fn, re.IGNORECASE)
-    ]
+    rules = IgnoreRules.load(path)
+    files = []
+    for line in ret.stdout.decode("utf-8").splitlines():
+        fields = line.split(None, 4)
+        if len(fields) < 5 or not fields[2].isdigit():
+            continue
+        fn = fields[4]
+        if (
+            re.fullmatch(extensions_regex, fn, re.IGNORECASE)
+            and int(fields[2]) <= MAX_NOTE_SIZE
+            and not rules.is_ignored(fn.strip('"'), False)
+        ):
+            files.append(fn.strip('"'))
+    return files
+
+
+def summarized_match(text: str, match_start: int, match_end: int, ctx_len: int) -> str:
+    """
+    Summarize a line of text by leaving ctx_len characters around the match
+    and trimming the rest
+
+    >>> summarized_match("the quick brown fox jumps", 10, 15, 4)
+    '...ick brown fox...'
+    """
+    start = max(0, match_start - ctx_len)
+    end = min(len(text), match_end + ctx_len)
+    ctx = "..." if start > 0 else ""
+    ctx += text[start:end]
+    ctx += "..." if end < len(text) else ""
+    return ctx
 
 
 def summarized_content_match(text: str, ctx_word: str, ctx_len: int) -> str:
@@ -184,16 +422,15 @@ def summarized_content_match(text: str, ctx_word: str, ctx_len: int) -> str:
     i = text.find(ctx_word)
     if i == -1:
         return text
-    start = max(0, i - ctx_len)
-    end = min(len(text), i + len(ctx_word) + ctx_len)
-    ctx = "..." if start > 0 else ""
-    ctx += text[start:end]
-    ctx += "..." if end < len(text) else ""
-    return ctx
+    return summarized_match(text, i, i + len(ctx_word), ctx_len)
 
 
 def search_note_file_contents(
-    path: str, file_exts: List[str], query: str
+    path: str,
+    file_exts: List[str],
+    query: str,
+    files: Optional[List[str]] = None,
+    jobs: Optional[int] = None,
 ) -> List[SearchResultItem]:
     """
     Call `grep` and turn results into SearchResultItem's
@@ -201,7 +438,7 @@ def search_note_file_contents(
     args = query.lower().split(" ")
     pattern = ".+".join(re.escape(a) for a in args)
     full_path = os.path.expanduser(path)
-    grep_matches = grep_dir(full_path, file_exts, pattern)
+    grep_matches = grep_dir(full_path, file_exts, pattern, files=files, jobs=jobs)
     matches = []
     for fn, text in grep_matches:
         matches.append(
@@ -216,21 +453,73 @@ def search_note_file_contents(
     return matches
 
 
+def filter_titles(files: List[str], name_chunks: List[str]) -> List[str]:
+    """
+    Files with names that contain all `name_chunks` in any order,
+    case-insensitive
+
+    >>> filter_titles(["py/Python cheatsheet.txt", "py/pep8.txt"], ["che", "py"])
+    ['py/Python cheatsheet.txt']
+    """
+    chunks = [c.lower() for c in name_chunks]
+    return [
+        fn for fn in files if all(c in fn.rpartition(os.sep)[2].lower() for c in chunks)
+    ]
+
+
 def search_note_file_titles(
-    path: str, file_exts: List[str], query: str
+    path: str, file_exts: List[str], query: str, files: Optional[List[str]] = None
 ) -> List[SearchResultItem]:
     """
-    Call `find` and turn results into SearchResultItem's
+    Match names of note files (listed by walking the directory,
+    unless given) and turn results into SearchResultItem's
     """
     args = query.lower().split(" ")
-    full_path = os.path.expanduser(path)
-    find_matches = find_dir(full_path, file_exts, args)
+    if files is None:
+        files = walk_notes_dir(os.path.expanduser(path), file_exts)
+    find_matches = filter_titles(files, args)
     matches = []
     for fn in find_matches:
         matches.append(SearchResultItem(fn, fn.lower(), "", "", ""))
     return matches
 
 
+def search_note_titles_in_index(
+    index: "NoteIndex", query: str, within: Optional[Set[int]] = None
+) -> List[SearchResultItem]:
+    """
+    Look up note titles in the index and turn results into SearchResultItem's.
+    Only notes with ids in `within` are looked at, if it's given.
+    """
+    args = query.split(" ")
+    return [
+        SearchResultItem(note.filename, note.filename_folded, "", "", "")
+        for note in index.find_titles(args, within)
+    ]
+
+
+def search_note_contents_in_index(
+    index: "NoteIndex", query: str, within: Optional[Set[int]] = None
+) -> List[SearchResultItem]:
+    """
+    Search folded note contents in the index and turn results into
+    SearchResultItem's. *_lower properties are set to folded text.
+    Only notes with ids in `within` are looked at, if it's given.
+    """
+    args = index.fold(query).split(" ")
+    pattern = re.compile(".+".join(re.escape(a) for a in args))
+    return [
+        SearchResultItem(
+            m.filename,
+            m.filename_folded,
+            m.line,
+            m.line_folded,
+            summarized_match(m.line, m.start, m.end, 25),
+        )
+        for m in index.search_content(pattern, args, within)
+    ]
+
+
 def match_sort_key(word_boundary_regex: Pattern, match: SearchResultItem) -> Tuple:
     """
     Generate a tuple that can be used as a sorting key.
@@ -252,28 +541,155 @@ def match_sort_key(word_boundary_regex: Pattern, match: SearchResultItem) -> Tup
     )
 
 
-def search_notes(path: str, file_exts: List[str], query: str) -> List[SearchResultItem]:
+def rank_matches(
+    grep_matches: List[SearchResultItem],
+    find_matches: List[SearchResultItem],
+    query: str,
+    strip_accents: bool = False,
+) -> List[SearchResultItem]:
     """
-    Search note contents and titles, combine, dedup and sort results.
+    Combine content and title matches, dedup and sort them
     """
-    grep_matches = search_note_file_contents(path, file_exts, query)
-    find_matches = search_note_file_titles(path, file_exts, query)
-    # dont include `find` matches for the same fn that appeared in `grep` matches
+    # dont include title matches for the same fn that appeared in content matches
     grep_fns = set(m.filename for m in grep_matches)
     matches = grep_matches + [m for m in find_matches if m.filename not in grep_fns]
-    args = query.split(" ")
+    args = fold(query, strip_accents).split(" ")
     word_boundary_regex = re.compile("\\b{}".format(re.escape(args[0])))
     return list(sorted(matches, key=partial(match_sort_key, word_boundary_regex)))
 
 
+# Options past the query are keyword-only, so that callers name them
+def search_notes(  # pylint: disable=too-many-arguments
+    path: str,
+    file_exts: List[str],
+    query: str,
+    *,
+    timings: Optional[Dict[str, float]] = None,
+    index: Optional["NoteIndex"] = None,
+    on_titles: Optional[Callable[[List[SearchResultItem]], None]] = None,
+    tags: Sequence[str] = (),
+    jobs: Optional[int] = None,
+) -> List[SearchResultItem]:
+    """
+    Search note titles and contents, combine, dedup and sort results.
+
+    If `timings` dict is given, time spent in each stage of the search
+    ("titles", "content", "rank") is added to it, in seconds.
+
+    Notes are looked up in `index` if it's given and ready,
+    otherwise the directory is walked once (see `ignore`) and
+    the note files found are matched by name and by calling `grep`,
+    with up to `jobs` processes searching shards of the files in parallel.
+
+    If (folded) `tags` are given, only notes that have all of them are
+    searched. When the query has nothing but tags, those notes are the results
+    and their contents aren't searched at all.
+
+    Title search is usually much faster than content search, so titles are
+    searched first, and if `on_titles` is given, it's called with sorted
+    title matches before content search starts.
+
+    If the index finds only a few notes, notes matching the query with
+    misspelled words corrected are added after them.
+    """
+    if index is not None and not index.is_ready():
+        index = None
+    strip_accents = index.strip_accents if index is not None else False
+    full_path = os.path.expanduser(path)
+    files = None
+    within = None
+    if index is None:
+        with stage_timer(timings, "walk"):
+            files = walk_notes_dir(full_path, file_exts)
+    if tags:
+        with stage_timer(timings, "tags"):
+            if index is not None:
+                within = index.ids_with_tags(tags)
+            else:
+                files = grep_tagged_files(full_path, files or [], tags, jobs=jobs)
+        if not query.strip():
+            return tagged_matches(index, within, files, tags)
+    with stage_timer(timings, "titles"):
+        if index is not None:
+            find_matches = search_note_titles_in_index(index, query, within)
+        else:
+            find_matches = search_note_file_titles(path, file_exts, query, files)
+    if on_titles is not None:
+        on_titles(rank_matches([], find_matches, query, strip_accents))
+    with stage_timer(timings, "content"):
+        if index is not None:
+            grep_matches = search_note_contents_in_index(index, query, within)
+        else:
+            grep_matches = search_note_file_contents(
+                path, file_exts, query, files, jobs
+            )
+    with stage_timer(timings, "rank"):
+        matches = rank_matches(grep_matches, find_matches, query, strip_accents)
+    if index is not None and len(matches) < FEW_RESULTS:
+        with stage_timer(timings, "spelling"):
+            matches += search_corrected_query(index, query, matches, within)
+    return matches
+
+
+def tagged_matches(
+    index: Optional["NoteIndex"],
+    within: Optional[Set[int]],
+    files: Optional[List[str]],
+    tags: Sequence[str],
+) -> List[SearchResultItem]:
+    """
+    Results of a query that only has tags: notes with ids `within`,
+    if the index was used, or `files` otherwise. Sorted by filename.
+    """
+    summary = " ".join(f"#{tag}" for tag in tags)
+    if index is not None:
+        matches = [
+            SearchResultItem(note.filename, note.filename_folded, "", "", summary)
+            for note in index.tagged_notes(within or set())
+        ]
+    else:
+        matches = [
+            SearchResultItem(fn, fn.lower(), "", "", summary) for fn in files or []
+        ]
+    return sorted(matches, key=lambda m: m.filename_lower)
+
+
+def search_corrected_query(
+    index: "NoteIndex",
+    query: str,
+    matches: List[SearchResultItem],
+    within: Optional[Set[int]] = None,
+) -> List[SearchResultItem]:
+    """
+    Matches of the query with misspelled words corrected,
+    except for notes that are already in `matches`
+    """
+    corrected_words = index.correct_spelling(index.fold(query).split(" "))
+    if corrected_words is None:
+        return []
+    corrected = " ".join(corrected_words)
+    seen = set(m.filename for m in matches)
+    return [
+        m._replace(corrected_query=corrected)
+        for m in rank_matches(
+            search_note_contents_in_index(index, corrected, within),
+            search_note_titles_in_index(index, corrected, within),
+            corrected,
+            index.strip_accents,
+        )
+        if m.filename not in seen
+    ]
+
+
 def contains_filename_match(
     matches: List[SearchResultItem], filename: str, extensions: List[str]
 ) -> bool:
     """
-    Whether search results contain given filename with one of possible extensions.
+    Whether search results contain given filename with one of possible extensions,
+    compressed or not.
     """
     possible_fns = set(f"{filename.lower()}.{ext.lower()}" for ext in extensions)
     for match in matches:
-        if match.filename_lower in possible_fns:
+        if strip_compression_suffix(match.filename_lower) in possible_fns:
             return True
     return False
@@ -0,0 +1,762 @@
+"""
+Segments of the note index, and their merging in the background
+
+Notes are indexed in batches (a build, a refresh, a rescan, a note saved
+by the extension), and each batch becomes a segment: the notes read in it,
+with consecutive ids, and the posting lists of their terms. Published
+segments are never changed in place. A note that goes away, or is read
+again into a newer segment because it changed, is only marked as deleted
+(a tombstone) in its old segment. So an update costs as much as the notes
+that changed, not as much as the whole index.
+
+Small segments pile up that way, and tombstones take up memory, so segments
+are merged in a background thread, as in a log-structured merge tree:
+runs of `MERGE_FACTOR` adjacent segments of about the same size are merged
+into one, and segments that are mostly tombstones are rewritten without them.
+Posting lists of segments without tombstones are concatenated as they are
+(see `postings.append_postings`), only the others are decoded and filtered.
+Lists spilled to disk stay there: they're merged a batch at a time
+into the merged segment's own spilled lists.
+Merges read and write at most `MERGE_BYTES_PER_SECOND` of posting lists.
+
+Updates go through a `SegmentWriter`, which copies the parts of published
+segments it changes on first write, and publish `IndexSnapshot`s
+of the segments (see `SegmentStore`).
+"""
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_right
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    TYPE_CHECKING,
+)
+from .postings import (
+    SpilledPostings,
+    append_postings,
+    decode_postings,
+    encode_postings,
+)
+from .rescan import IoBudget, lower_thread_priority
+
+if TYPE_CHECKING:
+    from .index import NoteEntry, NoteIndex  # noqa: F401
+
+
+logger = logging.getLogger(__name__)
+
+# Merge pending posting list additions once this many ids are waiting
+PENDING_MERGE_THRESHOLD = 1_000_000
+
+# How many segments of the same level are merged at once
+MERGE_FACTOR = 8
+
+# Segments with a larger share of deleted notes are rewritten without them
+MAX_DELETED_SHARE = 0.3
+
+# Throttle of background merges, in bytes of posting lists read and written
+MERGE_BYTES_PER_SECOND = 32 * 1024 * 1024
+
+# Merged spilled posting lists are written to disk in batches this large
+SPILL_BATCH_BYTES = 1024 * 1024
+
+# How many query words to remember the in-memory terms of
+LOOKUP_CACHE_SIZE = 256
+
+
+class Segment(NamedTuple):
+    """
+    Notes read in one batch, with ids starting at `first_id`,
+    and posting lists of their terms: `postings` in memory,
+    `spilled` moved to disk
+
+    Ids of deleted notes are in `deleted`. Their entries stay
+    in `notes` and `filenames_by_id` until the segment is merged.
+    """
+
+    first_id: int
+    notes: Dict[str, "NoteEntry"]
+    filenames_by_id: Dict[int, str]
+    postings: Dict[str, bytes]
+    spilled: Optional[SpilledPostings]
+    deleted: Set[int]
+    # Approximate memory used by `postings`, terms included
+    postings_size: int
+
+
+def new_segment(first_id: int) -> Segment:
+    """
+    Empty segment for notes with ids from `first_id` on
+    """
+    return Segment(first_id, {}, {}, {}, None, set(), 0)
+
+
+def postings_size(postings: Dict[str, bytes]) -> int:
+    """
+    Approximate memory used by posting lists and their terms
+    """
+    return sum(
+        sys.getsizeof(term) + sys.getsizeof(data) for term, data in postings.items()
+    )
+
+
+def append_pending(segment: Segment, pending: Dict[str, List[int]]) -> Segment:
+    """
+    Segment with ids of new notes appended to posting lists of their terms.
+    Only for the segment that is open for new notes, which isn't published:
+    its posting lists are changed in place.
+    """
+    postings = segment.postings
+    for term, ids in pending.items():
+        postings[term] = append_postings(postings.get(term, b""), ids)
+    return segment._replace(postings_size=postings_size(postings))
+
+
+def note_count(segment: Segment) -> int:
+    """
+    Number of notes in the segment that haven't been deleted
+    """
+    return len(segment.filenames_by_id) - len(segment.deleted)
+
+
+def find_note(
+    segments: Sequence[Segment], filename: str
+) -> Tuple[int, Optional["NoteEntry"]]:
+    """
+    Note that hasn't been deleted, and the position of its segment.
+    A file has at most one such note, in the newest segment it's in.
+    """
+    for i in range(len(segments) - 1, -1, -1):
+        segment = segments[i]
+        note = segment.notes.get(filename)
+        if note is not None and note.doc_id not in segment.deleted:
+            return i, note
+    return -1, None
+
+
+def segment_note_ids(segment: Segment, term: str) -> List[int]:
+    """
+    Ids of the segment's notes that have the term, deleted ones included
+    """
+    data = segment.postings.get(term)
+    if data is not None:
+        return decode_postings(data)
+    if segment.spilled is not None:
+        ordinal = segment.spilled.find_term(term)
+        if ordinal is not None:
+            return segment.spilled.read(ordinal)
+    return []
+
+
+def term_note_count(segments: Sequence[Segment], term: str) -> int:
+    """
+    Number of notes that have the term, not counting deleted ones
+    """
+    count = 0
+    for segment in segments:
+        ids = segment_note_ids(segment, term)
+        deleted = segment.deleted
+        count += (
+            sum(1 for doc_id in ids if doc_id not in deleted) if deleted else len(ids)
+        )
+    return count
+
+
+def iter_notes(segments: Sequence[Segment]) -> Iterator["NoteEntry"]:
+    """
+    Notes that haven't been deleted, oldest segment first
+    """
+    for segment in segments:
+        deleted = segment.deleted
+        if deleted:
+            yield from (n for n in segment.notes.values() if n.doc_id not in deleted)
+        else:
+            yield from segment.notes.values()
+
+
+class IndexSnapshot(NamedTuple):
+    """
+    Published state of the index: its segments, oldest first.
+    Never modified after it's published.
+    """
+
+    segments: Tuple[Segment, ...]
+    # First id of each segment, to find the segment of an id
+    first_ids: List[int]
+    note_count: int
+    vocabulary_version: int
+
+    def note(self, filename: str) -> Optional["NoteEntry"]:
+        """
+        Note of the file, if it's in the index
+        """
+        return find_note(self.segments, filename)[1]
+
+    def note_by_id(self, doc_id: int) -> Optional["NoteEntry"]:
+        """
+        Note with the id, if it's still in the index
+        """
+        i = bisect_right(self.first_ids, doc_id) - 1
+        if i < 0:
+            return None
+        segment = self.segments[i]
+        filename = segment.filenames_by_id.get(doc_id)
+        if filename is None or doc_id in segment.deleted:
+            return None
+        return segment.notes[filename]
+
+    def notes_by_ids(self, ids: Iterable[int]) -> List["NoteEntry"]:
+        """
+        Notes with the ids that are still in the index, in id order
+        """
+        found = []
+        for doc_id in sorted(ids):
+            note = self.note_by_id(doc_id)
+            if note is not None:
+                found.append(note)
+        return found
+
+    def live_ids(self, ids: Iterable[int]) -> Set[int]:
+        """
+        Ids of notes that are still in the index
+        """
+        return {doc_id for doc_id in ids if self.note_by_id(doc_id) is not None}
+
+    def iter_notes(self) -> Iterator["NoteEntry"]:
+        """
+        All notes in the index
+        """
+        return iter_notes(self.segments)
+
+    def filenames(self) -> List[str]:
+        """
+        File names of all notes in the index
+        """
+        return [note.filename for note in iter_notes(self.segments)]
+
+
+# pylint: disable=too-few-public-methods
+class TermLookup:
+    """
+    In-memory terms that contain query words, cached for as long as
+    the vocabulary doesn't change. Terms found earlier for a part of a word
+    are narrowed down instead of scanning the whole vocabulary,
+    which keeps typing fast.
+    """
+
+    def __init__(self):
+        # Query word -> in-memory terms that contain it
+        self.cache: Dict[str, List[str]] = {}
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def hot_terms(self, snapshot: IndexSnapshot, word: str) -> List[str]:
+        """
+        In-memory terms of the snapshot that contain the word
+        """
+        if self.version != snapshot.vocabulary_version:
+            self.cache = {}
+            self.version = snapshot.vocabulary_version
+        cache = self.cache
+        terms = cache.get(word)
+        if terms is not None:
+            self.hits += 1
+            return terms
+        narrowest: Optional[List[str]] = None
+        for cached_word, cached_terms in list(cache.items()):
+            if cached_word in word and (
+                narrowest is None or len(cached_terms) < len(narrowest)
+            ):
+                narrowest = cached_terms
+        if narrowest is not None:
+            self.hits += 1
+            terms = [t for t in narrowest if word in t]
+        else:
+            self.misses += 1
+            found: Set[str] = set()
+            for segment in snapshot.segments:
+                found.update([t for t in segment.postings if word in t])
+            terms = list(found)
+        if len(cache) >= LOOKUP_CACHE_SIZE:
+            cache.clear()
+        cache[word] = terms
+        return terms
+
+
+def merge_level(notes: int) -> int:
+    """
+    Segments with the same number of digits in their note count
+    (in base `MERGE_FACTOR`) are merged together
+
+    >>> [merge_level(n) for n in (0, 7, 8, 63, 64, 5000)]
+    [0, 0, 1, 1, 2, 4]
+    """
+    level = 0
+    while notes >= MERGE_FACTOR:
+        notes //= MERGE_FACTOR
+        level += 1
+    return level
+
+
+def pick_merge(segments: Sequence[Segment]) -> Optional[Tuple[int, int]]:
+    """
+    Start and end of the segments to merge next: the first segment
+    that is mostly tombstones, or else the first `MERGE_FACTOR` adjacent
+    segments of the same level. None if there's nothing to merge.
+    """
+    for i, segment in enumerate(segments):
+        if len(segment.deleted) > MAX_DELETED_SHARE * len(segment.filenames_by_id):
+            return i, i + 1
+    run_start = 0
+    run_level = -1
+    for i, segment in enumerate(segments):
+        level = merge_level(note_count(segment))
+        if level != run_level:
+            run_start = i
+            run_level = level
+        elif i + 1 - run_start == MERGE_FACTOR:
+            return run_start, i + 1
+    return None
+
+
+class SpilledPart(NamedTuple):
+    """
+    Posting list of a term that a segment spilled to disk
+    """
+
+    spilled: SpilledPostings
+    ordinal: int
+
+
+# Posting list of a term in a segment being merged, and the segment's
+# deleted ids
+PostingsPart = Tuple[Set[int], Union[bytes, SpilledPart]]
+
+
+def _merge_parts(parts: List[PostingsPart], io_budget: Optional[IoBudget]) -> bytes:
+    """
+    One posting list out of the lists of a term in adjacent segments,
+    oldest first, without ids of deleted notes
+    """
+    datas = []
+    for deleted, part in parts:
+        if isinstance(part, SpilledPart):
+            data = part.spilled.data(part.ordinal)
+            if io_budget:
+                io_budget.spend(len(data))
+        else:
+            data = part
+        if deleted:
+            data = encode_postings(
+                [doc_id for doc_id in decode_postings(data) if doc_id not in deleted]
+            )
+            if not data:
+                continue
+        datas.append(data)
+        if io_budget:
+            io_budget.spend(len(data))
+    # Ids of later segments are larger, so their lists can be appended as is
+    return b"\x00".join(datas)
+
+
+def _postings_parts(
+    segments: Sequence[Segment],
+) -> Tuple[Dict[str, List[PostingsPart]], Set[str]]:
+    """
+    Posting lists of each term in the segments, oldest first,
+    and the terms that any of the segments spilled
+    """
+    parts: Dict[str, List[PostingsPart]] = {}
+    spilled_terms: Set[str] = set()
+    for segment in segments:
+        deleted = segment.deleted
+        for term, data in segment.postings.items():
+            parts.setdefault(term, []).append((deleted, data))
+        if segment.spilled is not None:
+            for ordinal in range(len(segment.spilled)):
+                term = segment.spilled.term(ordinal)
+                part = SpilledPart(segment.spilled, ordinal)
+                parts.setdefault(term, []).append((deleted, part))
+                spilled_terms.add(term)
+    return parts, spilled_terms
+
+
+def _merge_postings(
+    segments: Sequence[Segment], io_budget: Optional[IoBudget]
+) -> Tuple[Dict[str, bytes], Optional[SpilledPostings]]:
+    """
+    Merged posting lists of the segments' terms, in memory
+    and spilled, for terms that any of the segments spilled
+    """
+    parts, spilled_terms = _postings_parts(segments)
+    postings = {}
+    spilled = SpilledPostings() if spilled_terms else None
+    batch: Dict[str, bytes] = {}
+    batch_size = 0
+    for term, term_parts in parts.items():
+        data = _merge_parts(term_parts, io_budget)
+        if not data:
+            continue
+        if spilled is None or term not in spilled_terms:
+            postings[term] = data
+            continue
+        batch[term] = data
+        batch_size += len(data)
+        if batch_size >= SPILL_BATCH_BYTES:
+            spilled.add(batch)
+            batch = {}
+            batch_size = 0
+    if spilled is not None:
+        spilled.add(batch)
+    return postings, spilled
+
+
+def merge_segments(
+    segments: Sequence[Segment], io_budget: Optional[IoBudget] = None
+) -> Segment:
+    """
+    One segment with the notes of adjacent `segments` that haven't been
+    deleted, and their posting lists. Terms spilled in any of the segments
+    are spilled in the merged one too, a batch at a time, so that merging
+    doesn't read all spilled lists into memory.
+    """
+    notes: Dict[str, "NoteEntry"] = {}
+    filenames_by_id: Dict[int, str] = {}
+    for segment in segments:
+        for filename, note in segment.notes.items():
+            if note.doc_id not in segment.deleted:
+                notes[filename] = note
+                filenames_by_id[note.doc_id] = filename
+    postings, spilled = _merge_postings(segments, io_budget)
+    return Segment(
+        segments[0].first_id,
+        notes,
+        filenames_by_id,
+        postings,
+        spilled,
+        set(),
+        postings_size(postings),
+    )
+
+
+def catch_up(
+    merged: Segment, before: Sequence[Segment], after: Sequence[Segment]
+) -> None:
+    """
+    Apply to a freshly merged segment the deletions and evictions
+    that happened to its source segments (`before`, now `after`)
+    while they were being merged
+    """
+    for old, new in zip(before, after):
+        if new.deleted is not old.deleted:
+            merged.deleted.update(
+                doc_id
+                for doc_id in new.deleted - old.deleted
+                if doc_id in merged.filenames_by_id
+            )
+        if new.notes is not old.notes:
+            for filename, note in new.notes.items():
+                current = merged.notes.get(filename)
+                if (
+                    current is not None
+                    and current is not note
+                    and current.doc_id == note.doc_id
+                ):
+                    merged.notes[filename] = note
+
+
+class SegmentWriter:
+    """
+    Segments of the note index being updated
+
+    The last segment is open for new notes until it's sealed, with ids
+    of new notes waiting in `pending` to be appended to posting lists
+    of their terms. Published segments are copied before they're changed
+    (see `writable`), so that queries never see an update half done.
+    """
+
+    def __init__(self):
+        self.segments: List[Segment] = []
+        # Segments whose `deleted` (and `notes`) have been copied since
+        # they were last published, by first id
+        self.own_deleted: Set[int] = set()
+        self.own_notes: Set[int] = set()
+        self.next_id = 1
+        # Term -> ids of new notes not yet appended to its posting list
+        # in the open segment, None if no segment is open
+        self.pending: Optional[Dict[str, List[int]]] = None
+        self.pending_count = 0
+        # Changes whenever in-memory terms do
+        self.vocabulary_version = 0
+
+    def note(self, filename: str) -> Optional["NoteEntry"]:
+        """
+        Note of the file in the segments being updated
+        """
+        return find_note(self.segments, filename)[1]
+
+    def writable(self, i: int, notes: bool = False) -> Segment:
+        """
+        Segment with its `deleted` ids (and `notes`, if asked for) copied
+        if they are still shared with the published snapshot,
+        before changing them
+        """
+        segment = self.segments[i]
+        if segment.first_id not in self.own_deleted:
+            segment = segment._replace(deleted=set(segment.deleted))
+            self.own_deleted.add(segment.first_id)
+        if notes and segment.first_id not in self.own_notes:
+            segment = segment._replace(notes=dict(segment.notes))
+            self.own_notes.add(segment.first_id)
+        self.segments[i] = segment
+        return segment
+
+    def add_note(
+        self, note: "NoteEntry", terms: Set[str]
+    ) -> Tuple["NoteEntry", List[str]]:
+        """
+        Put a new note into the open segment, started on first use,
+        under the next id, and add the id to posting lists of its terms.
+        Returns the note with its id, and the terms that had no ids waiting.
+        """
+        if self.pending is None:
+            self.segments.append(new_segment(self.next_id))
+            self.own_deleted.add(self.next_id)
+            self.own_notes.add(self.next_id)
+            self.pending = {}
+        pending = self.pending
+        segment = self.segments[-1]
+        note = note._replace(doc_id=self.next_id, term_count=len(terms))
+        self.next_id += 1
+        segment.notes[note.filename] = note
+        segment.filenames_by_id[note.doc_id] = note.filename
+        added = []
+        for term in terms:
+            ids = pending.get(term)
+            if ids is None:
+                term = sys.intern(term)
+                pending[term] = [note.doc_id]
+                added.append(term)
+            else:
+                ids.append(note.doc_id)
+        if added:
+            self.vocabulary_version += 1
+        self.pending_count += len(terms)
+        if self.pending_count >= PENDING_MERGE_THRESHOLD:
+            self._merge_pending()
+        return note, added
+
+    def restore_note(self, note: "NoteEntry") -> None:
+        """
+        Put back a note removed during this update, where it was
+        """
+        i = bisect_right([s.first_id for s in self.segments], note.doc_id) - 1
+        restored = self.segments[i].notes.get(note.filename) is not note
+        segment = self.writable(i, notes=restored)
+        segment.deleted.discard(note.doc_id)
+        if restored:
+            segment.notes[note.filename] = note
+
+    def remove_note(self, filename: str) -> Optional["NoteEntry"]:
+        """
+        Mark the file's note deleted in its segment, and return it.
+        Its id stays in posting lists until the segment is merged.
+        """
+        i, note = find_note(self.segments, filename)
+        if note is not None:
+            self.writable(i).deleted.add(note.doc_id)
+        return note
+
+    def replace_note(self, filename: str, **changes) -> None:
+        """
+        Change fields of the file's note in place, keeping its id
+        """
+        i, note = find_note(self.segments, filename)
+        if note is not None:
+            self.writable(i, notes=True).notes[filename] = note._replace(**changes)
+
+    def _merge_pending(self) -> None:
+        """
+        Append pending ids to compressed posting lists of the open segment
+        """
+        if not self.pending:
+            return
+        self.segments[-1] = append_pending(self.segments[-1], self.pending)
+        self.pending = {}
+        self.pending_count = 0
+
+    def seal(self) -> None:
+        """
+        Close the open segment: new notes go into a new one from now on
+        """
+        if self.pending is not None:
+            self._merge_pending()
+            self.pending = None
+
+    def publish(self) -> Tuple[Segment, ...]:
+        """
+        Sealed segments to publish. They're copied again
+        before they're changed from now on.
+        """
+        self.seal()
+        self.own_deleted.clear()
+        self.own_notes.clear()
+        return tuple(self.segments)
+
+    def spill_rare_postings(self, max_len: int) -> None:
+        """
+        Move posting lists at most `max_len` bytes long of each segment
+        into a temporary file. Segments don't change once sealed,
+        so each is spilled only once.
+        """
+        spilled_any = False
+        for i, segment in enumerate(self.segments):
+            if segment.spilled is not None:
+                continue
+            rare = {
+                term: data
+                for term, data in segment.postings.items()
+                if len(data) <= max_len
+            }
+            if not rare:
+                continue
+            spilled = SpilledPostings()
+            spilled.add(rare)
+            postings = {
+                term: data
+                for term, data in segment.postings.items()
+                if term not in rare
+            }
+            self.segments[i] = segment._replace(
+                postings=postings,
+                spilled=spilled,
+                postings_size=postings_size(postings),
+            )
+            spilled_any = True
+        if spilled_any:
+            self.vocabulary_version += 1
+
+    def replace_merged(
+        self, start: int, end: int, merged: Segment, published: Sequence[Segment]
+    ) -> None:
+        """
+        Swap in the segment merged from `published`, the segments `start:end`
+        when it was started, with whatever was deleted or evicted since
+        """
+        # Published segments are only appended to, and replaced
+        # in place, until merged
+        current = self.segments[start:end]
+        catch_up(merged, published, current)
+        self.segments[start:end] = [merged] if merged.filenames_by_id else []
+        self.vocabulary_version += 1
+
+
+# pylint: disable=too-few-public-methods
+class SegmentStore:
+    """
+    Segments of the note index: the snapshot that queries read,
+    and the writer that updates go through
+
+    Updates hold `lock` and publish a new snapshot once they're done.
+    Queries read `snapshot` without locking. Merges hold `merge_lock`
+    and only take `lock` to swap the merged segment in.
+    """
+
+    def __init__(self):
+        self.writer = SegmentWriter()
+        self.lock = threading.Lock()
+        self.merge_lock = threading.Lock()
+        # Set when published segments need merging (see `SegmentMerger`)
+        self.merge_wanted = threading.Event()
+        # Set once a snapshot of all notes has been published
+        self.ready = threading.Event()
+        self.snapshot = IndexSnapshot((), [], 0, 0)
+        self.lookup = TermLookup()
+
+    def publish(self) -> None:
+        """
+        Make the writer's changes visible to queries, all at once
+        """
+        writer = self.writer
+        segments = writer.publish()
+        published = self.snapshot
+        if (
+            len(segments) == len(published.segments)
+            and all(a is b for a, b in zip(segments, published.segments))
+            and writer.vocabulary_version == published.vocabulary_version
+        ):
+            return
+        self.snapshot = IndexSnapshot(
+            segments,
+            [segment.first_id for segment in segments],
+            sum(note_count(segment) for segment in segments),
+            writer.vocabulary_version,
+        )
+        if pick_merge(segments) is not None:
+            self.merge_wanted.set()
+
+
+class SegmentMerger:
+    """
+    Merge segments of the note index in a background thread
+    whenever updates leave it with segments to merge
+    """
+
+    def __init__(
+        self,
+        index: "NoteIndex",
+        io_bytes_per_second: Optional[int] = MERGE_BYTES_PER_SECOND,
+    ):
+        self.index = index
+        self.io_bytes_per_second = io_bytes_per_second
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start merging in the background
+        """
+        self.thread = threading.Thread(
+            target=self.run, name="notesnv-merge", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop merging after the current merge finishes
+        """
+        self.stopped.set()
+        self.index.store.merge_wanted.set()
+
+    def run(self) -> None:
+        """
+        Merge loop
+        """
+        lower_thread_priority()
+        while True:
+            self.index.store.merge_wanted.wait()
+            if self.stopped.is_set():
+                return
+            self.index.store.merge_wanted.clear()
+            io_budget = IoBudget(self.io_bytes_per_second)
+            while not self.stopped.is_set():
+                started = time.perf_counter()
+                merged = self.index.merge(io_budget)
+                if not merged:
+                    break
+                logger.debug(
+                    "Merged %d index segments in %.3fs",
+                    merged,
+                    time.perf_counter() - started,
+                )
@@ -0,0 +1,193 @@
+"""
+Spelling correction of query words against the indexed vocabulary
+
+Uses a deletion dictionary (as in SymSpell): every term is stored under
+itself and under each variant with one character deleted. A misspelled
+word is looked up the same way, so that candidates within two edits
+(including swapped adjacent characters) are found with a fixed number
+of hash lookups, whatever the size of the vocabulary. Candidates are
+then checked by actual edit distance.
+
+Only the first `PREFIX_LEN` characters of terms are used for deletions,
+which bounds the number of entries per term. To keep memory down,
+the dictionary is a hash table of chained entries packed into arrays
+rather than a dict of lists.
+"""
+import sys
+from array import array
+from typing import Callable, Dict, List, Set
+
+
+# Only this many leading characters of a term are used for lookup
+PREFIX_LEN = 7
+
+# Shorter terms are neither indexed nor corrected
+MIN_TERM_LEN = 4
+
+INITIAL_BUCKETS = 1 << 12
+
+
+def deletion_keys(word: str) -> Set[str]:
+    """
+    Prefix of the word and its variants with one character deleted
+
+    >>> sorted(deletion_keys("cats"))
+    ['ats', 'cas', 'cat', 'cats', 'cts']
+    """
+    prefix = word[:PREFIX_LEN]
+    keys = {prefix}
+    for i in range(len(prefix)):
+        rest = i + 1
+        keys.add(prefix[:i] + prefix[rest:])
+    return keys
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Number of insertions, deletions, substitutions and swaps of adjacent
+    characters that turn `a` into `b`, or `max_distance + 1` if more
+
+    >>> edit_distance("kuberentes", "kubernetes", 2)
+    1
+    >>> edit_distance("kitten", "sitting", 2)
+    3
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev_prev: List[int] = []
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev_prev[j - 2] + 1)
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev_prev, prev = prev, cur
+    return min(prev[-1], max_distance + 1)
+
+
+def max_edits(word: str) -> int:
+    """
+    How many edits a word of this length is allowed to be off by
+
+    >>> max_edits("pyhton"), max_edits("kuberentes")
+    (1, 2)
+    """
+    return 1 if len(word) < 8 else 2
+
+
+class SpellingDictionary:
+    """
+    Deletion dictionary of terms
+    """
+
+    def __init__(self):
+        self.terms: List[str] = []
+        # Chained hash table: first entry of each bucket, and for each entry
+        # the next one in its bucket, its term and its key hash
+        self.heads = array("i", [-1]) * INITIAL_BUCKETS
+        self.next_entry = array("i")
+        self.entry_terms = array("i")
+        self.entry_hashes = array("i")
+
+    def _bucket(self, key_hash: int) -> int:
+        return key_hash & (len(self.heads) - 1)
+
+    def _grow(self) -> None:
+        """
+        Double the number of buckets and re-chain entries
+        """
+        self.heads = array("i", [-1]) * (len(self.heads) * 2)
+        for entry, key_hash in enumerate(self.entry_hashes):
+            bucket = self._bucket(key_hash)
+            self.next_entry[entry] = self.heads[bucket]
+            self.heads[bucket] = entry
+
+    def __contains__(self, term: str) -> bool:
+        key_hash = hash(term[:PREFIX_LEN]) & 0x7FFFFFFF
+        entry = self.heads[self._bucket(key_hash)]
+        while entry != -1:
+            if (
+                self.entry_hashes[entry] == key_hash
+                and self.terms[self.entry_terms[entry]] == term
+            ):
+                return True
+            entry = self.next_entry[entry]
+        return False
+
+    def add(self, term: str) -> None:
+        """
+        Make the term available as a correction, unless it already is
+        """
+        if len(term) < MIN_TERM_LEN or term in self:
+            return
+        ordinal = len(self.terms)
+        self.terms.append(term)
+        for key in deletion_keys(term):
+            key_hash = hash(key) & 0x7FFFFFFF
+            bucket = self._bucket(key_hash)
+            self.next_entry.append(self.heads[bucket])
+            self.entry_terms.append(ordinal)
+            self.entry_hashes.append(key_hash)
+            self.heads[bucket] = len(self.entry_hashes) - 1
+        if len(self.entry_hashes) > len(self.heads):
+            self._grow()
+
+    def candidates(self, word: str) -> Set[str]:
+        """
+        Terms that share a deletion key with the word (unchecked)
+        """
+        found = set()
+        for key in deletion_keys(word):
+            key_hash = hash(key) & 0x7FFFFFFF
+            entry = self.heads[self._bucket(key_hash)]
+            while entry != -1:
+                if self.entry_hashes[entry] == key_hash:
+                    found.add(self.terms[self.entry_terms[entry]])
+                entry = self.next_entry[entry]
+        return found
+
+    def suggest(
+        self, word: str, popularity: Callable[[str], int], limit: int = 1
+    ) -> List[str]:
+        """
+        Closest terms to a (misspelled) word, most popular first
+        among equally close ones. Terms are never taken out
+        of the dictionary, so those no note has any more
+        (of popularity 0) are skipped.
+        """
+        if len(word) < MIN_TERM_LEN:
+            return []
+        max_distance = max_edits(word)
+        distances: Dict[str, int] = {}
+        for term in self.candidates(word):
+            if term == word:
+                continue
+            distance = edit_distance(word, term, max_distance)
+            if distance <= max_distance:
+                distances[term] = distance
+        popularities = {term: popularity(term) for term in distances}
+        ordered = sorted(
+            (term for term in distances if popularities[term]),
+            key=lambda t: (distances[t], -popularities[t], t),
+        )
+        return ordered[:limit]
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def memory_footprint(self) -> int:
+        """
+        Approximate number of bytes used, not counting terms
+        which are shared with posting lists
+        """
+        return (
+            sys.getsizeof(self.terms)
+            + sys.getsizeof(self.heads)
+            + sys.getsizeof(self.next_entry)
+            + sys.getsizeof(self.entry_terms)
+            + sys.getsizeof(self.entry_hashes)
+        )
@@ -0,0 +1,111 @@
+"""
+Result items of the "stats" query command, showing how the search engine
+is doing (see `metrics`)
+"""
+from typing import List, Optional
+from ulauncher.api.shared.item.ResultItem import ResultItem
+from ulauncher.api.shared.item.ExtensionResultItem import ExtensionResultItem
+from ulauncher.api.shared.action.DoNothingAction import DoNothingAction
+from .index import NoteIndex
+from .metrics import Metrics, hit_rate, format_bytes, format_ms, format_rate
+from .peek import HeadCache
+
+
+def stat_item(name: str, description: str) -> ResultItem:
+    """
+    Result item showing one statistic
+    """
+    return ExtensionResultItem(
+        icon="images/notes-nv.svg",
+        name=name,
+        description=description,
+        on_enter=DoNothingAction(),
+        highlightable=False,
+    )
+
+
+def index_stats_items(
+    index: NoteIndex, ready_seconds: Optional[float]
+) -> List[ResultItem]:
+    """
+    Result items showing the size of a ready note index
+    and how well its caches work
+    """
+    footprint = ", ".join(
+        f"{part}: {format_bytes(size)}"
+        for part, size in index.memory_footprint().items()
+    )
+    budget = index.memory.budget
+    segments = index.snapshot.segments
+    lookup = index.store.lookup
+    return [
+        stat_item(
+            f"Notes: {len(index)}",
+            f"Index ready in {format_ms(ready_seconds)} after startup",
+        ),
+        stat_item(
+            f"Index memory: {format_bytes(index.memory_used())}"
+            + (f" of {format_bytes(budget)}" if budget else ""),
+            footprint,
+        ),
+        stat_item(
+            f"Index segments: {len(segments)}",
+            f"{sum(len(s.deleted) for s in segments)} deleted notes "
+            "not merged away yet",
+        ),
+        stat_item(
+            "Term lookup cache hit rate: "
+            + format_rate(hit_rate(lookup.hits, lookup.misses)),
+            f"{lookup.hits} hits, {lookup.misses} misses",
+        ),
+    ]
+
+
+def stats_items(
+    metrics: Metrics,
+    index: Optional[NoteIndex],
+    heads: HeadCache,
+    ready_seconds: Optional[float],
+) -> List[ResultItem]:
+    """
+    Result items showing how the search engine is doing: the note index
+    (if it's built), the preview cache, and latencies and counters of queries
+    """
+    if index is not None and index.is_ready():
+        items = index_stats_items(index, ready_seconds)
+    else:
+        items = [
+            stat_item(
+                "Notes: index is warming up",
+                "Searching with grep until it's ready",
+            )
+        ]
+
+    items.append(
+        stat_item(
+            "Preview cache hit rate: "
+            + format_rate(hit_rate(heads.hits, heads.misses)),
+            f"{heads.hits} hits, {heads.misses} misses, {len(heads)} notes cached",
+        )
+    )
+
+    latency = metrics.search_latency
+    first_latency = metrics.first_result_latency
+    items.append(
+        stat_item(
+            f"Search latency: p50 {format_ms(latency.percentile(50))}, "
+            f"p95 {format_ms(latency.percentile(95))}",
+            f"First results: p50 {format_ms(first_latency.percentile(50))}, "
+            f"p95 {format_ms(first_latency.percentile(95))}. "
+            f"Over the last {len(latency)} searches",
+        )
+    )
+    counters = metrics.counters
+    items.append(
+        stat_item(
+            f"Queries: {counters['searches']} searched, {counters['errors']} failed",
+            f"{counters['dropped']} dropped, {counters['cancelled']} cancelled. "
+            f"Waiting {format_ms(metrics.debounce_window)} for more keystrokes",
+        )
+    )
+    return items
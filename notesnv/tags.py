@@ -0,0 +1,110 @@
+"""
+#hashtags in notes and queries
+
+A tag is `#` followed by letters, digits, `_`, `-` or `/`, with at least one
+letter, that doesn't follow a word character (so that URL fragments like
+`page#section` aren't tags). Markdown headings (`# Title`) aren't tags
+either, since the `#` is followed by a space. Tags are case-insensitive.
+"""
+import re
+from typing import List, Sequence, Set
+from .postings import IdLists
+from .textfold import fold
+
+
+TAG_REGEX = re.compile(r"(?<![\w#&/])#((?=[\w/-]*[^\W\d_])[\w/-]+)")
+
+# Same as `TAG_REGEX`, for `grep --extended-regexp`
+GREP_TAG_PREFIX = "(^|[^[:alnum:]_#&/])#"
+GREP_TAG_SUFFIX = "([^[:alnum:]_/-]|$)"
+
+# Characters that are special in `grep --extended-regexp` patterns
+ERE_SPECIAL_REGEX = re.compile(r"([.\[\]()*+?{}|^$\\])")
+
+
+def extract_tags(text: str) -> Set[str]:
+    """
+    Folded tags in text
+
+    >>> sorted(extract_tags("# Notes\\n#Infra #on-call, see http://x.org/#anchor #42"))
+    ['infra', 'on-call']
+    """
+    if "#" not in text:
+        return set()
+    return set(fold(tag) for tag in TAG_REGEX.findall(text))
+
+
+def split_tags(query: str) -> List[str]:
+    """
+    Query words that are tags, folded and without `#`
+
+    >>> split_tags("#Infra disk #oncall")
+    ['infra', 'oncall']
+    """
+    return [fold(m.group(1)) for m in TAG_REGEX.finditer(query)]
+
+
+def strip_tags(query: str) -> str:
+    """
+    Query without tag words
+
+    >>> strip_tags("#infra disk  full #oncall")
+    'disk full'
+    """
+    return " ".join(TAG_REGEX.sub("", query).split())
+
+
+def escape_ere(text: str) -> str:
+    """
+    Text escaped to match itself in an extended regex. Unlike `re.escape`,
+    only escapes special characters: GNU grep warns about other ones
+    following a backslash.
+
+    >>> escape_ere("c++ on-call (v1.2)")
+    'c\\\\+\\\\+ on-call \\\\(v1\\\\.2\\\\)'
+    """
+    return ERE_SPECIAL_REGEX.sub(r"\\\1", text)
+
+
+def grep_tag_pattern(tag: str) -> str:
+    """
+    Extended regex that `grep --ignore-case` can find the tag with
+
+    >>> grep_tag_pattern("on-call")
+    '(^|[^[:alnum:]_#&/])#on-call([^[:alnum:]_/-]|$)'
+    """
+    return GREP_TAG_PREFIX + escape_ere(tag) + GREP_TAG_SUFFIX
+
+
+class NoteTags(IdLists):
+    """
+    Tag -> ids of notes that have it
+    """
+
+    def add_note(self, doc_id: int, text: str) -> None:
+        """
+        Record the tags of a new note
+        """
+        for tag in extract_tags(text):
+            self.add(tag, doc_id)
+
+    def ids_with_all(self, tags: Sequence[str]) -> Set[int]:
+        """
+        Ids of notes that have all of the (folded) tags.
+        Id lists are intersected starting from the shortest one.
+
+        >>> note_tags = NoteTags()
+        >>> note_tags.add_note(1, "#infra #oncall")
+        >>> note_tags.add_note(2, "#infra")
+        >>> note_tags.ids_with_all(["oncall", "infra"])
+        {1}
+        """
+        id_lists = sorted((self.get(tag) for tag in tags), key=len)
+        if not id_lists:
+            return set()
+        ids = set(id_lists[0])
+        for other in id_lists[1:]:
+            if not ids:
+                break
+            ids.intersection_update(other)
+        return ids
@@ -0,0 +1,93 @@
+"""
+Unicode case folding and diacritic stripping
+
+Text is folded once at index time. Folding can change the length of text
+("ß" becomes "ss", "é" may be stored as "e" + combining accent),
+so folded text comes with a map of offsets back into the original text,
+which is used to cut snippets out of the original.
+"""
+import unicodedata
+from array import array
+from typing import Optional, Tuple
+
+
+# Folded char offset -> original char offset, one extra entry for the end of text.
+# None means that folded text lines up with the original char for char.
+Offsets = Optional[array]
+
+
+def fold_char(char: str, strip_accents: bool) -> str:
+    """
+    Fold a single character
+
+    >>> fold_char("É", True)
+    'e'
+    >>> fold_char("É", False)
+    'é'
+    >>> fold_char("ß", False)
+    'ss'
+    """
+    folded = char.casefold()
+    if strip_accents:
+        folded = "".join(
+            c
+            for c in unicodedata.normalize("NFKD", folded)
+            if not unicodedata.combining(c)
+        )
+    return folded
+
+
+def fold(text: str, strip_accents: bool = False) -> str:
+    """
+    Case-fold text, optionally removing diacritics
+
+    >>> fold("Café Crème", strip_accents=True)
+    'cafe creme'
+    >>> fold("Café Crème")
+    'café crème'
+    """
+    if text.isascii():
+        return text.lower()
+    return "".join(fold_char(c, strip_accents) for c in text)
+
+
+def fold_with_offsets(text: str, strip_accents: bool = False) -> Tuple[str, Offsets]:
+    """
+    Fold text and map every folded character back to its original position
+
+    >>> folded, offsets = fold_with_offsets("Straße café", strip_accents=True)
+    >>> folded
+    'strasse cafe'
+    >>> text = "Straße café"
+    >>> start = folded.find("cafe")
+    >>> text[offsets[start]:offsets[start + len("cafe")]]
+    'café'
+    """
+    if text.isascii():
+        return text.lower(), None
+
+    folded_chunks = []
+    offsets = array("L")
+    # Most lines are usually plain ASCII even in non-ASCII notes
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        if line.isascii():
+            folded_chunks.append(line.lower())
+            offsets.extend(range(pos, pos + len(line)))
+        else:
+            for i, char in enumerate(line, start=pos):
+                folded_char = fold_char(char, strip_accents)
+                folded_chunks.append(folded_char)
+                offsets.extend([i] * len(folded_char))
+        pos += len(line)
+    offsets.append(len(text))
+    return "".join(folded_chunks), offsets
+
+
+def original_offset(offsets: Offsets, folded_offset: int) -> int:
+    """
+    Position in the original text that corresponds to position in folded text
+    """
+    if offsets is None:
+        return folded_offset
+    return offsets[folded_offset]
@@ -0,0 +1,29 @@
+"""
+Lightweight latency measurement helpers
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+
+@contextmanager
+def stage_timer(timings: Optional[Dict[str, float]], stage: str) -> Iterator[None]:
+    """
+    Measure how long the wrapped block takes and add it to `timings[stage]`
+    (in seconds). Does nothing if `timings` is None.
+
+    >>> timings = {}
+    >>> with stage_timer(timings, "sleep"):
+    ...     time.sleep(0.001)
+    >>> timings["sleep"] > 0
+    True
+    """
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings[stage] = timings.get(stage, 0.0) + elapsed
@@ -0,0 +1,125 @@
+"""
+Note index of the running extension
+
+The index is built in a background thread whenever preferences that
+affect it change, and searches use it once it's ready. Until then,
+and while it's being rebuilt, they walk the notes directory instead.
+Once it's ready, its segments are merged and the notes directory is
+rescanned in the background.
+"""
+import os
+import threading
+from typing import Callable, Optional, TYPE_CHECKING
+from .index import NoteIndex, build_in_background
+from .rescan import PeriodicRescan, DEFAULT_RESCAN_INTERVAL
+from .segments import SegmentMerger
+
+if TYPE_CHECKING:
+    from .extension import NotesNv  # noqa: F401
+
+
+class IndexWarmup:
+    """
+    Note index built for the current preferences, with the threads
+    that keep it up to date
+    """
+
+    def __init__(self, notesnv: "NotesNv", on_ready: Callable[[], None]):
+        self.notesnv = notesnv
+        # Called every time an index is built
+        self.on_ready = on_ready
+        self.index: Optional[NoteIndex] = None
+        self.rescan: Optional[PeriodicRescan] = None
+        self.merger: Optional[SegmentMerger] = None
+        self.lock = threading.Lock()
+
+    def get_index_memory_budget(self) -> Optional[int]:
+        """
+        Memory budget of the note index in bytes, None if unlimited.
+        Stored in megabytes.
+        """
+        megabytes = self.notesnv.get_number_preference("index-memory-budget")
+        return int(megabytes * 1024 * 1024) if megabytes else None
+
+    def get_rescan_interval(self) -> Optional[float]:
+        """
+        Seconds between periodic rescans of the notes directory,
+        None if they aren't configured: then searches check directories
+        for changes, and rescans run every `DEFAULT_RESCAN_INTERVAL` seconds
+        """
+        return self.notesnv.get_number_preference("rescan-interval") or None
+
+    def get_accent_insensitive(self) -> bool:
+        """
+        Whether search should ignore diacritics ("cafe" matches "café")
+        """
+        return self.notesnv.preferences.get("accent-insensitive-search") == "yes"
+
+    def start(self) -> Optional[threading.Thread]:
+        """
+        Build a fresh note index in a background thread.
+        Queries are served by walking the notes directory until it's ready.
+        """
+        if not self.notesnv.has_preferences():
+            return None
+        index = NoteIndex(
+            self.notesnv.get_notes_path(),
+            self.notesnv.get_note_file_extensions(),
+            self.get_accent_insensitive(),
+            self.get_index_memory_budget(),
+        )
+        with self.lock:
+            self.index = index
+            if self.rescan is not None:
+                self.rescan.stop()
+                self.rescan = None
+            if self.merger is not None:
+                self.merger.stop()
+                self.merger = None
+        return build_in_background(index, on_ready=lambda: self._on_ready(index))
+
+    def _on_ready(self, index: NoteIndex) -> None:
+        self.on_ready()
+        interval = self.get_rescan_interval()
+        with self.lock:
+            if self.index is not index:
+                return
+            self.merger = SegmentMerger(index)
+            self.merger.start()
+            io_budget = self.notesnv.get_number_preference("rescan-io-budget")
+            self.rescan = PeriodicRescan(
+                index,
+                interval or DEFAULT_RESCAN_INTERVAL,
+                int(io_budget * 1024) if io_budget else None,
+            )
+            self.rescan.start()
+
+    def ready(self) -> Optional[NoteIndex]:
+        """
+        Note index, if it's been built for current preferences, with changed
+        directories re-listed (see `NoteIndex.refresh`). When periodic rescans
+        are configured, the index is kept up to date by them instead.
+        """
+        with self.lock:
+            index = self.index
+        if (
+            index is None
+            or not index.is_ready()
+            or index.path != self.notesnv.get_notes_path()
+            or index.file_exts != self.notesnv.get_note_file_extensions()
+            or index.strip_accents != self.get_accent_insensitive()
+        ):
+            return None
+        if self.get_rescan_interval() is None:
+            index.refresh()
+        return index
+
+    def note_written(self, path: str) -> None:
+        """
+        Update the note index right away after the extension itself
+        wrote a note file, so that the very next query finds it
+        """
+        with self.lock:
+            index = self.index
+        if index is not None and index.path == self.notesnv.get_notes_path():
+            index.update_note(os.path.relpath(path, index.path))
@@ -1,5 +1,6 @@
+import threading
 from ulauncher.api.shared.event import ItemEnterEvent
-from notesnv.callable_action import callable_action, CallableEventListener
+from notesnv.callable_action import Cache, callable_action, CallableEventListener
 
 
 class Recorder:
@@ -47,3 +48,19 @@ def test_right_callable_is_called():
 
     assert right.was_called
     assert not wrong.was_called
+
+
+def test_cache_from_threads():
+    cache = Cache()
+    items = [Recorder() for _ in range(1000)]
+
+    def add_items(start):
+        for item in items[start::4]:
+            assert cache.get(cache.add(item)) is item
+
+    threads = [threading.Thread(target=add_items, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache.cache) == cache.cache.maxsize
@@ -0,0 +1,55 @@
+import io
+import json
+from contextlib import redirect_stdout, redirect_stderr
+from utils import with_temp_dir
+from notesnv import cli
+
+
+def run_cli(args):
+    out = io.StringIO()
+    err = io.StringIO()
+    with redirect_stdout(out), redirect_stderr(err):
+        code = cli.main(args)
+    return code, out.getvalue(), err.getvalue()
+
+
+@with_temp_dir([("python cheatsheet.txt", "list comprehensions"), "java.txt"])
+def test_cli_text_output(path):
+    code, out, _ = run_cli([path, "python", "--ext", "txt"])
+    assert code == 0
+    assert out.splitlines() == ["python cheatsheet.txt"]
+
+
+@with_temp_dir([("a.txt", "who ordered snakes?"), ("b.txt", "books you love")])
+def test_cli_json_output(path):
+    code, out, _ = run_cli([path, "snake", "--ext", "txt", "--json"])
+    assert code == 0
+    results = json.loads(out)
+    assert len(results) == 1
+    assert results[0]["filename"] == "a.txt"
+    assert "snakes" in results[0]["match_summary"]
+
+
+@with_temp_dir(["python cheatsheet.txt"])
+def test_cli_timing(path):
+    code, _, err = run_cli([path, "python", "--repeat", "3", "--timing"])
+    assert code == 0
+    for stage in ["content", "titles", "rank", "total"]:
+        assert stage in err
+    assert "3 runs" in err
+
+
+@with_temp_dir()
+def test_cli_search_error(path):
+    code, out, err = run_cli([path + "/nosuchdir", "python"])
+    assert code == 1
+    assert not out
+    assert "Could not" in err
+
+
+@with_temp_dir([("menu.txt", "Le café crème"), "other.txt"])
+def test_cli_index_ignore_accents(path):
+    code, out, err = run_cli([path, "cafe", "--ignore-accents", "--timing"])
+    assert code == 0
+    assert out.startswith("menu.txt")
+    assert "index build" in err
@@ -0,0 +1,50 @@
+import gzip
+import os
+import pytest
+from notesnv import compressed
+from notesnv.compressed import DecompressedCache, read_note_text
+from notesnv.peek import read_head
+from utils import with_temp_dir
+
+
+def write_gzip(path, filename, text):
+    full_path = os.path.join(path, filename)
+    with gzip.open(full_path, "wt", encoding="utf-8") as f:
+        f.write(text)
+    return full_path
+
+
+@with_temp_dir()
+def test_read_compressed_note(path):
+    fn = write_gzip(path, "old.md.gz", "first\nsecond\n")
+    assert read_note_text(fn) == "first\nsecond\n"
+    assert read_head(fn).lines == ["first", "second"]
+
+
+@with_temp_dir([("broken.md.gz", "not gzip at all")])
+def test_read_corrupt_note(path):
+    with pytest.raises(OSError):
+        read_note_text(os.path.join(path, "broken.md.gz"))
+
+
+@with_temp_dir()
+def test_decompressed_cache(path):
+    fn = write_gzip(path, "old.md.gz", "v1")
+    cache = DecompressedCache()
+    calls = []
+    decompress = compressed.decompress_note
+
+    def counting_decompress(p):
+        calls.append(p)
+        return decompress(p)
+
+    compressed.decompress_note = counting_decompress
+    try:
+        assert cache.get(fn) == "v1"
+        assert cache.get(fn) == "v1"
+        assert len(calls) == 1
+        write_gzip(path, "old.md.gz", "version 2")
+        assert cache.get(fn) == "version 2"
+        assert len(calls) == 2
+    finally:
+        compressed.decompress_note = decompress
@@ -0,0 +1,61 @@
+import threading
+import time
+from notesnv.debounce import QueryCoalescer, MAX_DEBOUNCE
+from notesnv.metrics import Metrics
+
+
+def test_latest_query_wins():
+    metrics = Metrics()
+    coalescer = QueryCoalescer(metrics)
+    started = threading.Event()
+    release = threading.Event()
+    done = threading.Event()
+    ran = []
+    stale = []
+
+    def query(name):
+        def run(is_stale):
+            ran.append(name)
+            if name == "a":
+                started.set()
+                release.wait(5)
+            stale.append(is_stale())
+            if name == "abc":
+                done.set()
+
+        return run
+
+    coalescer.submit(query("a"), debounced=False)
+    started.wait(5)
+    coalescer.submit(query("ab"))
+    coalescer.submit(query("abc"))
+    release.set()
+    assert done.wait(5)
+    assert ran == ["a", "abc"]
+    # Results of "a" were superseded while it ran
+    assert stale == [True, False]
+    assert metrics.counters["dropped"] == 1
+
+
+def test_window_follows_latency():
+    metrics = Metrics()
+    coalescer = QueryCoalescer(metrics)
+    coalescer._record_latency(0.01)
+    assert metrics.debounce_window == 0.005
+    for _ in range(50):
+        coalescer._record_latency(10)
+    assert metrics.debounce_window == MAX_DEBOUNCE
+
+
+def test_failed_queries_are_counted():
+    metrics = Metrics()
+    coalescer = QueryCoalescer(metrics)
+
+    def run(is_stale):
+        raise ValueError("oops")
+
+    coalescer.submit(run, debounced=False)
+    deadline = time.monotonic() + 5
+    while not metrics.counters["errors"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert metrics.counters["errors"] == 1
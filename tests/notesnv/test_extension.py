@@ -1,7 +1,9 @@
 import os
+import threading
 from unittest.mock import MagicMock
-from notesnv import extension
+from notesnv import extension, query_command
 from notesnv.search import SearchResultItem
+from notesnv.rescan import DEFAULT_RESCAN_INTERVAL
 from ulauncher.api.shared.action.RenderResultListAction import RenderResultListAction
 from utils import with_temp_dir
 
@@ -86,6 +88,9 @@ def test_new_note_title():
     assert not notesnv.can_be_new_note_title(
         "yes hello", [search_result_file("yes hello.txt")]
     )
+    assert not notesnv.can_be_new_note_title(
+        "yes hello", [search_result_file("yes hello.txt.gz")]
+    )
 
 
 def test_items_open_note_command():
@@ -99,3 +104,179 @@ def test_items_open_note_command():
     assert len(items) == 3
     assert any(i for i in items if i.get_name() == "yes hello.txt")
     assert len(list(i for i in items if "Create" in i.get_name())) == 2
+
+
+def test_clipboard_created_lazily():
+    notesnv = extension.NotesNv({})
+    assert notesnv._clipboard is None
+
+
+@with_temp_dir(["hello.txt"])
+def test_index_warmup(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": path, "file-extensions": "txt"}
+    )
+    assert notesnv.indexes.ready() is None
+    notesnv.indexes.start().join(5)
+    assert notesnv.indexes.ready() is not None
+    assert "ready" in extension.STARTUP_TIMINGS
+    assert notesnv.indexes.rescan.interval == DEFAULT_RESCAN_INTERVAL
+    notesnv.indexes.rescan.stop()
+
+
+@with_temp_dir([("hello.txt", "hello world")])
+def test_stats_command(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": path, "file-extensions": "txt"}
+    )
+    notesnv.process_search_query("hello")
+    action = notesnv.process_search_query("|stats")
+    names = [item.get_name() for item in action.result_list]
+    assert any("warming up" in name for name in names)
+    assert any("Search latency" in name for name in names)
+    assert any("1 searched" in name for name in names)
+
+    notesnv.indexes.start().join(5)
+    notesnv.process_search_query("hello")
+    action = notesnv.process_search_query("| stats")
+    names = [item.get_name() for item in action.result_list]
+    assert "Notes: 1" in names
+    assert any(name.startswith("Index memory") for name in names)
+
+
+@with_temp_dir([("snakes.txt", "about pythons"), ("python.txt", "snakes")])
+def test_progressive_results(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": path, "file-extensions": "txt"}
+    )
+    sent = []
+    action = notesnv.process_search_query("python", sent.append)
+    assert len(sent) == 1
+    assert [i.get_name() for i in sent[0].result_list] == ["python.txt"]
+    assert len(action.result_list) == 2
+    assert len(notesnv.metrics.first_result_latency) == 1
+
+
+@with_temp_dir([("python.txt", "snakes")])
+def test_progressive_results_off(path):
+    notesnv = extension.NotesNv(
+        {
+            "notes-directory-path": path,
+            "file-extensions": "txt",
+            "progressive-results": "no",
+        }
+    )
+    sent = []
+    notesnv.process_search_query("python", sent.append)
+    assert not sent
+
+
+@with_temp_dir(["hello.txt"])
+def test_created_note_found_right_away(path):
+    notesnv = extension.NotesNv(
+        {
+            "notes-directory-path": path,
+            "file-extensions": "txt",
+            "rescan-interval": "3600",
+        }
+    )
+    notesnv.open_note = MagicMock()
+    notesnv.indexes.start().join(5)
+    notesnv.create_empty_note(os.path.join(path, "hello world.txt"))
+    matches = notesnv.indexes.ready().find_titles(["world"])
+    assert [m.filename for m in matches] == ["hello world.txt"]
+    notesnv.indexes.rescan.stop()
+
+
+@with_temp_dir([("a.txt", "onion soup recipe"), ("b.txt", "onion stew recipe")])
+def test_show_related_notes(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": path, "file-extensions": "txt"}
+    )
+    action = notesnv.commands.show_related_notes("a.txt")
+    assert "still being indexed" in action.result_list[0].get_name()
+    notesnv.indexes.start().join(5)
+    action = notesnv.commands.show_related_notes("a.txt")
+    assert [i.get_name() for i in action.result_list] == ["b.txt"]
+
+
+@with_temp_dir([("a.txt", "see [[b]]"), ("b.txt", "hello")])
+def test_show_backlinks(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": path, "file-extensions": "txt"}
+    )
+    notesnv.indexes.start().join(5)
+    action = notesnv.commands.show_backlinks("b.txt")
+    assert [i.get_name() for i in action.result_list] == ["a.txt"]
+    action = notesnv.commands.show_backlinks("a.txt")
+    assert action.result_list[0].get_name() == "No notes link here"
+
+
+@with_temp_dir([("a.txt", "first line\n\nsecond line\n"), ("empty.txt", "")])
+def test_peek_note(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": path, "file-extensions": "txt"}
+    )
+    action = notesnv.commands.peek_note("a.txt")
+    assert [i.get_name() for i in action.result_list] == ["first line", "second line"]
+    action = notesnv.commands.peek_note("empty.txt")
+    assert action.result_list[0].get_name() == "Note is empty"
+    action = notesnv.commands.peek_note("missing.txt")
+    assert "Could not" in action.result_list[0].get_name()
+
+
+@with_temp_dir([(f"recipe {i:02}.txt", "soup") for i in range(15)])
+def test_more_results(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": path, "file-extensions": "txt"}
+    )
+    action = notesnv.process_search_query("recipe")
+    names = [i.get_name() for i in action.result_list]
+    assert names[0] == "recipe 00.txt"
+    assert "More results… (5 more)" in names
+
+    query = tuple(query_command.parse("recipe"))
+    action = notesnv.pages.show_more_results(query, 10)
+    names = [i.get_name() for i in action.result_list]
+    assert names == [f"recipe {i}.txt" for i in range(10, 15)]
+
+    notesnv.process_search_query("soup")
+    action = notesnv.pages.show_more_results(query, 10)
+    assert "out of date" in action.result_list[0].get_name()
+
+
+@with_temp_dir([("hello.txt", "hello world")])
+def test_superseded_results_are_cancelled(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": path, "file-extensions": "txt"}
+    )
+    listener = extension.KeywordQueryEventListener(notesnv)
+    started = threading.Event()
+    release = threading.Event()
+    search = notesnv.process_search_query
+
+    def slow_search(query, send_partial):
+        if query == "hel":
+            started.set()
+            release.wait(5)
+        return search(query, send_partial)
+
+    notesnv.process_search_query = slow_search
+    sent = threading.Event()
+    ulauncher = MagicMock()
+    ulauncher.send_response.side_effect = lambda event, action: sent.set()
+    listener.on_event(MagicMock(get_argument=lambda: "hel"), ulauncher)
+    started.wait(5)
+    listener.on_event(MagicMock(get_argument=lambda: "hello"), ulauncher)
+    release.set()
+    assert sent.wait(5)
+    assert notesnv.metrics.counters["cancelled"] == 1
+
+
+@with_temp_dir()
+def test_failed_empty_query_is_counted(path):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": os.path.join(path, "gone"), "file-extensions": "txt"}
+    )
+    notesnv.process_empty_query()
+    assert notesnv.metrics.counters["errors"] == 1
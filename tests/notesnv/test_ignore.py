@@ -0,0 +1,46 @@
+import os
+from utils import with_temp_dir, create_text_file
+from notesnv import ignore, search
+
+
+@with_temp_dir([("a.txt", "snakes"), ("b.txt", "snakes")])
+def test_walk_skips_vcs_and_hidden_dirs(path):
+    for sub_dir in [".git", ".trash", "CVS"]:
+        os.mkdir(os.path.join(path, sub_dir))
+        create_text_file(path, os.path.join(sub_dir, "c.txt"), "snakes")
+    assert sorted(ignore.walk_note_files(path, ["txt"])) == ["a.txt", "b.txt"]
+
+
+@with_temp_dir([("a.txt", "snakes"), ("draft.txt", "snakes")])
+def test_walk_applies_nvignore(path):
+    os.mkdir(os.path.join(path, "attachments"))
+    os.mkdir(os.path.join(path, ".archive"))
+    create_text_file(path, "attachments/c.txt", "snakes")
+    create_text_file(path, ".archive/d.txt", "snakes")
+    create_text_file(path, ".nvignore", "# comment\nattachments/\ndraft*\n!.archive/")
+    assert sorted(ignore.walk_note_files(path, ["txt"])) == [".archive/d.txt", "a.txt"]
+
+
+@with_temp_dir([("a.txt", "snakes")])
+def test_walk_follows_symlinks_once(path):
+    os.mkdir(os.path.join(path, "sub"))
+    create_text_file(path, "sub/b.txt", "snakes")
+    os.symlink("..", os.path.join(path, "sub", "up"))
+    assert sorted(ignore.walk_note_files(path, ["txt"])) == ["a.txt", "sub/b.txt"]
+
+
+@with_temp_dir([("a.txt", "snakes")])
+def test_walk_skips_large_files(path):
+    with open(os.path.join(path, "big.txt"), "wb") as f:
+        f.truncate(ignore.MAX_NOTE_SIZE + 1)
+    os.symlink("nowhere.txt", os.path.join(path, "broken.txt"))
+    assert ignore.walk_note_files(path, ["txt"]) == ["a.txt"]
+    assert search.ls_dir(path, ["txt"]) == ["a.txt"]
+
+
+@with_temp_dir([("a.txt", "snakes"), ("b.txt", "snakes")])
+def test_search_skips_ignored_notes(path):
+    create_text_file(path, ".nvignore", "b.txt")
+    matches = search.search_notes(path, ["txt"], "snakes")
+    assert [m.filename for m in matches] == ["a.txt"]
+    assert search.ls_dir(path, ["txt"]) == ["a.txt"]
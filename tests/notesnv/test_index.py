@@ -0,0 +1,360 @@
+import gzip
+import os
+import re
+import threading
+import time
+from utils import with_temp_dir, create_text_file
+from notesnv import search
+from notesnv.index import NoteIndex
+
+
+def built_index(path, exts=["txt"], strip_accents=False):
+    index = NoteIndex(path, exts, strip_accents)
+    index.build()
+    return index
+
+
+def titles(index, chunks):
+    return sorted(note.filename for note in index.find_titles(chunks))
+
+
+@with_temp_dir(["python cheatsheet.txt", "java cheatsheet.txt", "books.md"])
+def test_find_titles(path):
+    index = built_index(path)
+    assert index.is_ready()
+    assert len(index) == 2
+    assert titles(index, ["che", "py"]) == ["python cheatsheet.txt"]
+    assert titles(index, ["cheats"]) == [
+        "java cheatsheet.txt",
+        "python cheatsheet.txt",
+    ]
+
+
+@with_temp_dir(["PYTHON cheatsheet.TXT"])
+def test_find_titles_case_insensitive(path):
+    index = built_index(path)
+    assert titles(index, ["py"]) == ["PYTHON cheatsheet.TXT"]
+
+
+@with_temp_dir()
+def test_subdirectories(path):
+    os.mkdir(os.path.join(path, "sub"))
+    create_text_file(path, os.path.join("sub", "python.txt"), "")
+    index = built_index(path)
+    assert titles(index, ["python"]) == [os.path.join("sub", "python.txt")]
+    # Only the file name is matched, not the directory
+    assert titles(index, ["sub"]) == []
+
+
+@with_temp_dir(["python.txt"])
+def test_refresh_picks_up_changes(path):
+    index = built_index(path)
+    os.mkdir(os.path.join(path, "sub"))
+    create_text_file(path, os.path.join("sub", "python2.txt"), "")
+    os.remove(os.path.join(path, "python.txt"))
+    # Make sure directory mtime changes even on coarse-grained filesystems
+    os.utime(path, (0, 0))
+    index.refresh()
+    assert titles(index, ["python"]) == [os.path.join("sub", "python2.txt")]
+
+
+@with_temp_dir(["python cheatsheet.txt", "java cheatsheet.txt"])
+def test_search_notes_with_index(path):
+    index = built_index(path)
+    matches = search.search_notes(path, ["txt"], "python", index=index)
+    assert [m.filename for m in matches] == ["python cheatsheet.txt"]
+
+
+@with_temp_dir(["python cheatsheet.txt"])
+def test_search_notes_index_not_ready(path):
+    index = NoteIndex(path, ["txt"])
+    matches = search.search_notes(path, ["txt"], "python", index=index)
+    assert [m.filename for m in matches] == ["python cheatsheet.txt"]
+
+
+@with_temp_dir([("snakes.txt", "first line\nwho ordered Snakes?\nlast line")])
+def test_search_content(path):
+    index = built_index(path)
+    matches = search.search_notes(path, ["txt"], "ordered snake", index=index)
+    assert len(matches) == 1
+    assert matches[0].match_content == "who ordered Snakes?"
+
+
+@with_temp_dir([("order.txt", "who ordered snakes?")])
+def test_refresh_rereads_changed_notes(path):
+    index = built_index(path)
+    create_text_file(path, "order.txt", "who ordered pizza and more pizza?")
+    # Notes changed in place are left to rescans
+    index.refresh()
+    assert search.search_notes(path, ["txt"], "snakes", index=index)
+    os.utime(path, (0, 0))
+    index.refresh()
+    assert not search.search_notes(path, ["txt"], "snakes", index=index)
+    assert search.search_notes(path, ["txt"], "pizza", index=index)
+
+
+@with_temp_dir([("menu.txt", "Le CAFÉ crème, s'il vous plaît"), "Café notes.txt"])
+def test_accent_insensitive_search(path):
+    index = built_index(path, strip_accents=True)
+    matches = search.search_notes(path, ["txt"], "cafe creme", index=index)
+    assert len(matches) == 1
+    assert matches[0].match_content == "Le CAFÉ crème, s'il vous plaît"
+    assert "CAFÉ crème" in matches[0].match_summary
+    matches = search.search_notes(path, ["txt"], "cafe", index=index)
+    assert sorted(m.filename for m in matches) == ["Café notes.txt", "menu.txt"]
+
+
+@with_temp_dir([("menu.txt", "Le CAFÉ crème")])
+def test_accent_sensitive_search(path):
+    index = built_index(path, strip_accents=False)
+    assert not search.search_notes(path, ["txt"], "cafe", index=index)
+    assert search.search_notes(path, ["txt"], "café", index=index)
+
+
+CORPUS = [
+    ("kubernetes.txt", "kubectl get pods\nkubectl describe pod"),
+    ("docker.txt", "docker run --rm -it ubuntu\ndocker ps"),
+    ("python.txt", "python -m venv .venv\npip install requests"),
+    ("rare.txt", "the word zymurgy appears once"),
+]
+
+
+@with_temp_dir(CORPUS)
+def test_search_uses_postings(path):
+    index = built_index(path)
+    matches = search.search_notes(path, ["txt"], "describe", index=index)
+    assert [m.filename for m in matches] == ["kubernetes.txt"]
+    # Partial words match too, same as grep
+    matches = search.search_notes(path, ["txt"], "ubun", index=index)
+    assert [m.filename for m in matches] == ["docker.txt"]
+    matches = search.search_notes(path, ["txt"], "install req", index=index)
+    assert [m.filename for m in matches] == ["python.txt"]
+
+
+@with_temp_dir(CORPUS)
+def test_memory_budget(path):
+    unlimited = built_index(path)
+    limited = NoteIndex(path, ["txt"], memory_budget=1)
+    limited.build()
+    assert limited.memory_used() < unlimited.memory_used()
+    assert all(note.folded is None for note in limited.snapshot.iter_notes())
+    assert any(segment.spilled for segment in limited.snapshot.segments)
+
+    for query in ["zymurgy", "describe", "pip install", "docker ps"]:
+        expected = search.search_notes(path, ["txt"], query, index=unlimited)
+        actual = search.search_notes(path, ["txt"], query, index=limited)
+        assert actual == expected
+
+
+@with_temp_dir(CORPUS)
+def test_memory_footprint(path):
+    index = built_index(path)
+    footprint = index.memory_footprint()
+    assert set(footprint) == {
+        "titles",
+        "text",
+        "folded",
+        "postings",
+        "spilled",
+        "spelling",
+        "links",
+        "tags",
+    }
+    assert footprint["text"] > 0
+    assert footprint["postings"] > 0
+    assert index.memory_used() == sum(footprint.values())
+
+
+@with_temp_dir([("a.txt", "snakes")])
+def test_index_skips_ignored_notes_and_symlink_loops(path):
+    os.mkdir(os.path.join(path, "sub"))
+    create_text_file(path, "sub/b.txt", "snakes")
+    create_text_file(path, "sub/c.txt", "snakes")
+    os.symlink("..", os.path.join(path, "sub", "up"))
+    create_text_file(path, ".nvignore", "c.txt")
+    index = NoteIndex(path, ["txt"])
+    index.build()
+    assert sorted(index.snapshot.filenames()) == ["a.txt", "sub/b.txt"]
+
+    create_text_file(path, ".nvignore", "")
+    index.refresh()
+    # Changed rules are left to the background rescanner
+    assert index.dirs.rescan_wanted.is_set()
+    assert sorted(index.snapshot.filenames()) == ["a.txt", "sub/b.txt"]
+    index.rescan()
+    assert not index.dirs.rescan_wanted.is_set()
+    assert sorted(index.snapshot.filenames()) == ["a.txt", "sub/b.txt", "sub/c.txt"]
+
+
+@with_temp_dir([("a.txt", "snakes")])
+def test_update_note(path):
+    index = built_index(path)
+    create_text_file(path, "b.txt", "more snakes")
+    index.update_note("b.txt")
+    index.update_note("c.md")
+    assert sorted(index.snapshot.filenames()) == ["a.txt", "b.txt"]
+    matches = search.search_note_contents_in_index(index, "more")
+    assert [m.filename for m in matches] == ["b.txt"]
+    assert "b.txt" in index.memory.recently_matched
+
+    os.remove(os.path.join(path, "b.txt"))
+    index.update_note("b.txt")
+    assert sorted(index.snapshot.filenames()) == ["a.txt"]
+
+
+@with_temp_dir(
+    [
+        ("asyncio.txt", "python asyncio event loop coroutines"),
+        ("trio.txt", "python trio coroutines nursery"),
+        ("soup.txt", "onion soup recipe"),
+        ("stew.txt", "beef stew recipe onion"),
+        ("python.txt", "python"),
+    ]
+)
+def test_related(path):
+    index = built_index(path)
+    related = index.related("asyncio.txt", 10)
+    assert [r.filename for r in related] == ["trio.txt"]
+    assert related[0].shared_terms == ["coroutines"]
+    assert [r.filename for r in index.related("soup.txt", 10)] == ["stew.txt"]
+    assert index.related("nosuchnote.txt", 10) == []
+
+
+@with_temp_dir(
+    [("k8s.txt", "kubernetes cluster setup"), ("py.txt", "python packaging")]
+)
+def test_spelling_correction(path):
+    index = built_index(path)
+    assert index.correct_spelling(["kuberentes", "clster"]) == ["kubernetes", "cluster"]
+    assert index.correct_spelling(["kube", "pack"]) is None
+    matches = search.search_notes(path, ["txt"], "kuberentes", index=index)
+    assert [(m.filename, m.corrected_query) for m in matches] == [
+        ("k8s.txt", "kubernetes")
+    ]
+
+
+@with_temp_dir([("a.txt", "kubernetes"), ("b.txt", "kuberentez")])
+def test_spelling_skips_terms_of_no_note(path):
+    index = NoteIndex(path, ["txt"], memory_budget=1)
+    index.build()
+    assert index.snapshot.segments[0].spilled
+    assert index.correct_spelling(["kuberentes"]) == ["kuberentez"]
+    create_text_file(path, "b.txt", "kubernetes again")
+    index.update_note("b.txt")
+    assert index.correct_spelling(["kuberentes"]) == ["kubernetes"]
+    # Spilled terms aren't added again
+    assert sorted(index.spelling.terms) == ["again", "kuberentez", "kubernetes"]
+
+
+@with_temp_dir(
+    [
+        ("setup.md", "how to set things up"),
+        ("a.md", "see [[Setup]] first"),
+        ("b.md", "[guide](setup.md)"),
+        ("c.md", "unrelated"),
+    ]
+)
+def test_backlinks(path):
+    index = built_index(path, ["md"])
+    assert index.backlinks("setup.md") == ["a.md", "b.md"]
+
+    create_text_file(path, "a.md", "no more links")
+    create_text_file(path, "c.md", "now see [[setup]]")
+    index.update_note("a.md")
+    index.update_note("c.md")
+    assert index.backlinks("setup.md") == ["b.md", "c.md"]
+
+
+@with_temp_dir(
+    [
+        ("disk.txt", "#Infra\ndisk full\n#oncall"),
+        ("dns.txt", "#infra dns"),
+        ("other.txt", "disk #oncall, see page#infra"),
+    ]
+)
+def test_search_with_tags(path):
+    index = built_index(path)
+    disk = index.snapshot.note("disk.txt")
+    assert index.ids_with_tags(["infra", "oncall"]) == {disk.doc_id}
+    matches = search.search_notes(path, ["txt"], "", index=index, tags=["infra"])
+    assert [m.filename for m in matches] == ["disk.txt", "dns.txt"]
+    matches = search.search_notes(path, ["txt"], "disk", index=index, tags=["oncall"])
+    assert sorted(m.filename for m in matches) == ["disk.txt", "other.txt"]
+
+
+@with_temp_dir([("disk.txt", "#infra disk full"), ("dns.txt", "#infra [[disk]]")])
+def test_merges_prune_id_lists(path):
+    index = built_index(path)
+    create_text_file(path, "dns.txt", "dns, no tags")
+    index.update_note("dns.txt")
+    os.remove(os.path.join(path, "disk.txt"))
+    index.update_note("disk.txt")
+    while index.merge():
+        pass
+    assert "infra" not in index.tags
+    assert index.ids_with_tags(["infra"]) == set()
+    assert not index.links
+
+
+@with_temp_dir([("plain.txt", "see [[archived]]")])
+def test_index_compressed_notes(path):
+    with gzip.open(os.path.join(path, "archived.txt.gz"), "wt") as f:
+        f.write("ancient wisdom")
+    index = NoteIndex(path, ["txt"])
+    index.build()
+    matches = search.search_notes(path, ["txt"], "wisdom", index=index)
+    assert [m.filename for m in matches] == ["archived.txt.gz"]
+    assert index.backlinks("archived.txt.gz") == ["plain.txt"]
+
+
+@with_temp_dir([("a.txt", "apple"), ("b.txt", "banana")])
+def test_snapshot_is_not_changed_by_updates(path):
+    index = NoteIndex(path, ["txt"])
+    index.build()
+    snapshot = index.snapshot
+    create_text_file(path, "c.txt", "cherry")
+    index.update_note("c.txt")
+    os.remove(os.path.join(path, "a.txt"))
+    index.refresh()
+    assert sorted(snapshot.filenames()) == ["a.txt", "b.txt"]
+    assert sorted(index.snapshot.filenames()) == ["b.txt", "c.txt"]
+    # Nothing changed, nothing published
+    current = index.snapshot
+    index.refresh()
+    assert index.snapshot is current
+    # Searches don't wait for updates
+    with index.store.lock:
+        os.remove(os.path.join(path, "b.txt"))
+        index.refresh()
+    assert index.snapshot is current
+
+
+@with_temp_dir([(f"note{i}.txt", f"common words {i}") for i in range(100)])
+def test_search_during_rescans(path):
+    index = NoteIndex(path, ["txt"])
+    index.build()
+    errors = []
+    done = threading.Event()
+
+    def search():
+        pattern = re.compile("common")
+        try:
+            while not done.is_set():
+                matches = index.search_content(pattern, ["common"])
+                # Every rescan replaces all notes at once
+                assert len(matches) == 100
+                assert len(set(m.line for m in matches)) == 100
+                time.sleep(0.001)
+        except Exception as exc:  # pylint: disable=broad-except
+            errors.append(exc)
+
+    reader = threading.Thread(target=search)
+    reader.start()
+    for round in range(3):
+        for i in range(100):
+            create_text_file(path, f"note{i}.txt", f"common words {i} {round}")
+            os.utime(os.path.join(path, f"note{i}.txt"), (round, round))
+        index.rescan()
+    done.set()
+    reader.join(5)
+    assert not errors
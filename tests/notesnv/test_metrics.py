@@ -0,0 +1,38 @@
+import threading
+from notesnv.metrics import LatencyWindow, Metrics
+
+
+def test_latency_window_rolls_over():
+    window = LatencyWindow(size=3)
+    for seconds in [10, 1, 2, 3]:
+        window.add(seconds)
+    assert len(window) == 3
+    assert window.percentile(100) == 3
+
+
+def test_latency_window_empty():
+    assert LatencyWindow().percentile(50) is None
+
+
+def test_record_search():
+    metrics = Metrics()
+    metrics.record_search(0.01)
+    metrics.record_search(0.03)
+    assert metrics.counters["searches"] == 2
+    assert metrics.search_latency.percentile(50) == 0.01
+    assert metrics.counters["dropped"] == 0
+
+
+def test_count_from_threads():
+    metrics = Metrics()
+
+    def count():
+        for _ in range(10000):
+            metrics.count("errors")
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.counters["errors"] == 40000
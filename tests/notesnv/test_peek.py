@@ -0,0 +1,45 @@
+import os
+from notesnv.peek import HeadCache, HEAD_BYTES, PEEK_LINES, read_head
+from utils import with_temp_dir
+
+
+@with_temp_dir([("long.txt", "".join(f"line {i}\n" for i in range(50)))])
+def test_read_head(path):
+    head = read_head(os.path.join(path, "long.txt"))
+    assert head.lines == [f"line {i}" for i in range(PEEK_LINES)]
+
+
+@with_temp_dir([("huge.txt", "x" * (HEAD_BYTES * 2))])
+def test_read_head_cut_off(path):
+    head = read_head(os.path.join(path, "huge.txt"))
+    assert head.lines == ["x" * HEAD_BYTES + "…"]
+
+
+@with_temp_dir([("a.txt", "old"), ("b.txt", "b"), ("c.txt", "c")])
+def test_head_cache(path):
+    cache = HeadCache(max_heads=2)
+    a = os.path.join(path, "a.txt")
+    assert cache.get(a) == ["old"]
+    assert cache.get(a) == ["old"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Changed files are read again
+    with open(a, "w") as f:
+        f.write("new content\n")
+    assert cache.get(a) == ["new content"]
+
+    cache.get(os.path.join(path, "b.txt"))
+    cache.get(os.path.join(path, "c.txt"))
+    assert len(cache) == 2
+    assert a not in cache.heads
+
+
+@with_temp_dir([("a.txt", "a"), ("b.txt", "b")])
+def test_head_cache_prefetch(path):
+    cache = HeadCache()
+    paths = [os.path.join(path, fn) for fn in ("a.txt", "missing.txt", "b.txt")]
+    cache.prefetch(paths)
+    cache.executor.shutdown(wait=True)
+    assert sorted(cache.heads) == [paths[0], paths[2]]
+    assert cache.get(paths[2]) == ["b"]
+    assert cache.misses == 0
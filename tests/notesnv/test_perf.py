@@ -0,0 +1,320 @@
+import os
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock
+import pytest
+from notesnv import extension, search
+from notesnv.index import NoteIndex, MIN_LOOKUP_LEN
+
+# Latency and memory budgets over a large generated corpus. Slow, so they only
+# run with NOTESNV_PERF set (`make perf`). NOTESNV_PERF_NOTES sets corpus size.
+#
+# Latency budgets are in units of `reference_seconds()`, how long this machine
+# takes for a fixed mix of the work searching does, so that they hold on slow
+# and fast machines alike. They were calibrated at about three times
+# the latencies measured on a 20k-note corpus. Whether cost grows with the
+# corpus is checked by comparing against a corpus a quarter the size.
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("NOTESNV_PERF"), reason="set NOTESNV_PERF to run"
+)
+
+NOTES = int(os.environ.get("NOTESNV_PERF_NOTES", 20000))
+NOTE_WORDS = 120
+VOCABULARY_SIZE = 5000
+# In this many notes of each corpus, whatever its size
+RARE_WORD = "quokka"
+RARE_NOTES = 10
+REPEAT = 5
+
+# Budgets, in units of `reference_seconds()`
+SELECTIVE_SEARCH_BUDGET = 8
+KEYSTROKE_BUDGET = 12
+BROAD_SEARCH_BUDGET = 100
+EMPTY_QUERY_BUDGET = 30
+NOTE_CREATION_BUDGET = 0.1
+
+# Time of parallel `grep` processes on the cold path relative to a single one:
+# at most this much slower on one CPU, at least this much faster on several
+MAX_SHARDING_OVERHEAD = 1.25
+MIN_SHARDING_SPEEDUP = 1.25
+
+# How much slower things may get on a corpus four times as large
+# when they shouldn't depend on its size
+MAX_GROWTH = 2.0
+
+# Index memory per byte of notes
+MAX_INDEX_MEMORY_RATIO = 3.5
+
+# Memory allocated by a search, at peak
+MAX_SELECTIVE_SEARCH_MEMORY = 1024 * 1024
+MAX_SEARCH_MEMORY_PER_MATCH = 4096
+
+
+def reference_seconds():
+    rng = random.Random(1)
+    words = ["".join(rng.choices("abcdefghij", k=8)) for _ in range(20000)]
+    text = " ".join(words)
+
+    def workload():
+        positions = {word: i for i, word in enumerate(words)}
+        found = [word for word in words if "abc" in word]
+        text.find("zzz")
+        sorted(words)
+        return positions, found
+
+    return min(timed(workload) for _ in range(REPEAT))
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def median_seconds(func, *args):
+    return statistics.median(timed(func, *args) for _ in range(REPEAT))
+
+
+def generate_corpus(path, notes, seed):
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "be", "da", "fu"]
+    vocabulary = sorted(
+        {"".join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(20000)}
+    )[:VOCABULARY_SIZE]
+    rng.shuffle(vocabulary)
+    # Zipf-like word frequencies, as in natural language
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    os.mkdir(path)
+    for i in range(notes):
+        words = rng.choices(vocabulary, weights, k=NOTE_WORDS)
+        if i % (notes // RARE_NOTES) == 0:
+            words[rng.randrange(NOTE_WORDS)] = RARE_WORD
+        lines = []
+        for start in range(0, NOTE_WORDS, 12):
+            end = start + 12
+            lines.append(" ".join(words[start:end]))
+        title = " ".join(rng.choices(vocabulary, k=rng.randint(1, 3)))
+        with open(os.path.join(path, f"{title} {i}.txt"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+    return vocabulary
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    with TemporaryDirectory() as path:
+        large = os.path.join(path, "large")
+        small = os.path.join(path, "small")
+        vocabulary = generate_corpus(large, NOTES, seed=1)
+        generate_corpus(small, NOTES // 4, seed=1)
+        indexes = {}
+        for name, notes_path in [("large", large), ("small", small)]:
+            indexes[name] = NoteIndex(notes_path, ["txt"])
+            indexes[name].build()
+        yield {"indexes": indexes, "vocabulary": vocabulary}
+
+
+@pytest.fixture(scope="module")
+def unit():
+    return reference_seconds()
+
+
+def search_timings(index, query):
+    timings = []
+    for _ in range(REPEAT):
+        stages = {}
+        started = time.perf_counter()
+        matches = search.search_notes(
+            index.path, ["txt"], query, timings=stages, index=index
+        )
+        stages["total"] = time.perf_counter() - started
+        timings.append(stages)
+    median = {
+        stage: statistics.median(t.get(stage, 0.0) for t in timings)
+        for stage in timings[0]
+    }
+    return matches, median
+
+
+def notesnv_for(index):
+    notesnv = extension.NotesNv(
+        {"notes-directory-path": index.path, "file-extensions": "txt"}
+    )
+    notesnv.indexes.index = index
+    notesnv.open_note = MagicMock()
+    return notesnv
+
+
+def keystroke_timings(index, query, monkeypatch):
+    """
+    Times of a search the way the extension runs it on every keystroke:
+    "total", "refresh" of the index and the stages of `search_timings`
+    """
+    notesnv = notesnv_for(index)
+    stages = {}
+    ready_index = notesnv.indexes.ready
+
+    def timed_ready_index():
+        started = time.perf_counter()
+        ready = ready_index()
+        stages["refresh"] = time.perf_counter() - started
+        assert ready is index
+        return ready
+
+    def timed_search_notes(*args, **kwargs):
+        return search.search_notes(*args, timings=stages, **kwargs)
+
+    monkeypatch.setattr(notesnv.indexes, "ready", timed_ready_index)
+    monkeypatch.setattr(extension, "search_notes", timed_search_notes)
+    timings = []
+    for _ in range(REPEAT):
+        stages.clear()
+        stages["total"] = timed(notesnv.process_search_query, query)
+        timings.append(dict(stages))
+    return {
+        stage: statistics.median(t.get(stage, 0.0) for t in timings)
+        for stage in timings[0]
+    }
+
+
+def test_index_memory(corpus):
+    index = corpus["indexes"]["large"]
+    notes_size = sum(
+        os.path.getsize(os.path.join(index.path, fn)) for fn in os.listdir(index.path)
+    )
+    assert len(index) == NOTES
+    assert index.memory_used() < MAX_INDEX_MEMORY_RATIO * notes_size
+
+
+def test_selective_search(corpus, unit):
+    large = corpus["indexes"]["large"]
+    small = corpus["indexes"]["small"]
+    matches, timings = search_timings(large, RARE_WORD)
+    assert len(matches) == RARE_NOTES
+    assert timings["total"] < SELECTIVE_SEARCH_BUDGET * unit
+    # Only notes with the word are looked at, however many notes there are
+    _, small_timings = search_timings(small, RARE_WORD)
+    assert (
+        timings["content"] + timings["rank"]
+        < MAX_GROWTH * (small_timings["content"] + small_timings["rank"]) + 0.1 * unit
+    )
+
+
+def test_keystrokes(corpus, unit, monkeypatch):
+    large = corpus["indexes"]["large"]
+    small = corpus["indexes"]["small"]
+    query = f"{RARE_WORD} {corpus['vocabulary'][0]}"
+    # Shorter words aren't looked up in the index, see `NoteIndex._candidates`
+    for end in range(MIN_LOOKUP_LEN, len(query) + 1):
+        typed = query[:end]
+        timings = keystroke_timings(large, typed, monkeypatch)
+        assert timings["total"] < KEYSTROKE_BUDGET * unit, typed
+        # Matching titles scans all of them, but refreshing the index
+        # and searching contents don't depend on how many notes there are
+        small_timings = keystroke_timings(small, typed, monkeypatch)
+        per_keystroke, small_per_keystroke = [
+            t["refresh"] + t["content"] + t["rank"] for t in (timings, small_timings)
+        ]
+        assert per_keystroke < MAX_GROWTH * small_per_keystroke + 0.1 * unit, typed
+
+
+def test_broad_search(corpus, unit, monkeypatch):
+    large = corpus["indexes"]["large"]
+    small = corpus["indexes"]["small"]
+    # The most frequent word is in nearly every note
+    query = corpus["vocabulary"][0]
+    matches, timings = search_timings(large, query)
+    assert len(matches) > NOTES // 2
+    assert timings["total"] < BROAD_SEARCH_BUDGET * unit
+    small_matches, small_timings = search_timings(small, query)
+    per_match = timings["rank"] / len(matches)
+    assert per_match < MAX_GROWTH * small_timings["rank"] / len(small_matches)
+
+    # Ranking computes one sort key per match, rather than comparing matches
+    calls = []
+    sort_key = search.match_sort_key
+
+    def counting_sort_key(*args):
+        calls.append(1)
+        return sort_key(*args)
+
+    monkeypatch.setattr(search, "match_sort_key", counting_sort_key)
+    matches = search.search_notes(large.path, ["txt"], query, index=large)
+    assert len(calls) <= len(matches)
+
+
+def test_search_memory(corpus):
+    index = corpus["indexes"]["large"]
+    for query, limit in [
+        (RARE_WORD, MAX_SELECTIVE_SEARCH_MEMORY),
+        (corpus["vocabulary"][0], MAX_SEARCH_MEMORY_PER_MATCH * NOTES),
+    ]:
+        tracemalloc.start()
+        try:
+            search.search_notes(index.path, ["txt"], query, index=index)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert peak < limit, query
+
+
+def test_sharded_grep(corpus):
+    path = corpus["indexes"]["large"].path
+    query = f"{RARE_WORD} {corpus['vocabulary'][0]}"
+
+    def content_seconds(jobs):
+        timings = []
+        for _ in range(REPEAT):
+            stages = {}
+            search.search_notes(path, ["txt"], query, timings=stages, jobs=jobs)
+            timings.append(stages["content"])
+        return statistics.median(timings)
+
+    # Warm up the page cache
+    content_seconds(1)
+    single = content_seconds(1)
+    sharded = content_seconds(search.MAX_GREP_JOBS)
+    assert sharded < MAX_SHARDING_OVERHEAD * single
+    if search.default_grep_jobs() > 1:
+        sharded = content_seconds(None)
+        assert sharded * MIN_SHARDING_SPEEDUP < single
+
+
+def test_min_files_per_shard(corpus):
+    path = corpus["indexes"]["large"].path
+    files = [
+        os.path.join(path, fn) for fn in os.listdir(path)[: search.MIN_FILES_PER_SHARD]
+    ]
+
+    def grep(args):
+        return lambda: subprocess.run(
+            ["grep", "-l", "-i", RARE_WORD] + args, stdout=subprocess.DEVNULL
+        )
+
+    # Starting one more process is cheap next to searching a shard
+    spawn = median_seconds(grep(["/dev/null"]))
+    shard = median_seconds(grep(files))
+    assert spawn < 0.5 * shard
+
+
+def test_empty_query(corpus, unit):
+    notesnv = notesnv_for(corpus["indexes"]["large"])
+    assert median_seconds(notesnv.process_empty_query) < EMPTY_QUERY_BUDGET * unit
+
+
+def test_note_creation(corpus, unit):
+    seconds = {}
+    for name, index in corpus["indexes"].items():
+        notesnv = notesnv_for(index)
+        timings = []
+        for i in range(REPEAT):
+            path = os.path.join(index.path, f"new note {i}.txt")
+            timings.append(timed(notesnv.create_empty_note, path))
+            assert index.snapshot.note(os.path.basename(path)) is not None
+        seconds[name] = statistics.median(timings)
+    assert seconds["large"] < NOTE_CREATION_BUDGET * unit
+    # Indexing a new note doesn't depend on how many notes there are
+    assert seconds["large"] < MAX_GROWTH * seconds["small"] + 0.05 * unit
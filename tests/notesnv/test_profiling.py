@@ -0,0 +1,47 @@
+import os
+import time
+from utils import with_temp_dir
+from notesnv.profiling import SlowQueryProfiler, profiled
+
+
+class Searcher:
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+
+    @profiled("search")
+    def search(self, query, delay=0):
+        time.sleep(delay)
+        return query.upper()
+
+
+@with_temp_dir()
+def test_fast_query_not_saved(path):
+    searcher = Searcher(SlowQueryProfiler(10, path))
+    assert searcher.search("hello") == "HELLO"
+    assert os.listdir(path) == []
+
+
+@with_temp_dir()
+def test_slow_query_saved(path):
+    searcher = Searcher(SlowQueryProfiler(0.001, path))
+    assert searcher.search("hello", delay=0.01) == "HELLO"
+    files = sorted(os.listdir(path))
+    assert len(files) == 2
+    assert files[0].endswith("-search.prof")
+    assert files[1].endswith("-search.txt")
+    with open(os.path.join(path, files[1])) as f:
+        report = f.read()
+    assert "'hello'" in report
+    assert "allocations" in report
+
+
+@with_temp_dir()
+def test_profiles_rotated(path):
+    searcher = Searcher(SlowQueryProfiler(0, path, max_profiles=2))
+    for _ in range(4):
+        searcher.search("hello")
+    assert len(os.listdir(path)) == 4
+
+
+def test_disabled_profiler():
+    assert Searcher().search("hello") == "HELLO"
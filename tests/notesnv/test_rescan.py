@@ -0,0 +1,101 @@
+import os
+import time
+from utils import with_temp_dir, create_text_file
+from notesnv import search
+from notesnv.index import NoteIndex
+from notesnv.rescan import IoBudget, PeriodicRescan
+
+
+def built_index(path):
+    index = NoteIndex(path, ["txt"])
+    index.build()
+    return index
+
+
+def content_matches(path, index, query):
+    return sorted(
+        m.filename for m in search.search_notes(path, ["txt"], query, index=index)
+    )
+
+
+@with_temp_dir([("a.txt", "apples"), ("b.txt", "bananas")])
+def test_rescan_finds_replaced_file(path):
+    index = built_index(path)
+    stat = os.stat(os.path.join(path, "a.txt"))
+    # Replace file the way sync tools do: same size and mtime, new inode
+    create_text_file(path, "new.tmp", "grapes")
+    os.utime(os.path.join(path, "new.tmp"), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(os.path.join(path, "new.tmp"), os.path.join(path, "a.txt"))
+    assert index.rescan() == 1
+    assert content_matches(path, index, "grapes") == ["a.txt"]
+    assert content_matches(path, index, "apples") == []
+
+
+@with_temp_dir([("a.txt", "apples"), ("b.txt", "bananas")])
+def test_rescan_finds_new_and_removed_files(path):
+    index = built_index(path)
+    os.mkdir(os.path.join(path, "sub"))
+    create_text_file(path, os.path.join("sub", "c.txt"), "cherries")
+    os.remove(os.path.join(path, "b.txt"))
+    assert index.rescan() == 2
+    assert content_matches(path, index, "cherries") == [os.path.join("sub", "c.txt")]
+    assert content_matches(path, index, "bananas") == []
+
+
+@with_temp_dir([("a.txt", "apples")])
+def test_rescan_without_changes(path):
+    index = built_index(path)
+    assert index.rescan() == 0
+
+
+@with_temp_dir([("a.txt", "apples")])
+def test_rescan_missing_directory_keeps_index(path):
+    index = built_index(path)
+    index.dirs.path = os.path.join(path, "nosuchdir")
+    assert index.rescan() == 0
+    assert len(index) == 1
+
+
+def test_io_budget_throttles():
+    budget = IoBudget(1000)
+    start = time.monotonic()
+    budget.spend(50)
+    assert time.monotonic() - start >= 0.04
+
+
+def test_io_budget_unlimited():
+    budget = IoBudget(None)
+    start = time.monotonic()
+    budget.spend(10 ** 9)
+    assert time.monotonic() - start < 0.01
+
+
+@with_temp_dir([("a.txt", "apples")])
+def test_periodic_rescan(path):
+    index = built_index(path)
+    rescan = PeriodicRescan(index, 0.01)
+    rescan.start()
+    try:
+        create_text_file(path, "b.txt", "bananas")
+        deadline = time.monotonic() + 5
+        while len(index) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert content_matches(path, index, "bananas") == ["b.txt"]
+    finally:
+        rescan.stop()
+
+
+@with_temp_dir([("a.txt", "apples"), ("b.txt", "bananas")])
+def test_periodic_rescan_on_request(path):
+    index = built_index(path)
+    rescan = PeriodicRescan(index, 60)
+    rescan.start()
+    try:
+        create_text_file(path, ".nvignore", "b.txt")
+        index.refresh()
+        deadline = time.monotonic() + 5
+        while len(index) > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sorted(index.snapshot.filenames()) == ["a.txt"]
+    finally:
+        rescan.stop()
@@ -1,47 +1,42 @@
+import gzip
 import os
 import pytest
 from utils import with_temp_dir
 from notesnv import search
 
 
+def title_matches(path, file_exts, query):
+    return [m.filename for m in search.search_note_file_titles(path, file_exts, query)]
+
+
 @with_temp_dir(["python cheatsheet.txt", "java cheatsheet.txt"])
 def test_find_one_file(path):
-    matches = search.find_dir(path, ["txt"], ["python"])
-    assert len(matches) == 1
-    assert matches[0] == "python cheatsheet.txt"
+    assert title_matches(path, ["txt"], "python") == ["python cheatsheet.txt"]
 
 
 @with_temp_dir(["python cheatsheet.txt", "java cheatsheet.txt", "books.txt"])
 def test_find_two_files(path):
-    matches = search.find_dir(path, ["txt"], ["cheats"])
-    assert len(matches) == 2
+    assert len(title_matches(path, ["txt"], "cheats")) == 2
 
 
 @with_temp_dir(["PYTHON cheatsheet.txt", "JAVA cheatsheet.txt"])
 def test_find_case_insensitive(path):
-    matches = search.find_dir(path, ["txt"], ["py"])
-    assert len(matches) == 1
-    assert matches[0] == "PYTHON cheatsheet.txt"
+    assert title_matches(path, ["txt"], "py") == ["PYTHON cheatsheet.txt"]
 
 
 @with_temp_dir(["python cheatsheet.txt", "python pep8.txt", "java cheatsheet.txt"])
 def test_find_pattern_with_two_parts(path):
-    matches = search.find_dir(path, ["txt"], ["py", "che"])
-    assert len(matches) == 1
-    assert matches[0] == "python cheatsheet.txt"
+    assert title_matches(path, ["txt"], "py che") == ["python cheatsheet.txt"]
 
 
 @with_temp_dir(["python cheatsheet.txt", "python pep8.txt", "java cheatsheet.txt"])
 def test_find_pattern_with_two_parts_swapped(path):
-    matches = search.find_dir(path, ["txt"], ["che", "py"])
-    assert len(matches) == 1
-    assert matches[0] == "python cheatsheet.txt"
+    assert title_matches(path, ["txt"], "che py") == ["python cheatsheet.txt"]
 
 
 @with_temp_dir(["python cheatsheet.txt", "python pep8.txt", "java cheatsheet.txt"])
 def test_find_right_extension(path):
-    matches = search.find_dir(path, ["gif"], ["che", "py"])
-    assert len(matches) == 0
+    assert title_matches(path, ["gif"], "che py") == []
 
 
 @with_temp_dir([("file1.txt", "books you love"), ("file2.txt", "who ordered snakes?")])
@@ -63,20 +58,10 @@ def test_grep_wrong_path(path):
         search.grep_dir(os.path.join(path, "nosuchdir"), ["txt"], "snake")
 
 
-@with_temp_dir()
-def test_find_wrong_command(path):
-    with pytest.raises(search.SearchError):
-        search.grep_dir(
-            search.find_dir(path, ["txt"], ["python"], find_cmd="no_such_find_cmdn")
-        )
-
-
 @with_temp_dir()
 def test_find_wrong_path(path):
     with pytest.raises(search.SearchError):
-        search.grep_dir(
-            search.find_dir(os.path.join(path, "nosuchdir"), ["txt"], ["python"])
-        )
+        title_matches(os.path.join(path, "nosuchdir"), ["txt"], "python")
 
 
 @with_temp_dir(["python cheatsheet.txt", "java cheatsheet.TXT", "nothing.nothing"])
@@ -97,3 +82,64 @@ def test_ls_wrong_command(path):
 def test_ls_wrong_path(path):
     with pytest.raises(search.SearchError):
         search.ls_dir(os.path.join(path, "nosuchdir"), ["txt"], ls_cmd="/nowhat/who")
+
+
+@with_temp_dir([("snakes.txt", "about pythons"), ("python.txt", "snakes")])
+def test_search_notes_titles_first(path):
+    partial = []
+    matches = search.search_notes(path, ["txt"], "python", on_titles=partial.append)
+    assert len(partial) == 1
+    assert [m.filename for m in partial[0]] == ["python.txt"]
+    assert sorted(m.filename for m in matches) == ["python.txt", "snakes.txt"]
+
+
+@with_temp_dir(
+    [
+        ("disk.txt", "#infra\ndisk full\n#oncall"),
+        ("dns.txt", "#infra dns"),
+        ("other.txt", "disk #oncall"),
+    ]
+)
+def test_search_notes_with_tags(path):
+    matches = search.search_notes(path, ["txt"], "", tags=["infra", "oncall"])
+    assert [m.filename for m in matches] == ["disk.txt"]
+    matches = search.search_notes(path, ["txt"], "disk", tags=["oncall"])
+    assert sorted(m.filename for m in matches) == ["disk.txt", "other.txt"]
+    matches = search.search_notes(path, ["txt"], "", tags=["nosuchtag"])
+    assert matches == []
+
+
+@with_temp_dir(
+    [(f"note {i}.txt", "needle" if i % 7 == 0 else "hay") for i in range(1500)]
+)
+def test_search_notes_parallel_grep(path):
+    serial = search.search_notes(path, ["txt"], "needle", jobs=1)
+    parallel = search.search_notes(path, ["txt"], "needle", jobs=3)
+    assert len(serial) == 215
+    assert parallel == serial
+
+
+@with_temp_dir([("plain.txt", "#infra disk full")])
+def test_search_compressed_notes(path):
+    with gzip.open(os.path.join(path, "archived.txt.gz"), "wt") as f:
+        f.write("old #infra notes\nDisk was full in 2019\n")
+    matches = search.search_notes(path, ["txt"], "disk full")
+    assert sorted(m.filename for m in matches) == ["archived.txt.gz", "plain.txt"]
+    archived = [m for m in matches if m.filename == "archived.txt.gz"][0]
+    assert archived.match_content == "Disk was full in 2019"
+    matches = search.search_notes(path, ["txt"], "", tags=["infra"])
+    assert sorted(m.filename for m in matches) == ["archived.txt.gz", "plain.txt"]
+    assert "archived.txt.gz" in search.ls_dir(path, ["txt"])
+
+
+@with_temp_dir([("good.txt", "needle in utf-8 ✓")])
+def test_search_invalid_utf8(path):
+    with open(os.path.join(path, "bad.txt"), "wb") as f:
+        f.write(b"latin-1 needle caf\xe9\n")
+    with open(os.path.join(os.fsencode(path), b"caf\xe9.txt"), "wb") as f:
+        f.write(b"needle\n")
+    matches = search.search_notes(path, ["txt"], "needle")
+    by_name = {m.filename: m.match_content for m in matches}
+    assert by_name["bad.txt"] == "latin-1 needle caf�"
+    assert by_name["good.txt"] == "needle in utf-8 ✓"
+    assert by_name["caf\udce9.txt"] == "needle"
@@ -0,0 +1,143 @@
+import os
+import time
+from utils import with_temp_dir, create_text_file
+from notesnv import search
+from notesnv.index import NoteIndex
+from notesnv.postings import decode_postings
+from notesnv.segments import (
+    SegmentMerger,
+    catch_up,
+    merge_segments,
+    new_segment,
+    pick_merge,
+    MERGE_FACTOR,
+)
+
+NOTES = [(f"note{i}.txt", f"fruit number {i}") for i in range(20)]
+
+
+def built_index(path, memory_budget=None):
+    index = NoteIndex(path, ["txt"], memory_budget=memory_budget)
+    index.build()
+    return index
+
+
+def content_matches(path, index, query):
+    return sorted(
+        m.filename for m in search.search_notes(path, ["txt"], query, index=index)
+    )
+
+
+def segment(first_id, notes, deleted=0):
+    filenames_by_id = {first_id + i: f"{first_id + i}.txt" for i in range(notes)}
+    return new_segment(first_id)._replace(
+        filenames_by_id=filenames_by_id, deleted=set(list(filenames_by_id)[:deleted])
+    )
+
+
+def test_pick_merge():
+    assert pick_merge([segment(1, 100)]) is None
+    small = [segment(101 + i, 1) for i in range(MERGE_FACTOR)]
+    assert pick_merge([segment(1, 100)] + small[:-1]) is None
+    assert pick_merge([segment(1, 100)] + small) == (1, 1 + MERGE_FACTOR)
+    # Mostly tombstones
+    assert pick_merge([segment(1, 100, deleted=40)] + small) == (0, 1)
+
+
+@with_temp_dir(NOTES)
+def test_updates_dont_copy_segments(path):
+    index = built_index(path)
+    (base,) = index.snapshot.segments
+    create_text_file(path, "new.txt", "fruit salad")
+    index.update_note("new.txt")
+    os.remove(os.path.join(path, "note3.txt"))
+    index.update_note("note3.txt")
+    first, added = index.snapshot.segments
+    assert first.notes is base.notes and first.postings is base.postings
+    assert first.deleted == {base.notes["note3.txt"].doc_id}
+    assert not base.deleted
+    assert list(added.notes) == ["new.txt"]
+    assert len(index) == 20
+    assert content_matches(path, index, "salad") == ["new.txt"]
+    assert "note3.txt" not in content_matches(path, index, "number")
+
+
+@with_temp_dir(NOTES)
+def test_merge_drops_deleted_notes(path):
+    index = built_index(path)
+    for i in range(MERGE_FACTOR * 2):
+        create_text_file(path, f"note{i}.txt", f"fruit edited {i}")
+        index.update_note(f"note{i}.txt")
+    assert len(index.snapshot.segments) == 1 + MERGE_FACTOR * 2
+    while index.merge():
+        pass
+    segments = index.snapshot.segments
+    assert len(segments) < 1 + MERGE_FACTOR
+    for merged in segments:
+        assert len(merged.deleted) <= 0.3 * len(merged.filenames_by_id)
+    live = {note.doc_id for note in index.snapshot.iter_notes()}
+    fruit = index.note_ids("fruit")
+    assert len(fruit) - len(set(fruit) - live) == 20
+    assert content_matches(path, index, "edited") == sorted(
+        f"note{i}.txt" for i in range(MERGE_FACTOR * 2)
+    )
+    assert content_matches(path, index, "number 19") == ["note19.txt"]
+
+
+@with_temp_dir(NOTES)
+def test_merge_keeps_deletions_made_meanwhile(path):
+    index = built_index(path)
+    create_text_file(path, "new.txt", "fruit salad")
+    index.update_note("new.txt")
+    before = index.snapshot.segments
+    merged = merge_segments(before)
+    os.remove(os.path.join(path, "new.txt"))
+    index.update_note("new.txt")
+    catch_up(merged, before, index.snapshot.segments)
+    assert merged.deleted == {before[1].notes["new.txt"].doc_id}
+    postings = decode_postings(merged.postings["salad"])
+    assert postings == [before[1].notes["new.txt"].doc_id]
+
+
+@with_temp_dir(NOTES)
+def test_merge_spilled_segments(path):
+    index = built_index(path, memory_budget=1)
+    for i in range(MERGE_FACTOR):
+        create_text_file(path, f"note{i}.txt", f"fruit edited {i}")
+        index.update_note(f"note{i}.txt")
+    assert any(s.spilled for s in index.snapshot.segments)
+    spilled_terms = {
+        s.spilled.term(ordinal)
+        for s in index.snapshot.segments
+        if s.spilled
+        for ordinal in range(len(s.spilled))
+    }
+    spilled_terms.difference_update(
+        *(s.postings for s in index.snapshot.segments)
+    )
+    while index.merge():
+        pass
+    # Spilled lists are merged on disk, not read back into memory
+    for merged in index.snapshot.segments:
+        assert not spilled_terms & set(merged.postings)
+        assert merged.spilled
+    assert content_matches(path, index, "edited 7") == ["note7.txt"]
+    assert content_matches(path, index, "number 19") == ["note19.txt"]
+
+
+@with_temp_dir(NOTES)
+def test_segment_merger(path):
+    index = built_index(path)
+    merger = SegmentMerger(index)
+    merger.start()
+    for i in range(MERGE_FACTOR):
+        os.remove(os.path.join(path, f"note{i}.txt"))
+        index.update_note(f"note{i}.txt")
+    deadline = time.monotonic() + 5
+    while index.snapshot.segments[0].deleted and time.monotonic() < deadline:
+        time.sleep(0.01)
+    merger.stop()
+    merger.thread.join(5)
+    assert not merger.thread.is_alive()
+    assert not index.snapshot.segments[0].deleted
+    assert len(index) == 20 - MERGE_FACTOR